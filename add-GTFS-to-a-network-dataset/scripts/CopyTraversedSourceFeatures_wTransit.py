@@ -32,8 +32,8 @@ produced containing only the transit edges.
    limitations under the License.'''
 ################################################################################
 
-import arcpy, os, sqlite3, datetime
-import hms
+import arcpy, os, datetime
+import hms, sqltrace
 
 class CustomError(Exception):
     pass
@@ -332,7 +332,8 @@ repair your transit network or choose a different layer." % naGDB)
                 junction_source_dict[junc.name] = junc.sourceID
 
         # Connect to the SQL database
-        conn = sqlite3.connect(SQLDbase)
+        sqltrace.Reset()
+        conn = sqltrace.connect(SQLDbase)
         c = conn.cursor()
 
         # Determine if we have the correct tables
@@ -770,6 +771,10 @@ but the table need only be indexed once, and future runs of this tool will be fa
         arcpy.AddMessage("- " + Turns)
         arcpy.AddMessage("- " + TransitEdges)
 
+        SQLReport = sqltrace.FormatReport()
+        if SQLReport:
+            arcpy.AddMessage(SQLReport)
+
     except Exception as e:
         raise
 
@@ -26,9 +26,9 @@ dataset for schedule lookups.'''
    limitations under the License.'''
 ################################################################################
 
-import sqlite3, os, operator, itertools, csv, re
+import os, operator, itertools, csv, re
 import arcpy
-import sqlize_csv, hms
+import sqlize_csv, hms, sqltrace
 
 class CustomError(Exception):
     pass
@@ -99,6 +99,7 @@ try:
     # The main SQLizing work is done in the sqlize_csv module
     # written by Luitien Pan for GTFS_NATools.
     # Connect to or create the SQL file.
+    sqltrace.Reset()
     sqlize_csv.connect(SQLDbase)
     # Create tables.
     for tblname in sqlize_csv.sql_schema:
@@ -124,7 +125,7 @@ try:
 # ----- Connect to SQL locally for further queries and entries -----
 
     # Connect to the SQL database
-    conn = sqlite3.connect(SQLDbase)
+    conn = sqltrace.connect(SQLDbase)
     c = conn.cursor()
 
 
@@ -547,6 +548,10 @@ these stops will be ignored. " + unicode(badStops))
     arcpy.AddMessage("Your transit lines feature class is:")
     arcpy.AddMessage("- " + outLinesFC)
 
+    SQLReport = sqltrace.FormatReport()
+    if SQLReport:
+        arcpy.AddMessage(SQLReport)
+
 except CustomError:
     arcpy.AddError("Failed to generate transit lines and stops.")
     pass
@@ -20,8 +20,8 @@ schedule information to a text file for easier reading.'''
    limitations under the License.'''
 ################################################################################
 
-import arcpy, sqlite3, os, operator, codecs
-import hms
+import arcpy, os, operator, codecs
+import hms, sqltrace
 
 class CustomError(Exception):
     pass
@@ -44,7 +44,8 @@ user's guide.")
     SQLDbase = os.path.join(os.path.dirname(os.path.dirname(TransitLines.dataSource)), "GTFS.sql")
 
     # Connect to the SQL database
-    conn = sqlite3.connect(SQLDbase)
+    sqltrace.Reset()
+    conn = sqltrace.connect(SQLDbase)
     c = conn.cursor()
 
     # ----- Check if the schedules table is indexed and index it if not -----
@@ -143,6 +144,10 @@ but the table need only be indexed once, and future runs of this tool will be fa
             if outFile:
                 f.write(prettyPrint)
 
+    SQLReport = sqltrace.FormatReport()
+    if SQLReport:
+        arcpy.AddMessage(SQLReport)
+
 
 except CustomError:
     arcpy.AddError("Failed to retrieve transit edge schedule information.")
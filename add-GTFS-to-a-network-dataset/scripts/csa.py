@@ -0,0 +1,372 @@
+################################################################################
+# csa.py
+# Earliest arrival transit routing with the Connection Scan Algorithm.
+# Last updated: 18 October 2026
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+# Finds the earliest arrival time at every stop from one or more origin stops
+# with the Connection Scan Algorithm (Dibbelt, Pajor, Strasser, and Wagner
+# 2013), using the schedules and linefeatures tables that Generate Transit Lines
+# and Stops adds to the GTFS SQL database, without solving the network dataset.
+# It doesn't use arcpy.
+#
+# Each row of schedules is a connection: a trip leaving from_stop at start_time
+# and arriving at to_stop at end_time without stopping in between.  The
+# connections of the trips running on a date are sorted by departure time and
+# stored in contiguous arrays.  The trips from the day before that are still
+# running after midnight are shifted to the date's time of day.  Frequency-based
+# trips have one row per headway for each line with the same trip_id, so their
+# connections are split into one trip per headway by their order on each line.
+#
+# A one-to-all query scans the connections once, starting at the departure
+# time: a connection can be used if its trip was already used or its stop was
+# reached by then.  A profile query finds the earliest arrivals for every
+# departure from the origins in a time window, by scanning again for each
+# departure time from the latest to the earliest and keeping the arrival times
+# from the later departures, so only the stops that can be reached earlier by
+# leaving earlier are updated.
+#
+# Connections that arrive at the same time they leave (consecutive stops with
+# the same scheduled time) can feed connections leaving that same second that
+# were sorted before them, so the connections leaving at such a time are
+# scanned again until no arrival time improves.  A trip only carries
+# passengers on from the first of its connections they boarded, and its
+# connections leaving at the same time are sorted in the order it rides them.
+#
+# Passengers only transfer between trips at the same stop.  Walking between
+# stops is left to the network dataset.
+################################################################################
+
+import sys, array, bisect, datetime, itertools
+
+try:
+    from itertools import izip
+except ImportError:
+    # Python 3
+    izip = zip
+
+SecsInDay = 86400
+weekdays = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+# Arrival time of the stops that can't be reached
+Unreachable = 2 ** 31 - 1
+
+
+def GetTableNames(c):
+    '''Return a list of the tables in the SQL database.'''
+    c.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    return [table[0] for table in c.fetchall()]
+
+
+def MakeServiceIDList(c, date):
+    '''Find the service ids running on a date (a datetime.date) from the
+    calendar and calendar_dates tables.'''
+
+    datestring = date.strftime("%Y%m%d")
+    tables = GetTableNames(c)
+    SIDList = set()
+    if "calendar" in tables:
+        GetServiceIDstmt = '''
+            SELECT service_id FROM calendar
+            WHERE %s == 1 AND start_date <= ? AND end_date >= ?
+            ;''' % weekdays[date.weekday()]
+        c.execute(GetServiceIDstmt, (datestring, datestring))
+        SIDList = set([SID[0] for SID in c.fetchall()])
+    if "calendar_dates" in tables:
+        GetServiceIDstmt = '''
+            SELECT service_id, exception_type FROM calendar_dates
+            WHERE date == ?
+            ;'''
+        c.execute(GetServiceIDstmt, (datestring,))
+        for SID in c.fetchall():
+            if SID[1] == 2:
+                SIDList.discard(SID[0])
+            elif SID[1] == 1:
+                SIDList.add(SID[0])
+    return SIDList
+
+
+def OrderLegs(legs):
+    '''Order a list of (from stop, to stop, connection) legs of a trip that
+    leave at the same time along the trip, following each leg's to stop to the
+    next leg's from stop.'''
+
+    remaining = list(legs)
+    ordered = []
+    stop = None
+    while remaining:
+        nextlegs = [leg for leg in remaining if leg[0] == stop]
+        if not nextlegs:
+            to_stops = set(leg[1] for leg in remaining)
+            nextlegs = [leg for leg in remaining if leg[0] not in to_stops] or remaining
+        leg = nextlegs[0]
+        remaining.remove(leg)
+        ordered.append(leg)
+        stop = leg[1]
+    return ordered
+
+
+class ConnectionTimetable(object):
+    '''The connections of the trips running on a date, sorted by departure
+    time.  Connection i leaves stop from_stops[i] at departures[i] and arrives
+    at stop to_stops[i] at arrivals[i] on trip trips[i].  The stops are
+    referred to by their index in stopids, and the trips by a number.'''
+
+    def __init__(self, c, date):
+        '''Load the connections running on a date (a datetime.date) with the
+        cursor c of a GTFS SQL database made by Generate Transit Lines and
+        Stops.'''
+
+        SIDs_today = MakeServiceIDList(c, date)
+        SIDs_yest = MakeServiceIDList(c, date - datetime.timedelta(days=1))
+
+        c.execute("SELECT trip_id, service_id FROM trips;")
+        trip_service_dict = dict(c.fetchall())
+        frequency_trips = set()
+        if "frequencies" in GetTableNames(c):
+            c.execute("SELECT DISTINCT trip_id FROM frequencies;")
+            frequency_trips = set([trip[0] for trip in c.fetchall()])
+
+        self.stopids = []
+        self.stopindexdict = {}
+        def GetStopIndex(stop_id):
+            try:
+                return self.stopindexdict[stop_id]
+            except KeyError:
+                stopindex = self.stopindexdict[stop_id] = len(self.stopids)
+                self.stopids.append(stop_id)
+                return stopindex
+
+        tripindexdict = {} # {(trip_id, day, headway number): trip index}
+        connections = []
+        scheduleFetch = '''
+            SELECT schedules.SourceOID, trip_id, start_time, end_time, from_stop, to_stop
+            FROM schedules JOIN linefeatures ON schedules.SourceOID == linefeatures.SourceOID
+            ;'''
+        c.execute(scheduleFetch)
+        frequency_rows = []
+        for row in c:
+            try:
+                service_id = trip_service_dict[row[1]]
+            except KeyError:
+                continue
+            if row[1] in frequency_trips:
+                frequency_rows.append(row)
+                continue
+            self.AddConnection(connections, tripindexdict, GetStopIndex,
+                        service_id, SIDs_today, SIDs_yest, row, (row[1],))
+
+        # The connections of a frequency-based trip on each line, in order of
+        # departure, belong to the trip's first, second, ... headway.
+        frequency_rows.sort()
+        for idx, row in enumerate(frequency_rows):
+            if idx == 0 or frequency_rows[idx - 1][:2] != row[:2]:
+                headway = 0
+            else:
+                headway += 1
+            self.AddConnection(connections, tripindexdict, GetStopIndex,
+                        trip_service_dict[row[1]], SIDs_today, SIDs_yest, row, (row[1], headway))
+
+        # Connections of a trip that leave and arrive at the same time are
+        # sorted in the order the trip rides them.
+        sequences = [0] * len(connections)
+        bytrip = sorted(range(len(connections)),
+                        key=lambda conn: (connections[conn][4], connections[conn][0], connections[conn][1]))
+        for key, group in itertools.groupby(bytrip,
+                        key=lambda conn: (connections[conn][4], connections[conn][0], connections[conn][1])):
+            group = list(group)
+            if len(group) > 1 and key[1] == key[2]:
+                legs = [(connections[conn][2], connections[conn][3], conn) for conn in group]
+                for sequence, leg in enumerate(OrderLegs(legs)):
+                    sequences[leg[2]] = sequence
+        connections = sorted((conn[0], conn[1], sequence) + conn[2:]
+                             for conn, sequence in izip(connections, sequences))
+        self.numtrips = len(tripindexdict)
+        self.departures = array.array('i', [conn[0] for conn in connections])
+        self.arrivals = array.array('i', [conn[1] for conn in connections])
+        self.from_stops = array.array('i', [conn[3] for conn in connections])
+        self.to_stops = array.array('i', [conn[4] for conn in connections])
+        self.trips = array.array('i', [conn[5] for conn in connections])
+
+        # The ranges of connections leaving at the same time as a connection
+        # that arrives when it leaves
+        self.zeroblockstarts = array.array('i')
+        self.zeroblockends = array.array('i')
+        for departure, arrival in izip(self.departures, self.arrivals):
+            if departure == arrival and (not self.zeroblockstarts or
+                        self.departures[self.zeroblockstarts[-1]] != departure):
+                self.zeroblockstarts.append(bisect.bisect_left(self.departures, departure))
+                self.zeroblockends.append(bisect.bisect_right(self.departures, departure))
+
+
+    def AddConnection(self, connections, tripindexdict, GetStopIndex, service_id,
+                      SIDs_today, SIDs_yest, row, tripkey):
+        '''Add a row of the schedules table to the list of connections as
+        (departure, arrival, from stop, to stop, trip) for each day its trip
+        runs on: today, and yesterday if it's still running after midnight.'''
+
+        SourceOID, trip_id, start_time, end_time, from_stop, to_stop = row
+        start_time = int(round(start_time))
+        end_time = int(round(end_time))
+        for day, SIDs, shift in (("today", SIDs_today, 0), ("yesterday", SIDs_yest, SecsInDay)):
+            if service_id not in SIDs or start_time < shift:
+                continue
+            try:
+                trip = tripindexdict[(day,) + tripkey]
+            except KeyError:
+                trip = tripindexdict[(day,) + tripkey] = len(tripindexdict)
+            connections.append((start_time - shift, end_time - shift,
+                                GetStopIndex(from_stop), GetStopIndex(to_stop), trip))
+
+
+    def GetOrigins(self, origins):
+        '''Return a list of (stop index, access time) for a list of origin
+        stop_ids or a dictionary of {stop_id: seconds to get to the stop}.
+        Origins that no connection on the date leaves from or arrives at are
+        skipped with a warning.'''
+        if not isinstance(origins, dict):
+            origins = dict((stop_id, 0) for stop_id in origins)
+        originlist = []
+        for stop_id, accesstime in origins.items():
+            if stop_id not in self.stopindexdict:
+                sys.stderr.write("Origin stop %s has no service on this date, so it was skipped.\n" % stop_id)
+                continue
+            originlist.append((self.stopindexdict[stop_id], int(accesstime)))
+        return originlist
+
+
+    def ScanRange(self, best, ready, tripboarded, improved, first, last, TransferTime):
+        '''Scan connections first to last - 1 once, updating best, ready, and
+        tripboarded, the first connection each trip was boarded at, and adding
+        the stops whose arrival times improved to improved.  Returns True if
+        anything changed.'''
+
+        changed = False
+        for conn, departure, arrival, from_stop, to_stop, trip in izip(itertools.count(first),
+                    self.departures[first:last], self.arrivals[first:last],
+                    self.from_stops[first:last], self.to_stops[first:last],
+                    self.trips[first:last]):
+            if tripboarded[trip] <= conn or ready[from_stop] <= departure:
+                if conn < tripboarded[trip]:
+                    tripboarded[trip] = conn
+                    changed = True
+                if arrival < best[to_stop]:
+                    best[to_stop] = arrival
+                    ready[to_stop] = arrival + TransferTime
+                    improved.append(to_stop)
+                    changed = True
+        return changed
+
+
+    def Scan(self, best, ready, departure_time, end_time, TransferTime):
+        '''Scan the connections leaving from departure_time to end_time,
+        updating the arrival times in best and the times passengers can leave
+        each stop in ready.  Returns the list of stops whose arrival times
+        improved.'''
+
+        tripboarded = array.array('i', [Unreachable]) * self.numtrips
+        improved = []
+        first = bisect.bisect_left(self.departures, departure_time)
+        if end_time is None:
+            last = len(self.departures)
+        else:
+            last = bisect.bisect_right(self.departures, end_time)
+
+        # A connection arriving at the same time it leaves can lead to one
+        # leaving at that time that was sorted before it, so the connections
+        # leaving at that time are scanned again until nothing changes.
+        block = bisect.bisect_right(self.zeroblockstarts, first)
+        if block > 0 and self.zeroblockends[block - 1] > first:
+            block -= 1
+        for blockstart, blockend in izip(self.zeroblockstarts[block:], self.zeroblockends[block:]):
+            if blockstart >= last:
+                break
+            blockstart = max(blockstart, first)
+            blockend = min(blockend, last)
+            self.ScanRange(best, ready, tripboarded, improved, first, blockstart, TransferTime)
+            while self.ScanRange(best, ready, tripboarded, improved, blockstart, blockend, TransferTime):
+                pass
+            first = blockend
+        self.ScanRange(best, ready, tripboarded, improved, first, last, TransferTime)
+        return improved
+
+
+    def EarliestArrival(self, origins, departure_time, MaxTravelTime=None, TransferTime=0):
+        '''Find the earliest arrival time at every stop leaving from the origins
+        at departure_time (seconds since midnight).  origins is a list of
+        stop_ids, or a dictionary of {stop_id: seconds to get to the stop};
+        see GetOrigins().  Passengers need TransferTime seconds to change
+        trips at a stop.  If MaxTravelTime is given, only connections leaving
+        within that many seconds of departure_time are used.  Returns a list
+        of the arrival time at each stop, Unreachable for the stops that can't
+        be reached.'''
+
+        best = [Unreachable] * len(self.stopids)
+        for stop, accesstime in self.GetOrigins(origins):
+            best[stop] = min(best[stop], departure_time + accesstime)
+        ready = list(best)
+        end_time = None
+        if MaxTravelTime is not None:
+            end_time = departure_time + MaxTravelTime
+        self.Scan(best, ready, departure_time, end_time, TransferTime)
+        return best
+
+
+    def Profile(self, origins, start_time, end_time, MaxTravelTime=None, TransferTime=0):
+        '''Find the earliest arrival time at every stop for every departure
+        from the origins between start_time and end_time.  origins,
+        MaxTravelTime, and TransferTime are like for EarliestArrival().
+        Returns a dictionary of {stop_id: [(departure time, arrival time), ...]}
+        sorted by departure time, where leaving at any time up to a departure
+        time gets to the stop by its arrival time.  A departure time is when
+        passengers leave for the origin, so it's the time of a trip leaving an
+        origin minus the time to get to the origin.'''
+
+        origins = self.GetOrigins(origins)
+
+        # The times when leaving makes a difference: just in time for each trip
+        # leaving an origin in the time window
+        departure_times = set()
+        originaccess = {}
+        for stop, accesstime in origins:
+            originaccess.setdefault(stop, []).append(accesstime)
+        first = bisect.bisect_left(self.departures, start_time)
+        last = bisect.bisect_right(self.departures, end_time + max([0] + [accesstime for stop, accesstime in origins]))
+        for conn in range(first, last):
+            for accesstime in originaccess.get(self.from_stops[conn], []):
+                if start_time <= self.departures[conn] - accesstime <= end_time:
+                    departure_times.add(self.departures[conn] - accesstime)
+
+        best = [Unreachable] * len(self.stopids)
+        ready = list(best)
+        profiles = {} # {stop index: [(departure time, arrival time), ...]}
+        for departure_time in sorted(departure_times, reverse=True):
+            # The arrival times for the later departures can still be reached,
+            # so only the stops reached earlier than that are updated.
+            for stop, accesstime in origins:
+                best[stop] = min(best[stop], departure_time + accesstime)
+                ready[stop] = min(ready[stop], departure_time + accesstime)
+            scan_end = None
+            if MaxTravelTime is not None:
+                scan_end = departure_time + MaxTravelTime
+            for stop in set(self.Scan(best, ready, departure_time, scan_end, TransferTime)):
+                profiles.setdefault(stop, []).append((departure_time, best[stop]))
+
+        return dict((self.stopids[stop], profile[::-1]) for stop, profile in profiles.items())
+
+
+    def MakeArrivalDict(self, arrivals):
+        '''Return a dictionary of {stop_id: arrival time} for the stops that can
+        be reached, from the arrival times returned by EarliestArrival().'''
+        return dict((self.stopids[stop], arrival) for stop, arrival in
+                    enumerate(arrivals) if arrival < Unreachable)
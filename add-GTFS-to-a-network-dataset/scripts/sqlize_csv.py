@@ -37,9 +37,9 @@ import os
 import re
 import sqlite3
 import sys
-import arcpy
 
 import hms
+import sqltrace
 
 
 class CustomError(Exception):
@@ -150,10 +150,12 @@ sql_schema = {
 db = None
 
 
-def connect(dbname):
+def connect(dbname, trace=None):
+    '''Connect to the SQL database. The statements are traced if trace is True,
+    or by default if the GTFS_SQL_TRACE environment variable is set.'''
     global db
     if db == None:
-        db = sqlite3.connect(dbname)
+        db = sqltrace.connect(dbname, trace)
 
 
 def check_time_str(s):
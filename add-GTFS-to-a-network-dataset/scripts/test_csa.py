@@ -0,0 +1,94 @@
+################################################################################
+# test_csa.py
+# Checks for the Connection Scan Algorithm engine in csa.py.
+# Last updated: 18 October 2026
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+# Run with python -m unittest test_csa from this folder.  It builds a small
+# in-memory GTFS SQL database with the schedules and linefeatures tables, so it
+# doesn't need arcpy or a real feed.
+################################################################################
+
+import datetime, sqlite3, unittest
+
+import csa
+
+# A Tuesday
+date = datetime.date(2026, 10, 20)
+
+
+def MakeDatabase(trips):
+    '''Make an in-memory database with one trip running every day for each
+    item of trips, a list of [(from_stop, to_stop, start_time, end_time), ...].'''
+
+    conn = sqlite3.connect(":memory:")
+    c = conn.cursor()
+    c.execute('''CREATE TABLE calendar (service_id TEXT, monday INT, tuesday INT,
+                    wednesday INT, thursday INT, friday INT, saturday INT, sunday INT,
+                    start_date TEXT, end_date TEXT);''')
+    c.execute("INSERT INTO calendar VALUES ('all', 1, 1, 1, 1, 1, 1, 1, '20260101', '20261231');")
+    c.execute("CREATE TABLE trips (trip_id TEXT, service_id TEXT);")
+    c.execute('''CREATE TABLE linefeatures (SourceOID INT, from_stop TEXT, to_stop TEXT,
+                    route_type INT, eid INT);''')
+    c.execute("CREATE TABLE schedules (SourceOID INT, trip_id TEXT, start_time REAL, end_time REAL);")
+    SourceOIDs = {}
+    for tripnum, legs in enumerate(trips):
+        trip_id = "trip%d" % tripnum
+        c.execute("INSERT INTO trips VALUES (?, 'all');", (trip_id,))
+        for from_stop, to_stop, start_time, end_time in legs:
+            if (from_stop, to_stop) not in SourceOIDs:
+                SourceOIDs[(from_stop, to_stop)] = len(SourceOIDs) + 1
+                c.execute("INSERT INTO linefeatures VALUES (?, ?, ?, 3, 0);",
+                          (SourceOIDs[(from_stop, to_stop)], from_stop, to_stop))
+            c.execute("INSERT INTO schedules VALUES (?, ?, ?, ?);",
+                      (SourceOIDs[(from_stop, to_stop)], trip_id, start_time, end_time))
+    return c
+
+
+class TestZeroDurationConnections(unittest.TestCase):
+
+    def test_transfer_between_zero_duration_connections(self):
+        # B -> C sorts before A -> B, but can only be reached through it.
+        c = MakeDatabase([[("A", "B", 28860, 28860)], [("B", "C", 28860, 28860)]])
+        timetable = csa.ConnectionTimetable(c, date)
+        arrivals = timetable.MakeArrivalDict(timetable.EarliestArrival(["A"], 28000))
+        self.assertEqual(arrivals, {"A": 28000, "B": 28860, "C": 28860})
+
+    def test_zero_duration_connections_of_one_trip(self):
+        c = MakeDatabase([[("D", "C", 28860, 28860), ("C", "B", 28860, 28860), ("B", "A", 28860, 28920)]])
+        timetable = csa.ConnectionTimetable(c, date)
+        arrivals = timetable.MakeArrivalDict(timetable.EarliestArrival(["D"], 28000, TransferTime=120))
+        self.assertEqual(arrivals, {"D": 28000, "C": 28860, "B": 28860, "A": 28920})
+
+    def test_no_riding_back_along_a_trip(self):
+        c = MakeDatabase([[("A", "B", 28860, 28860), ("B", "C", 28860, 28860)]])
+        timetable = csa.ConnectionTimetable(c, date)
+        arrivals = timetable.MakeArrivalDict(timetable.EarliestArrival(["B"], 28000))
+        self.assertEqual(arrivals, {"B": 28000, "C": 28860})
+
+    def test_transfer_time_still_applies(self):
+        c = MakeDatabase([[("A", "B", 28860, 28860)], [("B", "C", 28860, 28860)]])
+        timetable = csa.ConnectionTimetable(c, date)
+        arrivals = timetable.MakeArrivalDict(timetable.EarliestArrival(["A"], 28000, TransferTime=60))
+        self.assertEqual(arrivals, {"A": 28000, "B": 28860})
+
+    def test_profile(self):
+        c = MakeDatabase([[("A", "B", 28860, 28860)], [("B", "C", 28860, 28860)],
+                          [("A", "B", 30000, 30000)], [("B", "C", 30000, 30060)]])
+        timetable = csa.ConnectionTimetable(c, date)
+        profiles = timetable.Profile(["A"], 28000, 31000)
+        self.assertEqual(profiles["C"], [(28860, 28860), (30000, 30060)])
+
+
+if __name__ == '__main__':
+    unittest.main()
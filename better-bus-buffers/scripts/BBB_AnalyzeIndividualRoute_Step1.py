@@ -17,6 +17,9 @@ between subsequent trips, and the average headway.
 
 Step 1 - Preprocess Route Buffers creates the service areas around the stops.
 The trip count information is filled in Step 2.
+
+In batch mode, Step 1 creates the output for every route, or every route of the
+chosen GTFS route_types, in one run.
 '''
 ################################################################################
 '''Copyright 2015 Esri
@@ -32,9 +35,10 @@ The trip count information is filled in Step 2.
 ################################################################################
 
 
-import os, sqlite3
+import os
 import arcpy
 import BBB_SharedFunctions
+from bbb_core import profiling
 
 class CustomError(Exception):
     pass
@@ -44,6 +48,7 @@ conn = None
 
 
 try:
+    profiling.Start("Analyze Individual Route - Step 1")
     # ------ Get input parameters and set things up. -----
     try:
         #Check out the Network Analyst extension license
@@ -87,8 +92,14 @@ try:
             TrimPolys = "NO_TRIM_POLYS"
             TrimPolysValue = ""
 
-        ArcVersionInfo = arcpy.GetInstallInfo("desktop")
-        ArcVersion = BBB_SharedFunctions.ArcVersion = ArcVersionInfo['Version']
+        # Optional batch mode: analyze every route ("ALL"), or every route of
+        # the GTFS route_types given as a semicolon-separated list ("3;0"), in
+        # one run instead of the single route in RouteText.
+        BatchRouteTypes = ""
+        if arcpy.GetArgumentCount() > 9:
+            BatchRouteTypes = arcpy.GetParameterAsText(9).strip()
+
+        ArcVersion = BBB_SharedFunctions.DetermineArcVersion()
 
         OverwriteOutput = arcpy.env.overwriteOutput # Get the orignal value so we can reset it.
         arcpy.env.overwriteOutput = True
@@ -101,102 +112,165 @@ try:
         raise
 
 
-    # ===== Get trips and stops associated with this route =====
+    # ===== Get trips and stops associated with the routes =====
 
-    # ----- Figure out which route the user wants to analyze based on the text input -----
+    # ----- Figure out which routes the user wants to analyze -----
     try:
 
         arcpy.AddMessage("Gathering route, trip, and stop information...")
 
-        # Connect to or create the SQL file.
-        conn = sqlite3.connect(SQLDbase)
-        c = BBB_SharedFunctions.c = conn.cursor()
-
-        # Get list of routes in the GTFS data
-        routefetch = "SELECT route_short_name, route_long_name, route_id FROM routes;"
-        c.execute(routefetch)
-        routestuff = c.fetchall()
-        # Extract the route_id based on what the user picked from the GUI list
-        # It's better to do it by searching the database instead of trying to extract
-        # the route_id from the text they chose because we don't know what kind of
-        # characters will be in the route names and id, so parsing could be unreliable
-        route_id = ""
-        for route in routestuff:
-            routecheck = route[0] + ": " + route[1] + " [" + route[2] + "]"
-            if routecheck == RouteText:
-                route_id = route[2]
-                route_short_name = route[0]
-                break
-
-        if not route_id:
-            arcpy.AddError("Could not parse route selection.")
-            raise CustomError
+        with profiling.Stage("Get route stops") as stage:
+            # Connect to or create the SQL file.
+            conn = BBB_SharedFunctions.ConnectToSQLDatabase(SQLDbase)
+            c = BBB_SharedFunctions.c
+
+            routes = {} # {route_id: route_short_name}
+            if BatchRouteTypes:
+                # Batch mode: analyze every route, or every route of the chosen route_types
+                if BatchRouteTypes.upper() == "ALL":
+                    routetypes = None
+                else:
+                    try:
+                        routetypes = [int(routetype) for routetype in BatchRouteTypes.replace(",", ";").split(";") if routetype.strip()]
+                    except ValueError:
+                        arcpy.AddError("The route types must be ALL or a list of GTFS \
+route_type values separated by semicolons, like 3;0.")
+                        raise CustomError
+                routefetch = "SELECT route_id, route_short_name, route_type FROM routes;"
+                c.execute(routefetch)
+                for route in c.fetchall():
+                    if routetypes is None or route[2] in routetypes:
+                        routes[route[0]] = route[1]
+                if not routes:
+                    arcpy.AddError("There are no routes of the route types you \
+selected (%s) in the GTFS data." % BatchRouteTypes)
+                    raise CustomError
 
-        # Name feature classes
-        outStopsname = "Stops_" + route_short_name
-        outPolysname = "Buffers_" + route_short_name
+            else:
+                # Get list of routes in the GTFS data
+                routefetch = "SELECT route_short_name, route_long_name, route_id FROM routes;"
+                c.execute(routefetch)
+                routestuff = c.fetchall()
+                # Extract the route_id based on what the user picked from the GUI list
+                # It's better to do it by searching the database instead of trying to extract
+                # the route_id from the text they chose because we don't know what kind of
+                # characters will be in the route names and id, so parsing could be unreliable
+                for route in routestuff:
+                    routecheck = route[0] + ": " + route[1] + " [" + route[2] + "]"
+                    if routecheck == RouteText:
+                        routes[route[2]] = route[0]
+                        break
+
+                if not routes:
+                    arcpy.AddError("Could not parse route selection.")
+                    raise CustomError
+            stage.rows = len(routes)
 
     except Exception, err:
         arcpy.AddError("Error determining route_id for analysis.")
         raise
 
 
-    # ----- Get trips associated with route and split into directions -----
+    # ----- Get list of stops served by the routes in each direction -----
     try:
         # Some GTFS datasets use the same route_id to identify trips traveling in
         # either direction along a route. Others identify it as a different route.
         # We will consider each direction separately if there is more than one.
+        # If a stop is used for trips going in both directions, count them separately.
+
+        # Select the unique set of stops used by the trips of each route and
+        # direction in one query.
+        stopsfetch = '''SELECT DISTINCT trips.route_id, trips.direction_id, stop_times.stop_id
+                    FROM trips JOIN stop_times ON trips.trip_id = stop_times.trip_id'''
+        if BatchRouteTypes:
+            if routetypes is None:
+                c.execute(stopsfetch + ";")
+            else:
+                stopsfetch += ''' JOIN routes ON trips.route_id = routes.route_id
+                    WHERE routes.route_type IN (%s);''' % ", ".join(["?"] * len(routetypes))
+                c.execute(stopsfetch, routetypes)
+        else:
+            stopsfetch += " WHERE trips.route_id = ?;"
+            c.execute(stopsfetch, (list(routes)[0],))
+
+        stoplist = {} # {(route_id, direction_id): [stop_id, stop_id, ...]}
+        for routestop in c.fetchall():
+            stoplist.setdefault((routestop[0], routestop[1]), []).append(routestop[2])
 
-        # Get list of trips
-        trip_route_dict = {}
-        triproutefetch = '''
-            SELECT trip_id, direction_id FROM trips
-            WHERE route_id='%s'
-            ;''' % route_id
-        c.execute(triproutefetch)
-        triproutelist = c.fetchall()
-
-        if not triproutelist:
-            arcpy.AddError("There are no trips in the GTFS data for the route \
+        if not stoplist:
+            if BatchRouteTypes:
+                arcpy.AddError("There are no trips in the GTFS data for the \
+routes you have selected.")
+            else:
+                arcpy.AddError("There are no trips in the GTFS data for the route \
 you have selected (%s).  Please select a different route or fix your GTFS \
 dataset." % RouteText)
             raise CustomError
 
-        # Fill some dictionaries for use later.
-        trip_dir_dict = {} # {Direction: [trip_id, trip_id, ...]}
-        for triproute in triproutelist:
-            trip_dir_dict.setdefault(triproute[1], []).append(triproute[0])
-
-    except Exception, err:
-        arcpy.AddError("Error getting trips associated with route.")
-        raise
-
-
-    # ----- Get list of stops associated with trips and split into directions -----
-    try:
-        # If a stop is used for trips going in both directions, count them separately.
-
-        # Select unique set of stops used by trips in each direction
-        stoplist = {} # {Direction: [stop_id, stop_id, ...]}
-        for direction in trip_dir_dict:
-            stops = []
-            for trip in trip_dir_dict[direction]:
-                stopsfetch = '''SELECT stop_id FROM stop_times
-                            WHERE trip_id == ?'''
-                c.execute(stopsfetch, (trip,))
-                selectedstops = c.fetchall()
-                for stop in selectedstops:
-                    stops.append(stop[0])
-            stoplist[direction] = list(set(stops))
-
-        # If there is more than one direction, we will append the direction number
-        # to the output fc names, so add an _ here for prettiness.
-        if len(stoplist) > 1:
-            arcpy.AddMessage("Route %s contains trips going in more than one \
+        def MakeOutputNames(name, directions):
+            '''Return the validated output feature class names for a route
+            called name: [(direction_id, outStopsFC, outPolysFC)]'''
+            outStopsname = "Stops_" + name
+            outPolysname = "Buffers_" + name
+            # If there is more than one direction, we will append the direction number
+            # to the output fc names, so add an _ here for prettiness.
+            if len(directions) > 1:
+                outStopsname += "_"
+                outPolysname += "_"
+            names = []
+            for direction in directions:
+                outStopsFC = outStopsname
+                outPolysFC = outPolysname
+                if direction != None:
+                    outStopsFC += str(direction)
+                    outPolysFC += str(direction)
+                names.append((direction, arcpy.ValidateTableName(outStopsFC, outGDB),
+                              arcpy.ValidateTableName(outPolysFC, outGDB)))
+            return names
+
+        # Name the output feature classes for each route and direction:
+        # [(route_id, direction_id, outStopsFC, outPolysFC)]
+        outputs = []
+        # Validated names already used, in lower case because geodatabase names
+        # aren't case sensitive. Different short names like "10-A" and "10 A"
+        # can validate to the same name, and overwriteOutput is on, so one
+        # route's output would replace the other's.
+        usedfcnames = set()
+        routeids = sorted(set([rtdir[0] for rtdir in stoplist]))
+        for route_id in routeids:
+            directions = sorted([rtdir[1] for rtdir in stoplist if rtdir[0] == route_id])
+            # Use the route_id if the short name is missing or its names are
+            # already used by another route, and number it if those are too.
+            candidates = [route_id]
+            if routes[route_id]:
+                candidates.insert(0, routes[route_id])
+            suffix = 2
+            while True:
+                if candidates:
+                    route_short_name = candidates.pop(0)
+                else:
+                    route_short_name = "%s_%i" % (route_id, suffix)
+                    suffix += 1
+                names = MakeOutputNames(route_short_name, directions)
+                fcnames = [fc.lower() for name in names for fc in name[1:]]
+                if not usedfcnames.intersection(fcnames):
+                    break
+            usedfcnames.update(fcnames)
+            if routes[route_id] and route_short_name != routes[route_id]:
+                arcpy.AddMessage("The output names for route %s are already used by \
+another route, so its output is named after %s." % (routes[route_id], route_short_name))
+
+            if len(directions) > 1:
+                arcpy.AddMessage("Route %s contains trips going in more than one \
 direction. A separate feature class will be created for each direction, and the \
 GTFS direction_id will be appended to the feature class name." % route_short_name)
-            outStopsname += "_"
-            outPolysname += "_"
+
+            for direction, outStopsFC, outPolysFC in names:
+                outputs.append((route_id, direction, outStopsFC, outPolysFC))
+
+        if BatchRouteTypes:
+            arcpy.AddMessage("Creating output for %i routes (%i route and \
+direction combinations)." % (len(routeids), len(outputs)))
 
     except Exception, err:
         arcpy.AddError("Error getting stops associated with route.")
@@ -210,32 +284,31 @@ GTFS direction_id will be appended to the feature class name." % route_short_nam
 
         arcpy.AddMessage("Creating feature class of GTFS stops...")
 
-        for direction in stoplist:
-            stops = stoplist[direction]
-            outputname = outStopsname
-            if direction != None:
-                outputname += str(direction)
-            outStops = os.path.join(outGDB, outputname)
-
-            outStops, outStopList = BBB_SharedFunctions.MakeStopsFeatureClass(outStops, stops)
-
-            # Add a route_id and direction_id field and populate it
-            arcpy.management.AddField(outStops, "route_id", "TEXT")
-            arcpy.management.AddField(outStops, "direction_id", "TEXT")
-            fields = ["route_id", "direction_id"]
-            if ArcVersion == "10.0":
-                cursor = arcpy.UpdateCursor(outStops)
-                for row in cursor:
-                    row.setValue("route_id", route_id)
-                    row.setValue("direction_id", direction)
-                    cursor.updateRow(row)
-                del cursor
-            else:
-                with arcpy.da.UpdateCursor(outStops, fields) as cursor:
+        with profiling.Stage("Create stops feature classes") as stage:
+            for route_id, direction, outStopsFC, outPolysFC in outputs:
+                stops = stoplist[(route_id, direction)]
+                outStops = os.path.join(outGDB, outStopsFC)
+
+                outStops, outStopList = BBB_SharedFunctions.MakeStopsFeatureClass(outStops, stops)
+
+                # Add a route_id and direction_id field and populate it
+                arcpy.management.AddField(outStops, "route_id", "TEXT")
+                arcpy.management.AddField(outStops, "direction_id", "TEXT")
+                fields = ["route_id", "direction_id"]
+                if ArcVersion == "10.0":
+                    cursor = arcpy.UpdateCursor(outStops)
                     for row in cursor:
-                        row[0] = route_id
-                        row[1] = direction
+                        row.setValue("route_id", route_id)
+                        row.setValue("direction_id", direction)
                         cursor.updateRow(row)
+                    del cursor
+                else:
+                    with arcpy.da.UpdateCursor(outStops, fields) as cursor:
+                        for row in cursor:
+                            row[0] = route_id
+                            row[1] = direction
+                            cursor.updateRow(row)
+            stage.rows = len(outputs)
 
     except Exception, err:
         arcpy.AddError("Error creating feature class of GTFS stops.")
@@ -247,39 +320,58 @@ GTFS direction_id will be appended to the feature class name." % route_short_nam
 
         arcpy.AddMessage("Creating buffers around stops...")
 
-        for direction in stoplist:
-            outputname = outStopsname
-            if direction != None:
-                outputname += str(direction)
-            outStops = os.path.join(outGDB, outputname)
-
-            polygons = BBB_SharedFunctions.MakeServiceAreasAroundStops(outStops, inNetworkDataset, impedanceAttribute, BufferSize, restrictions, TrimPolys, TrimPolysValue)
-
-            # Join stop information to polygons and save as feature class
-            arcpy.management.AddJoin(polygons, "stop_id", outStops, "stop_id")
-            outPolys = outPolysname
-            if direction != None:
-                outPolys += str(direction)
-            outPolysFC = os.path.join(outGDB, outPolys)
-            arcpy.management.CopyFeatures(polygons, outPolysFC)
-
-            # Add a route_id and direction_id field and populate it
-            arcpy.management.AddField(outPolysFC, "route_id", "TEXT")
-            arcpy.management.AddField(outPolysFC, "direction_id", "TEXT")
-            fields = ["route_id", "direction_id"]
-            if ArcVersion == "10.0":
-                cursor = arcpy.UpdateCursor(outPolysFC)
-                for row in cursor:
-                    row.setValue("route_id", route_id)
-                    row.setValue("direction_id", direction)
-                    cursor.updateRow(row)
-                del cursor
-            else:
-                with arcpy.da.UpdateCursor(outPolysFC, fields) as cursor:
+        with profiling.Stage("Create buffers") as stage:
+            if len(outputs) > 1:
+                # Many stops are shared by several routes and directions, so solve
+                # the service area around each distinct stop only once.
+                allstops = set()
+                for stops in stoplist.values():
+                    allstops.update(stops)
+                TempStops = os.path.join(outGDB, "Temp_RouteStops")
+                TempPolys = os.path.join(outGDB, "Temp_RouteBuffers")
+                BBB_SharedFunctions.MakeStopsFeatureClass(TempStops, list(allstops))
+                polygons = BBB_SharedFunctions.MakeServiceAreasAroundStops(TempStops, inNetworkDataset, impedanceAttribute, BufferSize, restrictions, TrimPolys, TrimPolysValue)
+                arcpy.management.CopyFeatures(polygons, TempPolys)
+                stopidField = arcpy.AddFieldDelimiters(TempPolys, "stop_id")
+
+            for route_id, direction, outStopsFC, outPolysFC in outputs:
+                outStops = os.path.join(outGDB, outStopsFC)
+
+                if len(outputs) > 1:
+                    # Select the buffers around this route and direction's stops
+                    WhereClause = stopidField + " IN (" + ", ".join(["'" + stop_id.replace("'", "''") + "'"
+                                    for stop_id in stoplist[(route_id, direction)]]) + ")"
+                    polygons = arcpy.management.MakeFeatureLayer(TempPolys, "RouteBuffers", WhereClause).getOutput(0)
+                else:
+                    polygons = BBB_SharedFunctions.MakeServiceAreasAroundStops(outStops, inNetworkDataset, impedanceAttribute, BufferSize, restrictions, TrimPolys, TrimPolysValue)
+
+                # Join stop information to polygons and save as feature class
+                arcpy.management.AddJoin(polygons, "stop_id", outStops, "stop_id")
+                outPolysFC = os.path.join(outGDB, outPolysFC)
+                arcpy.management.CopyFeatures(polygons, outPolysFC)
+
+                # Add a route_id and direction_id field and populate it
+                arcpy.management.AddField(outPolysFC, "route_id", "TEXT")
+                arcpy.management.AddField(outPolysFC, "direction_id", "TEXT")
+                fields = ["route_id", "direction_id"]
+                if ArcVersion == "10.0":
+                    cursor = arcpy.UpdateCursor(outPolysFC)
                     for row in cursor:
-                        row[0] = route_id
-                        row[1] = direction
+                        row.setValue("route_id", route_id)
+                        row.setValue("direction_id", direction)
                         cursor.updateRow(row)
+                    del cursor
+                else:
+                    with arcpy.da.UpdateCursor(outPolysFC, fields) as cursor:
+                        for row in cursor:
+                            row[0] = route_id
+                            row[1] = direction
+                            cursor.updateRow(row)
+
+            if len(outputs) > 1:
+                arcpy.management.Delete(TempStops)
+                arcpy.management.Delete(TempPolys)
+            stage.rows = len(outputs)
 
     except Exception, err:
         arcpy.AddError("Error creating buffers around stops.")
@@ -288,12 +380,7 @@ GTFS direction_id will be appended to the feature class name." % route_short_nam
     arcpy.AddMessage("Done!")
     arcpy.AddMessage("Output written to %s is:" % outGDB)
     outFClist = []
-    for direction in stoplist:
-        outPolysFC = outPolysname
-        outStopsFC = outStopsname
-        if direction != None:
-            outStopsFC += str(direction)
-            outPolysFC += str(direction)
+    for route_id, direction, outStopsFC, outPolysFC in outputs:
         outFClist.append(outStopsFC)
         outFClist.append(outPolysFC)
         arcpy.AddMessage("- " + outStopsFC)
@@ -312,6 +399,8 @@ except Exception, err:
     raise
 
 finally:
+    # Show the timing of a run that failed or was canceled too.
+    profiling.Report()
     if OverwriteOutput:
         arcpy.env.overwriteOutput = OverwriteOutput
     arcpy.CheckInExtension("network")
\ No newline at end of file
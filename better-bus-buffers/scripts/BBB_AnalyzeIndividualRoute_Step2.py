@@ -31,9 +31,10 @@ Step 2: Count Trips for Route uses the template feature class created in Step
    limitations under the License.'''
 ################################################################################
 
-import os, sqlite3
+import os
 import arcpy
 import BBB_SharedFunctions
+from bbb_core import resultcache, headways, profiling
 
 OverwriteOutput = None
 
@@ -42,41 +43,21 @@ class CustomError(Exception):
 
 
 def RetrieveStatsForStop(stop_id, rtdirtuple):
-    '''For a given stop, query the stoptimedict {stop_id: [[trip_id, stop_time]]}
-    and return the NumTrips, NumTripsPerHr, MaxWaitTime, and AvgHeadway given a
-    specific route_id and direction'''
+    '''For a given stop, return the NumTrips, NumTripsPerHr, MaxWaitTime, and
+    AvgHeadway for a specific route_id and direction from the statistics
+    calculated for all the stops at once.'''
 
-    try:
-        stoptimedict = stoptimedict_rtdirpair[rtdirtuple]
-    except KeyError:
-        # We will get a KeyError if there were no trips found for the route/direction
-        # pair, which usually happens if the wrong SQL database was selected.
-        stoptimedict = {}
-
-    # Make a list of stop_times
-    StopTimesAtThisPoint = []
-    try:
-        for trip in stoptimedict[stop_id]:
-            StopTimesAtThisPoint.append(trip[1])
-    except KeyError:
-        pass
-    StopTimesAtThisPoint.sort()
-
-    # Calculate the number of trips
-    NumTrips = len(StopTimesAtThisPoint)
+    # Stops with no trips for the route/direction pair (which usually happens
+    # if the wrong SQL database was selected) have no entry.
+    NumTrips, MaxWaitTime, AvgHeadway = stopstatsdict.get((rtdirtuple, stop_id), (0, None, None))
     NumTripsPerHr = float(NumTrips) / TimeWindowLength
 
-    # Get the max wait time and the average headway
-    MaxWaitTime = BBB_SharedFunctions.CalculateMaxWaitTime(StopTimesAtThisPoint, start_sec, end_sec)
-    AvgHeadway = None
-    if NumTrips > 1:
-        AvgHeadway = int(round(float(sum(abs(x - y) for (x, y) in zip(StopTimesAtThisPoint[1:], StopTimesAtThisPoint[:-1]))/(len(StopTimesAtThisPoint)-1))/60, 0)) # minutes
-
     return NumTrips, NumTripsPerHr, MaxWaitTime, AvgHeadway
 
 
 #===== Main code =====
 try:
+    profiling.Start("Analyze Individual Route - Step 2")
     # ------ Get input parameters and set things up. -----
     try:
         # Stops and Polygons from Step 1 (any number and route combo)
@@ -102,8 +83,8 @@ fields %s. Please choose a valid feature class." % (FC, str(RequiredFields)))
 
         # SQL database of preprocessed GTFS from Step 1
         SQLDbase = arcpy.GetParameterAsText(1)
-        conn = sqlite3.connect(SQLDbase)
-        c = BBB_SharedFunctions.c = conn.cursor()
+        conn = BBB_SharedFunctions.ConnectToSQLDatabase(SQLDbase)
+        c = BBB_SharedFunctions.c
 
         # Day and time window to analyze
         DayOfWeek = arcpy.GetParameterAsText(2)
@@ -135,8 +116,7 @@ fields %s. Please choose a valid feature class." % (FC, str(RequiredFields)))
             DepOrArr = "departure_time"
 
         # Figure out what version of ArcGIS they're running
-        ArcVersionInfo = arcpy.GetInstallInfo("desktop")
-        ArcVersion = ArcVersionInfo['Version']
+        ArcVersion = BBB_SharedFunctions.DetermineArcVersion()
 
         OverwriteOutput = arcpy.env.overwriteOutput # Get the orignal value so we can reset it.
         arcpy.env.overwriteOutput = True
@@ -176,66 +156,82 @@ fields %s. Please choose a valid feature class." % (FC, str(RequiredFields)))
     try:
         arcpy.AddMessage("Getting list of trips...")
 
-        # Get the service_ids serving the correct days
-        serviceidlist, serviceidlist_yest, serviceidlist_tom, nonoverlappingsids = \
-            BBB_SharedFunctions.GetServiceIDListsAndNonOverlaps(DayOfWeek, start_sec, end_sec, DepOrArr)
-
-        trip_route_dict = {} #{(route_id, direction_id): [trip_id, trip_id,..]}
-        serviceids_used = []
-        for rtpair in route_dir_list:
-            key = tuple(rtpair)
-            route_id = rtpair[0]
-            direction_id = rtpair[1]
-
-            # Get list of trips
-            # Ignore direction if this route doesn't have a direction
-            if direction_id:
+        with profiling.Stage("Get trips") as stage:
+            # Get the service_ids serving the correct days
+            serviceidlist, serviceidlist_yest, serviceidlist_tom, nonoverlappingsids = \
+                BBB_SharedFunctions.GetServiceIDListsAndNonOverlaps(DayOfWeek, start_sec, end_sec, DepOrArr)
+
+            # service_ids running on the correct days
+            serviceids = set(serviceidlist) | set(serviceidlist_yest) | set(serviceidlist_tom)
+
+            # Get the trips of all the route/direction pairs in one query, in
+            # batches of pairs to stay under the SQL variable limit.
+            # Group the trips by route/direction pair. A trip matches the pairs for
+            # its route with its direction and with no direction.
+            pairtrips = {} # {(route_id, direction_id): [(trip_id, service_id), ...]}
+            for batchstart in range(0, len(route_dir_list), 200):
+                batch = set([tuple(rtpair) for rtpair in route_dir_list[batchstart:batchstart + 200]])
+                conditions = []
+                params = []
+                for route_id, direction_id in batch:
+                    # Ignore direction if this route doesn't have a direction
+                    if direction_id:
+                        conditions.append("(route_id = ? AND direction_id = ?)")
+                        params += [route_id, direction_id]
+                    else:
+                        conditions.append("route_id = ?")
+                        params.append(route_id)
                 triproutefetch = '''
-                    SELECT trip_id, service_id FROM trips
-                    WHERE route_id='%s'
-                    AND direction_id=%s
-                    ;''' % (route_id, direction_id)
-            else:
-                triproutefetch = '''
-                    SELECT trip_id, service_id FROM trips
-                    WHERE route_id='%s'
-                    ;''' % route_id
-            c.execute(triproutefetch)
-            triproutelist = c.fetchall()
-
-            if not triproutelist:
-                arcpy.AddWarning("Your GTFS dataset does not contain any trips \
+                    SELECT route_id, direction_id, trip_id, service_id FROM trips
+                    WHERE %s
+                    ;''' % " OR ".join(conditions)
+                c.execute(triproutefetch, params)
+                for route_id, direction_id, trip_id, service_id in c:
+                    for key in [(route_id, str(direction_id)), (route_id, None), (route_id, "")]:
+                        if key in batch:
+                            pairtrips.setdefault(key, []).append((trip_id, service_id))
+
+            trip_route_dict = {} #{(route_id, direction_id): [trip_id, trip_id,..]}
+            serviceids_used = set()
+            for rtpair in route_dir_list:
+                key = tuple(rtpair)
+                route_id = rtpair[0]
+                direction_id = rtpair[1]
+
+                triproutelist = pairtrips.get(key, [])
+                if not triproutelist:
+                    arcpy.AddWarning("Your GTFS dataset does not contain any trips \
 corresponding to Route %s and Direction %s. Please ensure that \
 you have selected the correct GTFS SQL file for this input file or that your \
 GTFS data is good. Output fields will be generated, but \
 the values will be 0 or <Null>." % (route_id, str(direction_id)))
 
-            for triproute in triproutelist:
-                # Only keep trips running on the correct day
-                if triproute[1] in serviceidlist or triproute[1] in serviceidlist_tom or triproute[1] in serviceidlist_yest:
-                    serviceids_used.append(triproute[1])
-                    trip_route_dict.setdefault(key, []).append(triproute[0])
+                for trip_id, service_id in triproutelist:
+                    # Only keep trips running on the correct day
+                    if service_id in serviceids:
+                        serviceids_used.add(service_id)
+                        trip_route_dict.setdefault(key, []).append(trip_id)
 
-            if not trip_route_dict:
-                arcpy.AddWarning("There is no service for route %s in direction %s \
+                if key not in trip_route_dict:
+                    arcpy.AddWarning("There is no service for route %s in direction %s \
 on %s during the time window you selected. Output fields will be generated, but \
 the values will be 0 or <Null>." % (route_id, str(direction_id), DayOfWeek))
 
-        # Give a warning for non-overlapping service_ids if necessary.
-        serviceids_used = list(set(serviceids_used))
-        nonoverlappingsids_used = []
-        for nonoverlap in nonoverlappingsids:
-            if nonoverlap[0] in serviceids_used and nonoverlap[1] in serviceids_used:
-                nonoverlappingsids_used.append(nonoverlap)
-        if nonoverlappingsids_used:
-            overlapwarning = "Warning! The service_ids used in counting trips \
+            # Give a warning for non-overlapping service_ids if necessary.
+            nonoverlappingsids_used = []
+            for nonoverlap in nonoverlappingsids:
+                if nonoverlap[0] in serviceids_used and nonoverlap[1] in serviceids_used:
+                    nonoverlappingsids_used.append(nonoverlap)
+            if nonoverlappingsids_used:
+                overlapwarning = "Warning! The service_ids used in counting trips \
 for this route and time window contain \
 non-overlapping date ranges. Your output might be double counting the number \
 of trips available. Please check the date ranges in your calendar.txt file(s). \
 See the User's Guide for further assistance.  Date ranges do not overlap in the \
 following pairs of service_ids used in \
 this analysis: " + str(nonoverlappingsids_used)
-            arcpy.AddWarning(overlapwarning)
+                arcpy.AddWarning(overlapwarning)
+            stage.rows = len(trip_route_dict)
 
 
     except Exception, err:
@@ -247,29 +243,53 @@ this analysis: " + str(nonoverlappingsids_used)
     try:
         arcpy.AddMessage("Calculating the number of transit trips available during the time window...")
 
-        stoptimedict_rtdirpair = {}
-        for rtdirpair in trip_route_dict:
-            triplist = trip_route_dict[rtdirpair]
-
-            # Get the stop_times that occur during this time window
-            stoptimedict = BBB_SharedFunctions.GetStopTimesForStopsInTimeWindow(start_sec, end_sec, DepOrArr, triplist, "today")
-            stoptimedict_yest = BBB_SharedFunctions.GetStopTimesForStopsInTimeWindow(start_sec, end_sec, DepOrArr, triplist, "yesterday")
-            stoptimedict_tom = BBB_SharedFunctions.GetStopTimesForStopsInTimeWindow(start_sec, end_sec, DepOrArr, triplist, "tomorrow")
-
-            # Combine the three dictionaries into one master
-            for stop in stoptimedict_yest:
-                stoptimedict[stop] = stoptimedict.setdefault(stop, []) + stoptimedict_yest[stop]
-            for stop in stoptimedict_tom:
-                stoptimedict[stop] = stoptimedict.setdefault(stop, []) + stoptimedict_tom[stop]
-
-            stoptimedict_rtdirpair[rtdirpair] = stoptimedict
-
-            # Add a warning if there is no service.
-            if not stoptimedict:
-                arcpy.AddWarning("There is no service for route %s in direction %s \
+        with profiling.Stage("Count trips") as stage:
+            stoptimedict_rtdirpair = {}
+            cachekeys = {}
+            for rtdirpair in trip_route_dict:
+                # Check if this query has been run on this GTFS dataset before.
+                if resultcache.CacheFile:
+                    cachekeys[rtdirpair] = resultcache.MakeKey(BBB_SharedFunctions.GetFeedHash(),
+                                    "route", rtdirpair, DayOfWeek, start_sec, end_sec, DepOrArr)
+                    stoptimedict = resultcache.LoadStopTimes(cachekeys[rtdirpair])
+                    if stoptimedict is not None:
+                        stoptimedict_rtdirpair[rtdirpair] = stoptimedict
+
+            # Get the stop_times that occur during this time window today, yesterday,
+            # and tomorrow for all the other route/direction pairs in one query.
+            pairtripdict = dict((rtdirpair, trip_route_dict[rtdirpair]) for rtdirpair
+                            in trip_route_dict if rtdirpair not in stoptimedict_rtdirpair)
+            if pairtripdict:
+                pairstoptimedict = BBB_SharedFunctions.GetStopTimesForRouteDirectionsInTimeWindow(
+                                        start_sec, end_sec, DepOrArr, pairtripdict)
+                for rtdirpair in pairstoptimedict:
+                    stoptimedict_rtdirpair[rtdirpair] = pairstoptimedict[rtdirpair]
+                    if rtdirpair in cachekeys:
+                        resultcache.StoreStopTimes(cachekeys[rtdirpair], pairstoptimedict[rtdirpair])
+
+            for rtdirpair in trip_route_dict:
+                # Add a warning if there is no service.
+                if not stoptimedict_rtdirpair[rtdirpair]:
+                    arcpy.AddWarning("There is no service for route %s in direction %s \
 on %s during the time window you selected. Output fields will be generated, but \
 the values will be 0 or <Null>." % (rtdirpair[0], str(rtdirpair[1]), DayOfWeek))
 
+            # Calculate the statistics for the stops of all the route/direction
+            # pairs at once. {((route_id, direction_id), stop_id): (NumTrips, MaxWaitTime, AvgHeadway)}
+            stopkeys = []
+            stoptimelists = []
+            for rtdirpair in stoptimedict_rtdirpair:
+                stoptimedict = stoptimedict_rtdirpair[rtdirpair]
+                for stop_id in stoptimedict:
+                    stopkeys.append((rtdirpair, stop_id))
+                    stoptimelists.append([stoptime[1] for stoptime in stoptimedict[stop_id]])
+            stopstatsdict = dict(zip(stopkeys, zip(*headways.CalculateHeadwayStatsForGroups(
+                                    stoptimelists, start_sec, end_sec))))
+
+            if resultcache.CacheFile:
+                arcpy.AddMessage("Result cache: %i hits, %i misses." % (resultcache.Hits, resultcache.Misses))
+            stage.rows = len(stopstatsdict)
+
     except:
         arcpy.AddError("Error counting arrivals or departures at stop during time window.")
         raise
@@ -280,42 +300,44 @@ the values will be 0 or <Null>." % (rtdirpair[0], str(rtdirpair[1]), DayOfWeek))
     arcpy.AddMessage("Writing output...")
 
     try:
-        # Prepare the fields we're going to add to the feature classes
-        ending = "_" + dayshort + "_" + start_time_pretty + "_" + end_time_pretty
-        fields_to_fill = ["NumTrips" + ending, "NumTripsPerHr" + ending, "MaxWaitTime" + ending, "AvgHeadway" + ending]
-        fields_to_read = ["stop_id", "route_id", "direction_id"] + fields_to_fill
-        field_type_dict = {"NumTrips" + ending: "Short", "NumTripsPerHr" + ending: "Double", "MaxWaitTime" + ending: "Short", "AvgHeadway" + ending: "Short"}
-
-        for FC in FCList:
-            # We probably need to add new fields for our calculations, but if the field
-            # is already there, don't add it because we'll overwrite it.
-            for field in fields_to_fill:
-                if field not in FieldNames[FC]:
-                    arcpy.management.AddField(FC, field, field_type_dict[field])
-            if ArcVersion == "10.0":
-                cur2 = arcpy.UpdateCursor(FC, "", "", ";".join(fields_to_read))
-                for row in cur2:
-                    rtpairtuple = (row.getValue("route_id"), row.getValue("direction_id"))
-                    stop = row.getValue("stop_id")
-                    NumTrips, NumTripsPerHr, MaxWaitTime, AvgHeadway = RetrieveStatsForStop(stop, rtpairtuple)
-                    row.setValue("NumTrips" + ending, NumTrips)
-                    row.setValue("NumTripsPerHr" + ending, NumTripsPerHr)
-                    row.setValue("MaxWaitTime" + ending, MaxWaitTime)
-                    row.setValue("AvgHeadway" + ending, AvgHeadway)
-                    cur2.updateRow(row)
-            else:
-                # For everything 10.1 and forward
-                cur2 = arcpy.da.UpdateCursor(FC, fields_to_read)
-                for row in cur2:
-                    rtpairtuple = (row[1], row[2]) # (route_id, direction_id)
-                    stop = row[0]
-                    NumTrips, NumTripsPerHr, MaxWaitTime, AvgHeadway = RetrieveStatsForStop(stop, rtpairtuple)
-                    row[3] = NumTrips
-                    row[4] = NumTripsPerHr
-                    row[5] = MaxWaitTime
-                    row[6] = AvgHeadway
-                    cur2.updateRow(row)
-            del cur2
+        with profiling.Stage("Write output") as stage:
+            # Prepare the fields we're going to add to the feature classes
+            ending = "_" + dayshort + "_" + start_time_pretty + "_" + end_time_pretty
+            fields_to_fill = ["NumTrips" + ending, "NumTripsPerHr" + ending, "MaxWaitTime" + ending, "AvgHeadway" + ending]
+            fields_to_read = ["stop_id", "route_id", "direction_id"] + fields_to_fill
+            field_type_dict = {"NumTrips" + ending: "Short", "NumTripsPerHr" + ending: "Double", "MaxWaitTime" + ending: "Short", "AvgHeadway" + ending: "Short"}
+
+            for FC in FCList:
+                # We probably need to add new fields for our calculations, but if the field
+                # is already there, don't add it because we'll overwrite it.
+                for field in fields_to_fill:
+                    if field not in FieldNames[FC]:
+                        arcpy.management.AddField(FC, field, field_type_dict[field])
+                if ArcVersion == "10.0":
+                    cur2 = arcpy.UpdateCursor(FC, "", "", ";".join(fields_to_read))
+                    for row in cur2:
+                        rtpairtuple = (row.getValue("route_id"), row.getValue("direction_id"))
+                        stop = row.getValue("stop_id")
+                        NumTrips, NumTripsPerHr, MaxWaitTime, AvgHeadway = RetrieveStatsForStop(stop, rtpairtuple)
+                        row.setValue("NumTrips" + ending, NumTrips)
+                        row.setValue("NumTripsPerHr" + ending, NumTripsPerHr)
+                        row.setValue("MaxWaitTime" + ending, MaxWaitTime)
+                        row.setValue("AvgHeadway" + ending, AvgHeadway)
+                        cur2.updateRow(row)
+                else:
+                    # For everything 10.1 and forward
+                    cur2 = arcpy.da.UpdateCursor(FC, fields_to_read)
+                    for row in cur2:
+                        rtpairtuple = (row[1], row[2]) # (route_id, direction_id)
+                        stop = row[0]
+                        NumTrips, NumTripsPerHr, MaxWaitTime, AvgHeadway = RetrieveStatsForStop(stop, rtpairtuple)
+                        row[3] = NumTrips
+                        row[4] = NumTripsPerHr
+                        row[5] = MaxWaitTime
+                        row[6] = AvgHeadway
+                        cur2.updateRow(row)
+                del cur2
+            stage.rows = len(FCList)
 
     except Exception, err:
         arcpy.AddError("Error writing output to feature class(es).")
@@ -339,4 +361,6 @@ except Exception, err:
     raise
 
 finally:
+    # Show the timing of a run that failed or was canceled too.
+    profiling.Report()
     arcpy.env.overwriteOutput = OverwriteOutput
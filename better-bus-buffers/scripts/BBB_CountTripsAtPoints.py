@@ -30,12 +30,14 @@ subsequent trips, and the number of stops within range of the input point.
 import os
 import arcpy
 import BBB_SharedFunctions
+from bbb_core import catchment, featurestops, profiling
 
 class CustomError(Exception):
     pass
 
 
 try:
+    profiling.Start("Count Trips at Points")
 
     #----- Get input parameters -----
     # Output files and location
@@ -81,6 +83,52 @@ try:
     elif DepOrArrChoice == "Departures":
         DepOrArr = "departure_time"
 
+    # Optional time-of-day profile: the length in minutes of the consecutive
+    # time windows to count trips in, in addition to the whole time window.
+    ProfileStep = ""
+    if arcpy.GetArgumentCount() > 13:
+        ProfileStep = arcpy.GetParameterAsText(13)
+
+    # Optional list of other weekdays to count trips on in the same time
+    # window, for comparison with the main day of the week.
+    CompareDays = []
+    if arcpy.GetArgumentCount() > 14 and arcpy.GetParameterAsText(14):
+        CompareDays = arcpy.GetParameterAsText(14).split(";")
+
+    # Optional straight-line distance in meters. If given, the stops within this
+    # distance of each point are used instead of solving an OD cost matrix on
+    # the network, and no Network Analyst license is needed.
+    StraightLineDistance = ""
+    if arcpy.GetArgumentCount() > 15:
+        StraightLineDistance = arcpy.GetParameterAsText(15)
+
+    # Optional distance in meters for combining stops into one location for the
+    # OD matrix. Stops are combined by parent_station, and the other stops by a
+    # grid of cells this many meters wide (0 to combine by parent_station only).
+    # The points reaching a combined location are served by all its stops.
+    CombineStopsTolerance = ""
+    if arcpy.GetArgumentCount() > 16:
+        CombineStopsTolerance = arcpy.GetParameterAsText(16)
+
+    # Optional headway statistics: the median and 90th percentile headway,
+    # the coefficient of variation of the headways, and the expected wait.
+    # These need numpy.
+    CalcHeadwayStats = False
+    if arcpy.GetArgumentCount() > 17:
+        CalcHeadwayStats = arcpy.GetParameterAsText(17) == "true"
+
+    # Optional range of specific dates (YYYYMMDD) to count trips on in the same
+    # time window. The mean, min, and max number of trips over the dates are
+    # reported, so holidays and other calendar_dates exceptions are included.
+    DateRange = []
+    if arcpy.GetArgumentCount() > 19 and arcpy.GetParameterAsText(18) and arcpy.GetParameterAsText(19):
+        DateRange = BBB_SharedFunctions.MakeDateRange(
+                        BBB_SharedFunctions.parse_date(arcpy.GetParameterAsText(18)),
+                        BBB_SharedFunctions.parse_date(arcpy.GetParameterAsText(19)))
+        if not DateRange:
+            arcpy.AddError("Your date range ends before it starts.")
+            raise CustomError
+
     # Hard-wired OD variables
     ExcludeRestricted = "EXCLUDE"
     PathShape = "NO_LINES"
@@ -97,13 +145,15 @@ try:
 
     # Figure out what version of ArcGIS they're running
     # (for compatibility reasons and general diagnostic info).
-    ArcVersionInfo = arcpy.GetInstallInfo("desktop")
-    ArcVersion = ArcVersionInfo['Version']
+    ArcVersion = BBB_SharedFunctions.DetermineArcVersion()
 
     #Check out the Network Analyst extension license
     # (note that this does NOT check out the extension in ArcMap.
     # It has to be done manually there.)
-    if arcpy.CheckExtension("Network") == "Available":
+    if StraightLineDistance:
+        # Network Analyst isn't used for straight-line distances.
+        pass
+    elif arcpy.CheckExtension("Network") == "Available":
         arcpy.CheckOutExtension("Network")
     else:
         arcpy.AddError("You must have a Network Analyst license to use this tool.")
@@ -123,122 +173,187 @@ try:
     arcpy.AddMessage("Run set up successfully.")
 
 
-    # ----- Create a feature class of stops ------
-    try:
-        arcpy.AddMessage("Getting GTFS stops...")
-        StopsLayer, StopList = BBB_SharedFunctions.MakeStopsFeatureClass(os.path.join("in_memory", "Temp_Stops"))
-    except:
-        arcpy.AddError("Error creating in_memory feature class of GTFS stops.")
-        raise
-
+    if StraightLineDistance:
+        #----- Find the stops within a straight-line distance of the user's points -----
+        try:
+            arcpy.AddMessage("Finding stops within %s meters of the points..." % StraightLineDistance)
+            with profiling.Stage("Find stops within distance") as stage:
+                stopids, stoplats, stoplons = BBB_SharedFunctions.GetStopLocations()
+                pointids, pointlats, pointlons = BBB_SharedFunctions.GetPointLocations(
+                                                    inPointsLayer, inLocUniqueID)
+                # PointsAndStops holds the stops serving each point in compact
+                # FeatureStopsCSR form, with a row for each point.
+                PointsAndStops = catchment.FindStopsWithinDistance(pointids,
+                                    pointlats, pointlons, [str(stop_id) for stop_id in stopids],
+                                    stoplats, stoplons, float(StraightLineDistance))
+                stage.rows = len(PointsAndStops)
+        except:
+            arcpy.AddError("Error finding stops within a straight-line distance of the input points.")
+            raise
 
-    #----- Create OD Matrix between stops and user's points -----
-    try:
-        arcpy.AddMessage("Creating OD matrix between points and stops...")
-        arcpy.AddMessage("(This step could take a while for large datasets or buffer sizes.)")
-
-        # Name to refer to OD matrix layer
-        outNALayer_OD = "ODMatrix"
-
-        # ODLayer is the NA Layer object returned by getOutput(0)
-        ODLayer = arcpy.na.MakeODCostMatrixLayer(inNetworkDataset, outNALayer_OD,
-                                        impedanceAttribute, BufferSize, "",
-                                        accumulate, uturns, restrictions,
-                                        hierarchy, "", PathShape).getOutput(0)
-
-        # To refer to the OD sublayers, get the sublayer names.  This is essential for localization.
-        if ArcVersion == "10.0":
-            naSubLayerNames = dict((sublayer.datasetName, sublayer.name) for sublayer in  arcpy.mapping.ListLayers(ODLayer)[1:])
-        else:
-            naSubLayerNames = arcpy.na.GetNAClassNames(ODLayer)
-        points = naSubLayerNames["Origins"]
-        stops = naSubLayerNames["Destinations"]
-
-        # Add a field for stop_id as a unique identifier for stops.
-        arcpy.na.AddFieldToAnalysisLayer(outNALayer_OD, stops,
-                                        "stop_id", "TEXT")
-        # Specify the field mappings for the stop_id field.
-        if ArcVersion == "10.0":
-            fieldMappingStops = "Name stop_id #; stop_id stop_id #"
-        else:
-            fieldMappingStops = arcpy.na.NAClassFieldMappings(ODLayer, stops)
-            fieldMappingStops["Name"].mappedFieldName = "stop_id"
-            fieldMappingStops["stop_id"].mappedFieldName = "stop_id"
-        # Add the GTFS stops as locations for the analysis.
-        arcpy.na.AddLocations(outNALayer_OD, stops, StopsLayer,
-                                fieldMappingStops, "50 meters", "", "", "", "", "", "",
-                                ExcludeRestricted)
-        # Clear out the memory because we don't need this anymore.
-        arcpy.management.Delete(StopsLayer)
-
-        # Add a field for unique identifier for points.
-        arcpy.na.AddFieldToAnalysisLayer(outNALayer_OD, points,
-                                        inLocUniqueID_qualified, "TEXT")
-        # Specify the field mappings for the unique id field.
-        if ArcVersion == "10.0":
-            fieldMappingPoints = "Name " + inLocUniqueID + " #; " + inLocUniqueID_qualified + " " + inLocUniqueID + " #"
-        else:
-            fieldMappingPoints = arcpy.na.NAClassFieldMappings(ODLayer, points)
-            fieldMappingPoints["Name"].mappedFieldName = inLocUniqueID
-            fieldMappingPoints[inLocUniqueID_qualified].mappedFieldName = inLocUniqueID
-        # Add the input points as locations for the analysis.
-        arcpy.na.AddLocations(outNALayer_OD, points, inPointsLayer,
-                                fieldMappingPoints, "500 meters", "", "", "", "", "", "",
-                                ExcludeRestricted)
-
-        # Solve the OD matrix.
-        arcpy.na.Solve(outNALayer_OD)
-
-        # Make layer objects for each sublayer we care about.
-        subLayers = dict((lyr.datasetName, lyr) for lyr in arcpy.mapping.ListLayers(ODLayer)[1:])
-        linesSubLayer = subLayers["ODLines"]
-        pointsSubLayer = subLayers["Origins"]
-        stopsSubLayer = subLayers["Destinations"]
-
-        # Get the OID fields, just to be thorough
-        desc1 = arcpy.Describe(pointsSubLayer)
-        points_OID = desc1.OIDFieldName
-        desc2 = arcpy.Describe(stopsSubLayer)
-        stops_OID = desc2.OIDFieldName
-
-        # Join polygons layer with input facilities to port over the stop_id
-        arcpy.management.JoinField(linesSubLayer, "OriginID", pointsSubLayer,
-                                    points_OID, [inLocUniqueID_qualified])
-        arcpy.management.JoinField(linesSubLayer, "DestinationID", stopsSubLayer,
-                                    stops_OID, ["stop_id"])
-
-        # Use searchcursor on lines to find the stops that are reachable from points.
-        global PointsAndStops
-        # PointsAndStops = {LocID: [stop_1, stop_2, ...]}
-        PointsAndStops = {}
-        if ArcVersion == "10.0":
-            ODCursor = arcpy.SearchCursor(linesSubLayer, "", "",
-                                            inLocUniqueID_qualified + "; stop_id")
-            for row in ODCursor:
-                UID = row.getValue(inLocUniqueID_qualified)
-                SID = row.getValue("stop_id")
-                PointsAndStops.setdefault(str(UID), []).append(str(SID))
-        else:
-            ODCursor = arcpy.da.SearchCursor(linesSubLayer, [inLocUniqueID_qualified, "stop_id"])
-            for row in ODCursor:
-                PointsAndStops.setdefault(str(row[0]), []).append(str(row[1]))
-        del ODCursor
-
-    except:
-        arcpy.AddError("Error creating OD matrix between stops and input points.")
-        raise
-
-    finally:
-        # Check the Network Analyst Extension back in.
-        arcpy.CheckInExtension("Network")
+    else:
+        # ----- Create a feature class of stops ------
+        try:
+            arcpy.AddMessage("Getting GTFS stops...")
+            with profiling.Stage("Get GTFS stops") as stage:
+                # {representative stop_id: [stop_id, ...]} for combined stops
+                StopGroups = {}
+                if CombineStopsTolerance:
+                    StopGroups = BBB_SharedFunctions.GetStopGroups(float(CombineStopsTolerance))
+                    arcpy.AddMessage("Combined %i stops into %i locations for the network analysis." % \
+                            (sum([len(members) for members in StopGroups.values()]), len(StopGroups)))
+                    StopsLayer, StopList = BBB_SharedFunctions.MakeStopsFeatureClass(
+                            os.path.join("in_memory", "Temp_Stops"), list(StopGroups))
+                else:
+                    StopsLayer, StopList = BBB_SharedFunctions.MakeStopsFeatureClass(os.path.join("in_memory", "Temp_Stops"))
+                stage.rows = len(StopList)
+        except:
+            arcpy.AddError("Error creating in_memory feature class of GTFS stops.")
+            raise
+
+
+        #----- Create OD Matrix between stops and user's points -----
+        try:
+            arcpy.AddMessage("Creating OD matrix between points and stops...")
+            arcpy.AddMessage("(This step could take a while for large datasets or buffer sizes.)")
+
+            with profiling.Stage("Solve OD matrix") as stage:
+                # Name to refer to OD matrix layer
+                outNALayer_OD = "ODMatrix"
+
+                # ODLayer is the NA Layer object returned by getOutput(0)
+                ODLayer = arcpy.na.MakeODCostMatrixLayer(inNetworkDataset, outNALayer_OD,
+                                                impedanceAttribute, BufferSize, "",
+                                                accumulate, uturns, restrictions,
+                                                hierarchy, "", PathShape).getOutput(0)
+
+                # To refer to the OD sublayers, get the sublayer names.  This is essential for localization.
+                if ArcVersion == "10.0":
+                    naSubLayerNames = dict((sublayer.datasetName, sublayer.name) for sublayer in  arcpy.mapping.ListLayers(ODLayer)[1:])
+                else:
+                    naSubLayerNames = arcpy.na.GetNAClassNames(ODLayer)
+                points = naSubLayerNames["Origins"]
+                stops = naSubLayerNames["Destinations"]
+
+                # Add a field for stop_id as a unique identifier for stops.
+                arcpy.na.AddFieldToAnalysisLayer(outNALayer_OD, stops,
+                                                "stop_id", "TEXT")
+                # Specify the field mappings for the stop_id field.
+                if ArcVersion == "10.0":
+                    fieldMappingStops = "Name stop_id #; stop_id stop_id #"
+                else:
+                    fieldMappingStops = arcpy.na.NAClassFieldMappings(ODLayer, stops)
+                    fieldMappingStops["Name"].mappedFieldName = "stop_id"
+                    fieldMappingStops["stop_id"].mappedFieldName = "stop_id"
+                # Add the GTFS stops as locations for the analysis.
+                arcpy.na.AddLocations(outNALayer_OD, stops, StopsLayer,
+                                        fieldMappingStops, "50 meters", "", "", "", "", "", "",
+                                        ExcludeRestricted)
+                # Clear out the memory because we don't need this anymore.
+                arcpy.management.Delete(StopsLayer)
+
+                # Add a field for unique identifier for points.
+                arcpy.na.AddFieldToAnalysisLayer(outNALayer_OD, points,
+                                                inLocUniqueID_qualified, "TEXT")
+                # Specify the field mappings for the unique id field.
+                if ArcVersion == "10.0":
+                    fieldMappingPoints = "Name " + inLocUniqueID + " #; " + inLocUniqueID_qualified + " " + inLocUniqueID + " #"
+                else:
+                    fieldMappingPoints = arcpy.na.NAClassFieldMappings(ODLayer, points)
+                    fieldMappingPoints["Name"].mappedFieldName = inLocUniqueID
+                    fieldMappingPoints[inLocUniqueID_qualified].mappedFieldName = inLocUniqueID
+                # Add the input points as locations for the analysis.
+                arcpy.na.AddLocations(outNALayer_OD, points, inPointsLayer,
+                                        fieldMappingPoints, "500 meters", "", "", "", "", "", "",
+                                        ExcludeRestricted)
+
+                # Solve the OD matrix.
+                arcpy.na.Solve(outNALayer_OD)
+
+                # Make layer objects for each sublayer we care about.
+                subLayers = dict((lyr.datasetName, lyr) for lyr in arcpy.mapping.ListLayers(ODLayer)[1:])
+                linesSubLayer = subLayers["ODLines"]
+                pointsSubLayer = subLayers["Origins"]
+                stopsSubLayer = subLayers["Destinations"]
+
+                # Get the OID fields, just to be thorough
+                desc1 = arcpy.Describe(pointsSubLayer)
+                points_OID = desc1.OIDFieldName
+                desc2 = arcpy.Describe(stopsSubLayer)
+                stops_OID = desc2.OIDFieldName
+
+                # Join polygons layer with input facilities to port over the stop_id
+                arcpy.management.JoinField(linesSubLayer, "OriginID", pointsSubLayer,
+                                            points_OID, [inLocUniqueID_qualified])
+                arcpy.management.JoinField(linesSubLayer, "DestinationID", stopsSubLayer,
+                                            stops_OID, ["stop_id"])
+
+                # Use searchcursor on lines to find the stops that are reachable from points.
+                # PointsAndStops holds the stops serving each point in compact
+                # FeatureStopsCSR form, with a row for each point with stops in range.
+                PointsAndStopsBuilder = featurestops.FeatureStopsCSRBuilder()
+                if ArcVersion == "10.0":
+                    ODCursor = arcpy.SearchCursor(linesSubLayer, "", "",
+                                                    inLocUniqueID_qualified + "; stop_id")
+                    for row in ODCursor:
+                        UID = row.getValue(inLocUniqueID_qualified)
+                        SID = str(row.getValue("stop_id"))
+                        # A combined location is served by all its stops.
+                        for stop_id in StopGroups.get(SID, [SID]):
+                            PointsAndStopsBuilder.Add(str(UID), str(stop_id))
+                else:
+                    ODCursor = arcpy.da.SearchCursor(linesSubLayer, [inLocUniqueID_qualified, "stop_id"])
+                    for row in ODCursor:
+                        SID = str(row[1])
+                        # A combined location is served by all its stops.
+                        for stop_id in StopGroups.get(SID, [SID]):
+                            PointsAndStopsBuilder.Add(str(row[0]), str(stop_id))
+                del ODCursor
+                PointsAndStops = PointsAndStopsBuilder.Finish()
+                del PointsAndStopsBuilder
+                stage.rows = len(PointsAndStops)
+
+        except:
+            arcpy.AddError("Error creating OD matrix between stops and input points.")
+            raise
+
+        finally:
+            # Check the Network Analyst Extension back in.
+            arcpy.CheckInExtension("Network")
 
 
     #----- Query the GTFS data to count the trips at each stop -----
     try:
         arcpy.AddMessage("Calculating the number of transit trips available during the time window...")
 
-        # Get a dictionary of stop times in our time window {stop_id: [[trip_id, stop_time]]}
-        stoptimedict = BBB_SharedFunctions.CountTripsAtStops(DayOfWeek, start_sec, end_sec, DepOrArr)
+        with profiling.Stage("Count trips") as stage:
+            # Get a dictionary of stop times in our time window {stop_id: [[trip_id, stop_time]]}
+            # Days with the same service_ids as the main day share its stop_times.
+            daystoptimedict = BBB_SharedFunctions.CountTripsAtStopsForDays(
+                                [DayOfWeek] + CompareDays, start_sec, end_sec, DepOrArr)
+            stoptimedict = daystoptimedict[DayOfWeek]
+            # Index the trips at each stop as bitsets {stop_id: tripbits} so unique
+            # trips can be counted without hashing trip_ids for every output feature.
+            stoptripbits = BBB_SharedFunctions.MakeStopTripBitsets(stoptimedict)
+            # Sort the stop times at each stop once so the stop times for sets of
+            # stops can be merged when calculating the max wait time and headways.
+            sortedstoptimes = None
+            if CalcWaitTime == "true" or CalcHeadwayStats:
+                sortedstoptimes = BBB_SharedFunctions.MakeSortedStopTimes(stoptimedict)
+
+            # Many points share the same set of reachable stops, so calculate the
+            # statistics once for each unique set of stops.
+            # {LocID: (NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime)},
+            # followed by the headway statistics if they were asked for
+            PointStats = BBB_SharedFunctions.RetrieveStatsForSetsOfStops(
+                                PointsAndStops, stoptimedict, CalcWaitTime,
+                                start_sec, end_sec, stoptripbits, sortedstoptimes,
+                                CalcHeadwayStats)
+            # Statistics for points with no stops in range
+            NoStopsStats = BBB_SharedFunctions.RetrieveStatsForSetOfStops(
+                                [], stoptimedict, CalcWaitTime, start_sec, end_sec,
+                                stoptripbits, sortedstoptimes)
+            stage.rows = len(stoptimedict)
 
     except:
         arcpy.AddError("Error calculating the number of transit trips available during the time window.")
@@ -249,95 +364,198 @@ try:
     try:
         arcpy.AddMessage("Writing output data...")
 
-        arcpy.management.CopyFeatures(inPointsLayer, outFile)
-        # Add a field to the output file for number of trips and num trips / hour.
-        if ".shp" in outFilename:
-            arcpy.management.AddField(outFile, "NumTrips", "SHORT")
-            arcpy.management.AddField(outFile, "TripsPerHr", "DOUBLE")
-            arcpy.management.AddField(outFile, "NumStops", "SHORT")
-            arcpy.management.AddField(outFile, "MaxWaitTm", "SHORT")
-        else:
-            arcpy.management.AddField(outFile, "NumTrips", "SHORT")
-            arcpy.management.AddField(outFile, "NumTripsPerHr", "DOUBLE")
-            arcpy.management.AddField(outFile, "NumStopsInRange", "SHORT")
-            arcpy.management.AddField(outFile, "MaxWaitTime", "SHORT")
-
-        if ArcVersion == "10.0":
+        with profiling.Stage("Write output") as stage:
+            arcpy.management.CopyFeatures(inPointsLayer, outFile)
+            # Add a field to the output file for number of trips and num trips / hour.
             if ".shp" in outFilename:
-                ucursor = arcpy.UpdateCursor(outFile, "", "",
-                                        inLocUniqueID[0:10] + "; NumTrips; TripsPerHr; NumStops; MaxWaitTm")
-                for row in ucursor:
-                    try:
-                        ImportantStops = PointsAndStops[str(row.getValue(inLocUniqueID))]
-                    except KeyError:
-                        # This point had no stops in range
-                        ImportantStops = []
-                    NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
-                                BBB_SharedFunctions.RetrieveStatsForSetOfStops(
-                                    ImportantStops, stoptimedict, CalcWaitTime,
-                                    start_sec, end_sec)
-                    row.NumTrips = NumTrips
-                    row.TripsPerHr = NumTripsPerHr
-                    row.NumStops = NumStopsInRange
-                    if MaxWaitTime == None:
-                        row.MaxWaitTm = -1
-                    else:
-                        row.MaxWaitTm = MaxWaitTime
-                    ucursor.updateRow(row)
+                arcpy.management.AddField(outFile, "NumTrips", "SHORT")
+                arcpy.management.AddField(outFile, "TripsPerHr", "DOUBLE")
+                arcpy.management.AddField(outFile, "NumStops", "SHORT")
+                arcpy.management.AddField(outFile, "MaxWaitTm", "SHORT")
+            else:
+                arcpy.management.AddField(outFile, "NumTrips", "SHORT")
+                arcpy.management.AddField(outFile, "NumTripsPerHr", "DOUBLE")
+                arcpy.management.AddField(outFile, "NumStopsInRange", "SHORT")
+                arcpy.management.AddField(outFile, "MaxWaitTime", "SHORT")
+
+            if ArcVersion == "10.0":
+                if ".shp" in outFilename:
+                    ucursor = arcpy.UpdateCursor(outFile, "", "",
+                                            inLocUniqueID[0:10] + "; NumTrips; TripsPerHr; NumStops; MaxWaitTm")
+                    for row in ucursor:
+                        try:
+                            NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
+                                        PointStats[str(row.getValue(inLocUniqueID))][:4]
+                        except KeyError:
+                            # This point had no stops in range
+                            NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = NoStopsStats
+                        row.NumTrips = NumTrips
+                        row.TripsPerHr = NumTripsPerHr
+                        row.NumStops = NumStopsInRange
+                        if MaxWaitTime == None:
+                            row.MaxWaitTm = -1
+                        else:
+                            row.MaxWaitTm = MaxWaitTime
+                        ucursor.updateRow(row)
+                else:
+                    ucursor = arcpy.UpdateCursor(outFile, "", "",
+                                            inLocUniqueID + "; NumTrips; NumTripsPerHr; NumStopsInRange; MaxWaitTime")
+                    for row in ucursor:
+                        try:
+                            NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
+                                        PointStats[str(row.getValue(inLocUniqueID))][:4]
+                        except KeyError:
+                            # This point had no stops in range
+                            NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = NoStopsStats
+                        row.NumTrips = NumTrips
+                        row.NumTripsPerHr = NumTripsPerHr
+                        row.NumStopsInRange = NumStopsInRange
+                        row.MaxWaitTime = MaxWaitTime
+                        ucursor.updateRow(row)
+
             else:
-                ucursor = arcpy.UpdateCursor(outFile, "", "",
-                                        inLocUniqueID + "; NumTrips; NumTripsPerHr; NumStopsInRange; MaxWaitTime")
+                # For everything 10.1 and forward
+                if ".shp" in outFilename:
+                    ucursor = arcpy.da.UpdateCursor(outFile,
+                                                    [inLocUniqueID[0:10], "NumTrips",
+                                                     "TripsPerHr", "NumStops",
+                                                     "MaxWaitTm"])
+                else:
+                    ucursor = arcpy.da.UpdateCursor(outFile,
+                                                [inLocUniqueID, "NumTrips",
+                                                 "NumTripsPerHr", "NumStopsInRange",
+                                                 "MaxWaitTime"])
                 for row in ucursor:
                     try:
-                        ImportantStops = PointsAndStops[str(row.getValue(inLocUniqueID))]
+                        NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
+                                    PointStats[str(row[0])][:4]
                     except KeyError:
                         # This point had no stops in range
-                        ImportantStops = []
-                    NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
-                                BBB_SharedFunctions.RetrieveStatsForSetOfStops(
-                                    ImportantStops, stoptimedict, CalcWaitTime,
-                                    start_sec, end_sec)
-                    row.NumTrips = NumTrips
-                    row.NumTripsPerHr = NumTripsPerHr
-                    row.NumStopsInRange = NumStopsInRange
-                    row.MaxWaitTime = MaxWaitTime
+                        NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = NoStopsStats
+                    row[1] = NumTrips
+                    row[2] = NumTripsPerHr
+                    row[3] = NumStopsInRange
+                    if ".shp" in outFilename and MaxWaitTime == None:
+                        row[4] = -1
+                    else:
+                        row[4] = MaxWaitTime
                     ucursor.updateRow(row)
-
-        else:
-            # For everything 10.1 and forward
-            if ".shp" in outFilename:
-                ucursor = arcpy.da.UpdateCursor(outFile,
-                                                [inLocUniqueID[0:10], "NumTrips",
-                                                 "TripsPerHr", "NumStops",
-                                                 "MaxWaitTm"])
-            else:
-                ucursor = arcpy.da.UpdateCursor(outFile,
-                                            [inLocUniqueID, "NumTrips",
-                                             "NumTripsPerHr", "NumStopsInRange",
-                                             "MaxWaitTime"])
-            for row in ucursor:
-                try:
-                    ImportantStops = PointsAndStops[str(row[0])]
-                except KeyError:
-                    # This point had no stops in range
-                    ImportantStops = []
-                NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime =\
-                                BBB_SharedFunctions.RetrieveStatsForSetOfStops(
-                                    ImportantStops, stoptimedict, CalcWaitTime,
-                                    start_sec, end_sec)
-                row[1] = NumTrips
-                row[2] = NumTripsPerHr
-                row[3] = NumStopsInRange
-                if ".shp" in outFilename and MaxWaitTime == None:
-                    row[4] = -1
-                else:
-                    row[4] = MaxWaitTime
-                ucursor.updateRow(row)
+            stage.rows = len(PointStats)
 
     except:
         arcpy.AddError("Error writing output.")
         raise
 
+
+    # ----- Write the headway statistics -----
+    if CalcHeadwayStats:
+        try:
+            arcpy.AddMessage("Writing the headway statistics...")
+
+            with profiling.Stage("Write headway statistics") as stage:
+                # They were calculated with the other statistics.
+                if ".shp" in outFilename:
+                    idField = inLocUniqueID[0:10]
+                else:
+                    idField = inLocUniqueID
+                HeadwayFields = BBB_SharedFunctions.WriteHeadwayStats(outFile,
+                                    idField, PointStats, NoStopsStats)
+                arcpy.AddMessage("Headway statistics written to %i fields." % len(HeadwayFields))
+                stage.rows = len(PointStats)
+
+        except:
+            arcpy.AddError("Error writing the headway statistics.")
+            raise
+
+    # ----- Calculate the time-of-day profile -----
+    if ProfileStep:
+        try:
+            arcpy.AddMessage("Calculating the time-of-day profile...")
+
+            with profiling.Stage("Time-of-day profile") as stage:
+                # The stop times for the whole time window are already loaded, so
+                # just split them into the profile's time windows.
+                windows = BBB_SharedFunctions.MakeTimeWindows(start_sec, end_sec, float(ProfileStep) * 60)
+                if not BBB_SharedFunctions.frequencies_dict_initialized:
+                    # The stop_times came from the result cache.
+                    BBB_SharedFunctions.MakeFrequenciesDict()
+                stopwindowevents = BBB_SharedFunctions.MakeStopEventsForTimeWindows(stoptimedict,
+                                    windows, BBB_SharedFunctions.frequencies_dict)
+                PointWindowStats = BBB_SharedFunctions.RetrieveStatsForSetsOfStopsForTimeWindows(
+                                    PointsAndStops, stopwindowevents, windows, CalcWaitTime)
+                # Statistics for points with no stops in range
+                NoStopsWindowStats = BBB_SharedFunctions.RetrieveStatsForSetOfStopsForTimeWindows(
+                                    [], stopwindowevents, windows, CalcWaitTime)
+                if ".shp" in outFilename:
+                    idField = inLocUniqueID[0:10]
+                else:
+                    idField = inLocUniqueID
+                fieldsuffixes = [BBB_SharedFunctions.MakeTimeWindowFieldSuffix(
+                                    window[0], window[1], ".shp" in outFilename) for window in windows]
+                ProfileFields = BBB_SharedFunctions.WriteStatsForFieldSets(outFile,
+                                    idField, PointWindowStats, fieldsuffixes,
+                                    NoStopsWindowStats)
+                arcpy.AddMessage("Time-of-day profile written to %i fields." % len(ProfileFields))
+                stage.rows = len(PointWindowStats)
+
+        except:
+            arcpy.AddError("Error calculating the time-of-day profile.")
+            raise
+
+    # ----- Calculate the statistics for the other days of the week -----
+    if CompareDays:
+        try:
+            arcpy.AddMessage("Calculating the number of transit trips on the other days of the week...")
+
+            with profiling.Stage("Other days of the week") as stage:
+                DayStats = BBB_SharedFunctions.RetrieveStatsForSetsOfStopsForDays(
+                                    PointsAndStops, daystoptimedict, CompareDays,
+                                    CalcWaitTime, start_sec, end_sec)
+                # Statistics for points with no stops in range
+                NoStopsDayStats = [NoStopsStats] * len(CompareDays)
+                if ".shp" in outFilename:
+                    idField = inLocUniqueID[0:10]
+                else:
+                    idField = inLocUniqueID
+                fieldsuffixes = ["_" + day[0:3] for day in CompareDays]
+                DayFields = BBB_SharedFunctions.WriteStatsForFieldSets(outFile,
+                                    idField, DayStats, fieldsuffixes,
+                                    NoStopsDayStats)
+                arcpy.AddMessage("Statistics for the other days of the week written to %i fields." % len(DayFields))
+                stage.rows = len(DayStats)
+
+        except:
+            arcpy.AddError("Error calculating the statistics for the other days of the week.")
+            raise
+
+    # ----- Calculate the statistics for the range of dates -----
+    if DateRange:
+        try:
+            arcpy.AddMessage("Calculating the number of transit trips on each date in the date range...")
+
+            with profiling.Stage("Date range") as stage:
+                # Dates with the same service_ids share one set of stop_times and
+                # one calculation.
+                datestoptimedict = BBB_SharedFunctions.CountTripsAtStopsForDates(
+                                    DateRange, start_sec, end_sec, DepOrArr)
+                DateStats = BBB_SharedFunctions.RetrieveTripStatsForDates(
+                                    PointsAndStops, datestoptimedict, DateRange,
+                                    start_sec, end_sec)
+                if ".shp" in outFilename:
+                    idField = inLocUniqueID[0:10]
+                else:
+                    idField = inLocUniqueID
+                # Points with no stops in range have no trips on any date.
+                DateFields = BBB_SharedFunctions.WriteDateRangeStats(outFile,
+                                    idField, DateStats, (0, 0, 0))
+                arcpy.AddMessage("Statistics for %i dates written to %i fields." % (len(DateRange), len(DateFields)))
+                stage.rows = len(DateStats)
+
+        except:
+            arcpy.AddError("Error calculating the statistics for the date range.")
+            raise
+
+
     arcpy.AddMessage("Done!")
     arcpy.AddMessage("Output files written:")
     arcpy.AddMessage("- " + outFile)
@@ -351,5 +569,7 @@ except:
     raise
 
 finally:
+    # Show the timing of a run that failed or was canceled too.
+    profiling.Report()
     # Reset overwriteOutput to what it was originally.
     arcpy.env.overwriteOutput = OverwriteOutput
\ No newline at end of file
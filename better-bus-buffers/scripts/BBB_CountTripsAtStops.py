@@ -28,12 +28,14 @@ during that time window.
 
 import arcpy
 import BBB_SharedFunctions
+from bbb_core import profiling
 
 class CustomError(Exception):
     pass
 
 
 try:
+    profiling.Start("Count Trips at Stops")
     # ------ Get input parameters and set things up. -----
     try:
 
@@ -72,9 +74,39 @@ try:
         elif DepOrArrChoice == "Departures":
             DepOrArr = "departure_time"
 
+        # Optional time-of-day profile: the length in minutes of the consecutive
+        # time windows to count trips in, in addition to the whole time window.
+        ProfileStep = ""
+        if arcpy.GetArgumentCount() > 7:
+            ProfileStep = arcpy.GetParameterAsText(7)
+
+        # Optional list of other weekdays to count trips on in the same time
+        # window, for comparison with the main day of the week.
+        CompareDays = []
+        if arcpy.GetArgumentCount() > 8 and arcpy.GetParameterAsText(8):
+            CompareDays = arcpy.GetParameterAsText(8).split(";")
+
+        # Optional headway statistics: the median and 90th percentile headway,
+        # the coefficient of variation of the headways, and the expected wait.
+        # These need numpy.
+        CalcHeadwayStats = False
+        if arcpy.GetArgumentCount() > 9:
+            CalcHeadwayStats = arcpy.GetParameterAsText(9) == "true"
+
+        # Optional range of specific dates (YYYYMMDD) to count trips on in the same
+        # time window. The mean, min, and max number of trips over the dates are
+        # reported, so holidays and other calendar_dates exceptions are included.
+        DateRange = []
+        if arcpy.GetArgumentCount() > 11 and arcpy.GetParameterAsText(10) and arcpy.GetParameterAsText(11):
+            DateRange = BBB_SharedFunctions.MakeDateRange(
+                            BBB_SharedFunctions.parse_date(arcpy.GetParameterAsText(10)),
+                            BBB_SharedFunctions.parse_date(arcpy.GetParameterAsText(11)))
+            if not DateRange:
+                arcpy.AddError("Your date range ends before it starts.")
+                raise CustomError
+
         # Figure out what version of ArcGIS they're running
-        ArcVersionInfo = arcpy.GetInstallInfo("desktop")
-        ArcVersion = ArcVersionInfo['Version']
+        ArcVersion = BBB_SharedFunctions.DetermineArcVersion()
 
     except:
         arcpy.AddError("Error getting user inputs.")
@@ -85,19 +117,21 @@ try:
     try:
         arcpy.AddMessage("Creating feature class of GTFS stops...")
 
-        # Create a feature class of transit stops
-        outStops, StopIDList = BBB_SharedFunctions.MakeStopsFeatureClass(outStops)
+        with profiling.Stage("Create stops feature class") as stage:
+            # Create a feature class of transit stops
+            outStops, StopIDList = BBB_SharedFunctions.MakeStopsFeatureClass(outStops)
 
-        # Add a field to the output file for number of trips, num trips / hour, and max wait time
-        if ".shp" in outStops:
-            # Shapefiles can't have long field names
-            arcpy.management.AddField(outStops, "NumTrips", "SHORT")
-            arcpy.management.AddField(outStops, "TripsPerHr", "DOUBLE")
-            arcpy.management.AddField(outStops, "MaxWaitTm", "SHORT")
-        else:
-            arcpy.management.AddField(outStops, "NumTrips", "SHORT")
-            arcpy.management.AddField(outStops, "NumTripsPerHr", "DOUBLE")
-            arcpy.management.AddField(outStops, "MaxWaitTime", "SHORT")
+            # Add a field to the output file for number of trips, num trips / hour, and max wait time
+            if ".shp" in outStops:
+                # Shapefiles can't have long field names
+                arcpy.management.AddField(outStops, "NumTrips", "SHORT")
+                arcpy.management.AddField(outStops, "TripsPerHr", "DOUBLE")
+                arcpy.management.AddField(outStops, "MaxWaitTm", "SHORT")
+            else:
+                arcpy.management.AddField(outStops, "NumTrips", "SHORT")
+                arcpy.management.AddField(outStops, "NumTripsPerHr", "DOUBLE")
+                arcpy.management.AddField(outStops, "MaxWaitTime", "SHORT")
+            stage.rows = len(StopIDList)
 
     except:
         arcpy.AddError("Error creating feature class of GTFS stops.")
@@ -108,8 +142,29 @@ try:
     try:
         arcpy.AddMessage("Calculating the number of transit trips available during the time window...")
 
-        # Get a dictionary of {stop_id: [[trip_id, stop_time]]} for our time window
-        stoptimedict = BBB_SharedFunctions.CountTripsAtStops(DayOfWeek, start_sec, end_sec, DepOrArr)
+        with profiling.Stage("Count trips") as stage:
+            # Get a dictionary of {stop_id: [[trip_id, stop_time]]} for our time window
+            # Days with the same service_ids as the main day share its stop_times.
+            daystoptimedict = BBB_SharedFunctions.CountTripsAtStopsForDays(
+                                [DayOfWeek] + CompareDays, start_sec, end_sec, DepOrArr)
+            stoptimedict = daystoptimedict[DayOfWeek]
+            # Each stop is its own set of stops. {stop_id: [stop_id]}
+            StopsDict = dict((str(stop_id), [str(stop_id)]) for stop_id in StopIDList)
+            # Index the trips at each stop as bitsets {stop_id: tripbits} so unique
+            # trips can be counted without hashing trip_ids for every output feature.
+            stoptripbits = BBB_SharedFunctions.MakeStopTripBitsets(stoptimedict)
+            # Sort the stop times at each stop once so the stop times for sets of
+            # stops can be merged when calculating the max wait time and headways.
+            sortedstoptimes = None
+            if CalcWaitTime == "true" or CalcHeadwayStats:
+                sortedstoptimes = BBB_SharedFunctions.MakeSortedStopTimes(stoptimedict)
+            # {stop_id: (NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime)},
+            # followed by the headway statistics if they were asked for
+            StopStats = BBB_SharedFunctions.RetrieveStatsForSetsOfStops(
+                                StopsDict, stoptimedict, CalcWaitTime, start_sec,
+                                end_sec, stoptripbits, sortedstoptimes,
+                                CalcHeadwayStats)
+            stage.rows = len(stoptimedict)
 
     except:
         arcpy.AddError("Error counting arrivals or departures at stop during time window.")
@@ -120,63 +175,145 @@ try:
     try:
         arcpy.AddMessage("Writing output data...")
 
-        # Create an update cursor to add numtrips, trips/hr, and maxwaittime to stops
-        if ArcVersion == "10.0":
-            if ".shp" in outStops:
-                ucursor = arcpy.UpdateCursor(outStops, "", "", "stop_id; NumTrips; TripsPerHr; MaxWaitTm")
-                for row in ucursor:
-                    NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
-                            BBB_SharedFunctions.RetrieveStatsForSetOfStops(
-                                [str(row.getValue("stop_id"))], stoptimedict,
-                                CalcWaitTime, start_sec, end_sec)
-                    row.NumTrips = NumTrips
-                    row.TripsPerHr = NumTripsPerHr
-                    if MaxWaitTime == None:
-                        row.MaxWaitTm = -1
-                    else:
-                        row.MaxWaitTm = MaxWaitTime
-                    ucursor.updateRow(row)
+        with profiling.Stage("Write output") as stage:
+            # Create an update cursor to add numtrips, trips/hr, and maxwaittime to stops
+            if ArcVersion == "10.0":
+                if ".shp" in outStops:
+                    ucursor = arcpy.UpdateCursor(outStops, "", "", "stop_id; NumTrips; TripsPerHr; MaxWaitTm")
+                    for row in ucursor:
+                        NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
+                                StopStats[str(row.getValue("stop_id"))][:4]
+                        row.NumTrips = NumTrips
+                        row.TripsPerHr = NumTripsPerHr
+                        if MaxWaitTime == None:
+                            row.MaxWaitTm = -1
+                        else:
+                            row.MaxWaitTm = MaxWaitTime
+                        ucursor.updateRow(row)
+                else:
+                    ucursor = arcpy.UpdateCursor(outStops, "", "", "stop_id; NumTrips; NumTripsPerHr; MaxWaitTime")
+                    for row in ucursor:
+                        NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
+                                StopStats[str(row.getValue("stop_id"))][:4]
+                        row.NumTrips = NumTrips
+                        row.NumTripsPerHr = NumTripsPerHr
+                        row.MaxWaitTime = MaxWaitTime
+                        ucursor.updateRow(row)
+
             else:
-                ucursor = arcpy.UpdateCursor(outStops, "", "", "stop_id; NumTrips; NumTripsPerHr; MaxWaitTime")
+                # For everything 10.1 and forward
+                if ".shp" in outStops:
+                    ucursor = arcpy.da.UpdateCursor(outStops,
+                                                ["stop_id", "NumTrips",
+                                                 "TripsPerHr",
+                                                 "MaxWaitTm"])
+                else:
+                    ucursor = arcpy.da.UpdateCursor(outStops,
+                                                ["stop_id", "NumTrips",
+                                                 "NumTripsPerHr",
+                                                 "MaxWaitTime"])
                 for row in ucursor:
                     NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
-                            BBB_SharedFunctions.RetrieveStatsForSetOfStops(
-                                [str(row.getValue("stop_id"))], stoptimedict,
-                                CalcWaitTime, start_sec, end_sec)
-                    row.NumTrips = NumTrips
-                    row.NumTripsPerHr = NumTripsPerHr
-                    row.MaxWaitTime = MaxWaitTime
+                                StopStats[str(row[0])][:4]
+                    row[1] = NumTrips
+                    row[2] = NumTripsPerHr
+                    if ".shp" in outStops and MaxWaitTime == None:
+                        row[3] = -1
+                    else:
+                        row[3] = MaxWaitTime
                     ucursor.updateRow(row)
-
-        else:
-            # For everything 10.1 and forward
-            if ".shp" in outStops:
-                ucursor = arcpy.da.UpdateCursor(outStops,
-                                            ["stop_id", "NumTrips",
-                                             "TripsPerHr",
-                                             "MaxWaitTm"])
-            else:
-                ucursor = arcpy.da.UpdateCursor(outStops,
-                                            ["stop_id", "NumTrips",
-                                             "NumTripsPerHr",
-                                             "MaxWaitTime"])
-            for row in ucursor:
-                NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
-                            BBB_SharedFunctions.RetrieveStatsForSetOfStops(
-                                [str(row[0])], stoptimedict, CalcWaitTime,
-                                start_sec, end_sec)
-                row[1] = NumTrips
-                row[2] = NumTripsPerHr
-                if ".shp" in outStops and MaxWaitTime == None:
-                    row[3] = -1
-                else:
-                    row[3] = MaxWaitTime
-                ucursor.updateRow(row)
+            stage.rows = len(StopIDList)
 
     except:
         arcpy.AddError("Error writing to output.")
         raise
 
+
+    # ----- Write the headway statistics -----
+    if CalcHeadwayStats:
+        try:
+            arcpy.AddMessage("Writing the headway statistics...")
+
+            with profiling.Stage("Write headway statistics") as stage:
+                # They were calculated with the other statistics.
+                HeadwayFields = BBB_SharedFunctions.WriteHeadwayStats(outStops,
+                                    "stop_id", StopStats)
+                arcpy.AddMessage("Headway statistics written to %i fields." % len(HeadwayFields))
+                stage.rows = len(StopStats)
+
+        except:
+            arcpy.AddError("Error writing the headway statistics.")
+            raise
+
+    # ----- Calculate the time-of-day profile -----
+    if ProfileStep:
+        try:
+            arcpy.AddMessage("Calculating the time-of-day profile...")
+
+            with profiling.Stage("Time-of-day profile") as stage:
+                # The stop times for the whole time window are already loaded, so
+                # just split them into the profile's time windows.
+                windows = BBB_SharedFunctions.MakeTimeWindows(start_sec, end_sec, float(ProfileStep) * 60)
+                if not BBB_SharedFunctions.frequencies_dict_initialized:
+                    # The stop_times came from the result cache.
+                    BBB_SharedFunctions.MakeFrequenciesDict()
+                stopwindowevents = BBB_SharedFunctions.MakeStopEventsForTimeWindows(stoptimedict,
+                                    windows, BBB_SharedFunctions.frequencies_dict)
+                StopWindowStats = BBB_SharedFunctions.RetrieveStatsForSetsOfStopsForTimeWindows(
+                                    StopsDict, stopwindowevents, windows, CalcWaitTime)
+                fieldsuffixes = [BBB_SharedFunctions.MakeTimeWindowFieldSuffix(
+                                    window[0], window[1], ".shp" in outStops) for window in windows]
+                ProfileFields = BBB_SharedFunctions.WriteStatsForFieldSets(outStops,
+                                    "stop_id", StopWindowStats, fieldsuffixes)
+                arcpy.AddMessage("Time-of-day profile written to %i fields." % len(ProfileFields))
+                stage.rows = len(StopWindowStats)
+
+        except:
+            arcpy.AddError("Error calculating the time-of-day profile.")
+            raise
+
+    # ----- Calculate the statistics for the other days of the week -----
+    if CompareDays:
+        try:
+            arcpy.AddMessage("Calculating the number of transit trips on the other days of the week...")
+
+            with profiling.Stage("Other days of the week") as stage:
+                DayStats = BBB_SharedFunctions.RetrieveStatsForSetsOfStopsForDays(
+                                    StopsDict, daystoptimedict, CompareDays,
+                                    CalcWaitTime, start_sec, end_sec)
+                fieldsuffixes = ["_" + day[0:3] for day in CompareDays]
+                DayFields = BBB_SharedFunctions.WriteStatsForFieldSets(outStops,
+                                    "stop_id", DayStats, fieldsuffixes)
+                arcpy.AddMessage("Statistics for the other days of the week written to %i fields." % len(DayFields))
+                stage.rows = len(DayStats)
+
+        except:
+            arcpy.AddError("Error calculating the statistics for the other days of the week.")
+            raise
+
+    # ----- Calculate the statistics for the range of dates -----
+    if DateRange:
+        try:
+            arcpy.AddMessage("Calculating the number of transit trips on each date in the date range...")
+
+            with profiling.Stage("Date range") as stage:
+                # Dates with the same service_ids share one set of stop_times and
+                # one calculation.
+                datestoptimedict = BBB_SharedFunctions.CountTripsAtStopsForDates(
+                                    DateRange, start_sec, end_sec, DepOrArr)
+                DateStats = BBB_SharedFunctions.RetrieveTripStatsForDates(
+                                    StopsDict, datestoptimedict, DateRange,
+                                    start_sec, end_sec)
+                DateFields = BBB_SharedFunctions.WriteDateRangeStats(outStops,
+                                    "stop_id", DateStats)
+                arcpy.AddMessage("Statistics for %i dates written to %i fields." % (len(DateRange), len(DateFields)))
+                stage.rows = len(DateStats)
+
+        except:
+            arcpy.AddError("Error calculating the statistics for the date range.")
+            raise
+
+
     arcpy.AddMessage("Finished!")
     arcpy.AddMessage("Your output is located at " + outStops)
 
@@ -186,4 +323,8 @@ except CustomError:
 
 except:
     arcpy.AddError("Failed to count trips at stops.")
-    raise
\ No newline at end of file
+    raise
+
+finally:
+    # Show the timing of a run that failed or was canceled too.
+    profiling.Report()
\ No newline at end of file
@@ -36,10 +36,11 @@ are analyzing.  Step 1 will take a while to run for larger transit systems.
    limitations under the License.'''
 ################################################################################
 
-import os, sqlite3
+import os
 from shutil import copyfile
 import arcpy
 import BBB_SharedFunctions
+from bbb_core import featurestops, profiling
 
 
 class CustomError(Exception):
@@ -47,13 +48,13 @@ class CustomError(Exception):
 
 
 try:
+    profiling.Start("Count Trips in Polygon Buffers around Stops - Step 1")
 
 # ----- Set up the run -----
     try:
 
         # Figure out what version of ArcGIS they're running
-        ArcVersionInfo = arcpy.GetInstallInfo("desktop")
-        ArcVersion = BBB_SharedFunctions.ArcVersion = ArcVersionInfo['Version']
+        ArcVersion = BBB_SharedFunctions.DetermineArcVersion()
         ArcLicense = arcpy.ProductInfo()
         if ArcLicense != "ArcInfo":
             arcpy.AddError("To run this tool, you must have the Desktop \
@@ -87,8 +88,8 @@ Advanced (ArcInfo) license.  Your license type is: %s." % ArcLicense)
         SQLDbase = os.path.join(outGDBwPath, "Step1_GTFS.sql")
         copyfile(inSQLDbase, SQLDbase)
         # Connect to or create the SQL file.
-        conn = sqlite3.connect(SQLDbase)
-        c = BBB_SharedFunctions.c = conn.cursor()
+        conn = BBB_SharedFunctions.ConnectToSQLDatabase(SQLDbase)
+        c = BBB_SharedFunctions.c
 
         # Network Dataset for creating Service Areas
         inNetworkDataset = arcpy.GetParameterAsText(3)
@@ -114,6 +115,16 @@ Advanced (ArcInfo) license.  Your license type is: %s." % ArcLicense)
             TrimPolys = "NO_TRIM_POLYS"
             TrimPolysValue = ""
 
+        # Optional distance in meters for combining stops into one location for
+        # the service areas. Stops are combined by parent_station, and the other
+        # stops by a grid of cells this many meters wide (0 to combine by
+        # parent_station only). A combined location's service area serves all
+        # its stops. Parameters 8-10 are the derived outputs, so this comes
+        # after them.
+        CombineStopsTolerance = ""
+        if arcpy.GetArgumentCount() > 11:
+            CombineStopsTolerance = arcpy.GetParameterAsText(11).strip()
+
     except:
         arcpy.AddError("Error setting up run.")
         raise
@@ -123,7 +134,19 @@ Advanced (ArcInfo) license.  Your license type is: %s." % ArcLicense)
     try:
         # Create a feature class of transit stops
         arcpy.AddMessage("Creating a feature class of GTFS stops...")
-        StopsLayer, StopIDList = BBB_SharedFunctions.MakeStopsFeatureClass(os.path.join(outGDBwPath, "Step1_Stops"))
+        with profiling.Stage("Create stops feature class") as stage:
+            StopsLayer, StopIDList = BBB_SharedFunctions.MakeStopsFeatureClass(os.path.join(outGDBwPath, "Step1_Stops"))
+            # Make the service areas around one stop for each group of combined
+            # stops. {representative stop_id: [stop_id, ...]}
+            StopGroups = {}
+            SAStopsLayer = StopsLayer
+            if CombineStopsTolerance:
+                StopGroups = BBB_SharedFunctions.GetStopGroups(float(CombineStopsTolerance))
+                arcpy.AddMessage("Combined %i stops into %i locations for the network analysis." % \
+                            (len(StopIDList), len(StopGroups)))
+                SAStopsLayer = BBB_SharedFunctions.MakeStopsFeatureClass(
+                            os.path.join("in_memory", "Temp_CombinedStops"), list(StopGroups))[0]
+            stage.rows = len(StopIDList)
     except:
         arcpy.AddError("Error creating a feature class of GTFS stops.")
         raise
@@ -133,9 +156,12 @@ Advanced (ArcInfo) license.  Your license type is: %s." % ArcLicense)
     try:
         arcpy.AddMessage("Creating service areas around stops...")
         arcpy.AddMessage("(This step will take a while for large networks.)")
-        polygons = BBB_SharedFunctions.MakeServiceAreasAroundStops(StopsLayer,
-                            inNetworkDataset, impedanceAttribute, BufferSize,
-                            restrictions, TrimPolys, TrimPolysValue)
+        with profiling.Stage("Solve service areas"):
+            polygons = BBB_SharedFunctions.MakeServiceAreasAroundStops(SAStopsLayer,
+                                inNetworkDataset, impedanceAttribute, BufferSize,
+                                restrictions, TrimPolys, TrimPolysValue)
+            if CombineStopsTolerance:
+                arcpy.management.Delete(SAStopsLayer)
     except:
         arcpy.AddError("Error creating service areas around stops.")
         raise
@@ -147,124 +173,126 @@ Advanced (ArcInfo) license.  Your license type is: %s." % ArcLicense)
         arcpy.AddMessage("Reformatting polygons for further analysis...")
         arcpy.AddMessage("(This step will take a while for large networks.)")
 
-        polycopy = os.path.join(outGDBwPath, "Temp_Polygons")
-        if ArcVersion == "10.0":
-            # For some reason, passing an NALayer reference object to FeatureToPolygon
-            # in PostProcessPolys() causes ArcMap 10.0 to crash.  Avoid this
-            # by saving the layer to a feature class and passing the path.
-            arcpy.management.CopyFeatures(polygons, polycopy)
-            polygons = polycopy
-
-
-        # ----- Flatten the overlapping service area polygons -----
-
-        # Use World Cylindrical Equal Area (WKID 54034) to ensure proper use of cluster tolerance in meters
-        arcpy.env.outputCoordinateSystem = BBB_SharedFunctions.WorldCylindrical
-
-        # Flatten the overlapping polygons.  This will ultimately be our output.
-        # Dummy points to use in FeatureToPolygon to get rid of unnecessary fields.
-        dummypoints = arcpy.management.CreateFeatureclass("in_memory",
-                                                            "DummyPoints", "POINT")
-
-        # The flattened polygons will be our ultimate output in the end (final
-        # output of step 2).
-        FlatPolys = os.path.join(outGDBwPath, "Step1_FlatPolys")
-        # FeatureToPolygon flattens overalpping polys.
-        # Set a large cluster tolerance to eliminate small sliver polygons and to
-        # keep the output file size down.  Boundaries may move up to the distance
-        # specified in the cluster tolerance, but some amount of movement is
-        # acceptable, as service area polygons are inexact anyway.
-        # The large cluster tolerance may cause some geometry issues with the output
-        # later, but this is the best solution I've found so far that doesn't eat
-        # up too much analysis time and memory
-        clusTol = "5 meters"
-        arcpy.management.FeatureToPolygon(polygons, FlatPolys, clusTol, "", dummypoints)
-        arcpy.management.Delete(dummypoints)
-
-        # Add a field to the output file for number of trips and num trips / hour.
-        # Also create a polygon id field so we can keep track of them.
-        arcpy.management.AddField(FlatPolys, "PolyID", "LONG")
-        arcpy.management.AddField(FlatPolys, "NumTrips", "LONG")
-        arcpy.management.AddField(FlatPolys, "NumTripsPerHr", "DOUBLE")
-        arcpy.management.AddField(FlatPolys, "NumStopsInRange", "LONG")
-        arcpy.management.AddField(FlatPolys, "MaxWaitTime", "DOUBLE")
-
-
-        # ----- Create stacked points, one for each original SA polygon -----
-
-        # Create points for use in the Identity tool (one point per poly)
-        FlattenedPoints = os.path.join(outGDBwPath, "Step1_FlattenedPoints")
-        arcpy.management.FeatureToPoint(FlatPolys, FlattenedPoints, "INSIDE")
-
-        # Use Identity to stack points and keep the stop_ids from the original SAs.
-        # Results in a points layer with fields ORIG_FID for the IDs of the
-        # flattened polygons and a stop_id column with the stop ids.
-        # Points are stacked, and each has only one stop_id.
-        StackedPoints = os.path.join(outGDBwPath, "Step1_StackedPoints")
-        arcpy.analysis.Identity(FlattenedPoints, polygons, StackedPoints)
-        arcpy.management.Delete(FlattenedPoints)
-
-
-        # ----- Read the Stacked Points into an SQL table -----
-
-        # Create a SQL table associating the Polygon FID with the stop_ids that serve it.
-        c.execute("DROP TABLE IF EXISTS StackedPoints;")
-        schema = "Polygon_FID LONG, stop_id TEXT"
-        create_stmt = "CREATE TABLE StackedPoints (%s);" % schema
-        c.execute(create_stmt)
-
-        # Add data to the table. Track Polygon IDs with no associated stop_ids so we can delete them.
-        FIDsToDelete = []
-        AddToStackedPts = []
-        if ArcVersion == "10.0":
-            StackedPtCursor = arcpy.SearchCursor(StackedPoints, "", "", "ORIG_FID; stop_id")
-            for row in StackedPtCursor:
-                if not row.stop_id:
-                    FIDsToDelete.append(row.ORIG_FID)
-                else:
-                    AddToStackedPts.append((row.ORIG_FID, row.stop_id,))
-        else:
-            StackedPtCursor = arcpy.da.SearchCursor(StackedPoints, ["ORIG_FID", "stop_id"])
-            for row in StackedPtCursor:
-                if not row[1]:
-                    FIDsToDelete.append(row[0])
-                else:
-                    AddToStackedPts.append((row[0], row[1],))
-        del StackedPtCursor
-        # Add the OD items to the SQL table
-        c.executemany('''INSERT INTO StackedPoints \
-                        (Polygon_FID, stop_id) \
-                        VALUES (?, ?);''', AddToStackedPts)
-        conn.commit()
-        arcpy.management.Delete(StackedPoints)
-        FIDsToDelete = set(FIDsToDelete)
-
-
-        # ----- Delete polygons not associated with any stop_ids -----
-        # These were generated by the FeatureToPolygon tool in areas completely
-        # surrounded by other polygons and aren't associated with any stops.
-
-        # Make feature layer containing only the polygons we want to delete.
-        desc2 = arcpy.Describe(FlatPolys)
-        OutputOIDName = desc2.OIDFieldName
-        # Anything with 0 area will just cause problems later.
-        WhereClause = '"Shape_Area" = 0'
-        if FIDsToDelete:
-            WhereClause += ' OR "' + OutputOIDName + '" IN ('
-            for FID in FIDsToDelete:
-                WhereClause += str(FID) + ", "
-            WhereClause = WhereClause[:-2] + ")"
-        arcpy.management.MakeFeatureLayer(FlatPolys, "FlatPolysLayer", WhereClause)
-
-        # Delete the polygons that don't correspond to any stop_ids.
-        arcpy.management.DeleteFeatures("FlatPolysLayer")
-
-
-        # ----- Populate the PolyID field -----
-
-        # Set PolyID equal to the OID.
-        expression = "!" + OutputOIDName + "!"
-        arcpy.management.CalculateField(FlatPolys, "PolyID", expression, "PYTHON")
+        with profiling.Stage("Reformat polygons"):
+            polycopy = os.path.join(outGDBwPath, "Temp_Polygons")
+            if ArcVersion == "10.0":
+                # For some reason, passing an NALayer reference object to FeatureToPolygon
+                # in PostProcessPolys() causes ArcMap 10.0 to crash.  Avoid this
+                # by saving the layer to a feature class and passing the path.
+                arcpy.management.CopyFeatures(polygons, polycopy)
+                polygons = polycopy
+
+
+            # ----- Flatten the overlapping service area polygons -----
+
+            # Use World Cylindrical Equal Area (WKID 54034) to ensure proper use of cluster tolerance in meters
+            arcpy.env.outputCoordinateSystem = BBB_SharedFunctions.WorldCylindrical
+
+            # Flatten the overlapping polygons.  This will ultimately be our output.
+            # Dummy points to use in FeatureToPolygon to get rid of unnecessary fields.
+            dummypoints = arcpy.management.CreateFeatureclass("in_memory",
+                                                                "DummyPoints", "POINT")
+
+            # The flattened polygons will be our ultimate output in the end (final
+            # output of step 2).
+            FlatPolys = os.path.join(outGDBwPath, "Step1_FlatPolys")
+            # FeatureToPolygon flattens overalpping polys.
+            # Set a large cluster tolerance to eliminate small sliver polygons and to
+            # keep the output file size down.  Boundaries may move up to the distance
+            # specified in the cluster tolerance, but some amount of movement is
+            # acceptable, as service area polygons are inexact anyway.
+            # The large cluster tolerance may cause some geometry issues with the output
+            # later, but this is the best solution I've found so far that doesn't eat
+            # up too much analysis time and memory
+            clusTol = "5 meters"
+            arcpy.management.FeatureToPolygon(polygons, FlatPolys, clusTol, "", dummypoints)
+            arcpy.management.Delete(dummypoints)
+
+            # Add a field to the output file for number of trips and num trips / hour.
+            # Also create a polygon id field so we can keep track of them.
+            arcpy.management.AddField(FlatPolys, "PolyID", "LONG")
+            arcpy.management.AddField(FlatPolys, "NumTrips", "LONG")
+            arcpy.management.AddField(FlatPolys, "NumTripsPerHr", "DOUBLE")
+            arcpy.management.AddField(FlatPolys, "NumStopsInRange", "LONG")
+            arcpy.management.AddField(FlatPolys, "MaxWaitTime", "DOUBLE")
+
+
+            # ----- Create stacked points, one for each original SA polygon -----
+
+            # Create points for use in the Identity tool (one point per poly)
+            FlattenedPoints = os.path.join(outGDBwPath, "Step1_FlattenedPoints")
+            arcpy.management.FeatureToPoint(FlatPolys, FlattenedPoints, "INSIDE")
+
+            # Use Identity to stack points and keep the stop_ids from the original SAs.
+            # Results in a points layer with fields ORIG_FID for the IDs of the
+            # flattened polygons and a stop_id column with the stop ids.
+            # Points are stacked, and each has only one stop_id.
+            StackedPoints = os.path.join(outGDBwPath, "Step1_StackedPoints")
+            arcpy.analysis.Identity(FlattenedPoints, polygons, StackedPoints)
+            arcpy.management.Delete(FlattenedPoints)
+
+
+            # ----- Read the Stacked Points into SQL tables -----
+
+            # Save the stop_ids that serve each Polygon FID to SQL tables: a stop
+            # dictionary, one row of packed stop indexes for each unique set of
+            # stops, and the set of stops serving each polygon.
+            # Track Polygon IDs with no associated stop_ids so we can delete them.
+            FIDsToDelete = []
+            StackedPtsBuilder = featurestops.FeatureStopsCSRBuilder()
+            if ArcVersion == "10.0":
+                StackedPtCursor = arcpy.SearchCursor(StackedPoints, "", "", "ORIG_FID; stop_id")
+                for row in StackedPtCursor:
+                    if not row.stop_id:
+                        FIDsToDelete.append(row.ORIG_FID)
+                    else:
+                        # A combined location's service area serves all its stops.
+                        for stop_id in StopGroups.get(row.stop_id, [row.stop_id]):
+                            StackedPtsBuilder.Add(row.ORIG_FID, stop_id)
+            else:
+                StackedPtCursor = arcpy.da.SearchCursor(StackedPoints, ["ORIG_FID", "stop_id"])
+                for row in StackedPtCursor:
+                    if not row[1]:
+                        FIDsToDelete.append(row[0])
+                    else:
+                        # A combined location's service area serves all its stops.
+                        for stop_id in StopGroups.get(row[1], [row[1]]):
+                            StackedPtsBuilder.Add(row[0], stop_id)
+            del StackedPtCursor
+            # Add the stops serving each polygon to the SQL tables
+            c.execute("DROP TABLE IF EXISTS StackedPoints;")
+            featurestops.SaveFeatureStops(c, StackedPtsBuilder.Finish(), "StackedPoints")
+            del StackedPtsBuilder
+            conn.commit()
+            arcpy.management.Delete(StackedPoints)
+            FIDsToDelete = set(FIDsToDelete)
+
+
+            # ----- Delete polygons not associated with any stop_ids -----
+            # These were generated by the FeatureToPolygon tool in areas completely
+            # surrounded by other polygons and aren't associated with any stops.
+
+            # Make feature layer containing only the polygons we want to delete.
+            desc2 = arcpy.Describe(FlatPolys)
+            OutputOIDName = desc2.OIDFieldName
+            # Anything with 0 area will just cause problems later.
+            WhereClause = '"Shape_Area" = 0'
+            if FIDsToDelete:
+                WhereClause += ' OR "' + OutputOIDName + '" IN ('
+                for FID in FIDsToDelete:
+                    WhereClause += str(FID) + ", "
+                WhereClause = WhereClause[:-2] + ")"
+            arcpy.management.MakeFeatureLayer(FlatPolys, "FlatPolysLayer", WhereClause)
+
+            # Delete the polygons that don't correspond to any stop_ids.
+            arcpy.management.DeleteFeatures("FlatPolysLayer")
+
+
+            # ----- Populate the PolyID field -----
+
+            # Set PolyID equal to the OID.
+            expression = "!" + OutputOIDName + "!"
+            arcpy.management.CalculateField(FlatPolys, "PolyID", expression, "PYTHON")
 
 
     except:
@@ -294,4 +322,6 @@ except:
     raise
 
 finally:
+    # Show the timing of a run that failed or was canceled too.
+    profiling.Report()
     arcpy.CheckInExtension("Network")
\ No newline at end of file
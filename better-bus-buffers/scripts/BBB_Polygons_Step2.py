@@ -31,9 +31,10 @@ Step 2: Count Trips in Buffers uses the template feature class created in Step
    limitations under the License.'''
 ################################################################################
 
-import os, sqlite3
+import os
 import arcpy
 import BBB_SharedFunctions
+from bbb_core import featurestops, profiling
 
 class CustomError(Exception):
     pass
@@ -42,6 +43,7 @@ OverwriteOutput = None
 
 
 try:
+    profiling.Start("Count Trips in Polygon Buffers around Stops - Step 2")
 
     # ----- Set up the run -----
     try:
@@ -52,8 +54,8 @@ try:
         FlatPolys = os.path.join(inStep1GDB, "Step1_FlatPolys")
         SQLDbase = os.path.join(inStep1GDB, "Step1_GTFS.sql")
         # Connect to the SQL database
-        conn = sqlite3.connect(SQLDbase)
-        c = BBB_SharedFunctions.c = conn.cursor()
+        conn = BBB_SharedFunctions.ConnectToSQLDatabase(SQLDbase)
+        c = BBB_SharedFunctions.c
 
         # Output file designated by user
         outFile = arcpy.GetParameterAsText(1)
@@ -89,9 +91,39 @@ try:
         elif TravelFromTo == "Arrivals":
             DepOrArr = "arrival_time"
 
+        # Optional time-of-day profile: the length in minutes of the consecutive
+        # time windows to count trips in, in addition to the whole time window.
+        ProfileStep = ""
+        if arcpy.GetArgumentCount() > 7:
+            ProfileStep = arcpy.GetParameterAsText(7)
+
+        # Optional list of other weekdays to count trips on in the same time
+        # window, for comparison with the main day of the week.
+        CompareDays = []
+        if arcpy.GetArgumentCount() > 8 and arcpy.GetParameterAsText(8):
+            CompareDays = arcpy.GetParameterAsText(8).split(";")
+
+        # Optional headway statistics: the median and 90th percentile headway,
+        # the coefficient of variation of the headways, and the expected wait.
+        # These need numpy.
+        CalcHeadwayStats = False
+        if arcpy.GetArgumentCount() > 9:
+            CalcHeadwayStats = arcpy.GetParameterAsText(9) == "true"
+
+        # Optional range of specific dates (YYYYMMDD) to count trips on in the same
+        # time window. The mean, min, and max number of trips over the dates are
+        # reported, so holidays and other calendar_dates exceptions are included.
+        DateRange = []
+        if arcpy.GetArgumentCount() > 11 and arcpy.GetParameterAsText(10) and arcpy.GetParameterAsText(11):
+            DateRange = BBB_SharedFunctions.MakeDateRange(
+                            BBB_SharedFunctions.parse_date(arcpy.GetParameterAsText(10)),
+                            BBB_SharedFunctions.parse_date(arcpy.GetParameterAsText(11)))
+            if not DateRange:
+                arcpy.AddError("Your date range ends before it starts.")
+                raise CustomError
+
         # Figure out what version of ArcGIS they're running
-        ArcVersionInfo = arcpy.GetInstallInfo("desktop")
-        ArcVersion = ArcVersionInfo['Version']
+        ArcVersion = BBB_SharedFunctions.DetermineArcVersion()
 
         # It's okay to overwrite stuff.
         OverwriteOutput = arcpy.env.overwriteOutput # Get the orignal value so we can reset it.
@@ -106,8 +138,21 @@ try:
     try:
         arcpy.AddMessage("Counting transit trips during the time window...")
 
-        # Get a dictionary of stop times in our time window {stop_id: [[trip_id, stop_time]]}
-        stoptimedict = BBB_SharedFunctions.CountTripsAtStops(DayOfWeek, start_sec, end_sec, DepOrArr)
+        with profiling.Stage("Count trips") as stage:
+            # Get a dictionary of stop times in our time window {stop_id: [[trip_id, stop_time]]}
+            # Days with the same service_ids as the main day share its stop_times.
+            daystoptimedict = BBB_SharedFunctions.CountTripsAtStopsForDays(
+                                [DayOfWeek] + CompareDays, start_sec, end_sec, DepOrArr)
+            stoptimedict = daystoptimedict[DayOfWeek]
+            # Index the trips at each stop as bitsets {stop_id: tripbits} so unique
+            # trips can be counted without hashing trip_ids for every output feature.
+            stoptripbits = BBB_SharedFunctions.MakeStopTripBitsets(stoptimedict)
+            # Sort the stop times at each stop once so the stop times for sets of
+            # stops can be merged when calculating the max wait time and headways.
+            sortedstoptimes = None
+            if CalcWaitTime == "true" or CalcHeadwayStats:
+                sortedstoptimes = BBB_SharedFunctions.MakeSortedStopTimes(stoptimedict)
+            stage.rows = len(stoptimedict)
 
     except:
         arcpy.AddError("Failed to count transit trips during the time window.")
@@ -117,114 +162,223 @@ try:
     #----- Find which stops serve each polygon -----
     try:
         arcpy.AddMessage("Retrieving list of stops associated with each polygon...")
-        # Find the stop_ids associated with each flattened polygon and put them in
-        # a dictionary. {ORIG_FID: [stop_id, stop_id,...]}
-        stackedpointdict = {}
-        GetStackedPtsStmt = "SELECT * FROM StackedPoints"
-        c.execute(GetStackedPtsStmt)
-        StackedPts = c.fetchall()
-        for PolyFID in StackedPts:
-            stackedpointdict.setdefault(PolyFID[0], []).append(str(PolyFID[1]))
+        with profiling.Stage("Get stops for polygons") as stage:
+            if "StackedPointsFeatures" in BBB_SharedFunctions.GetGTFSTableNames():
+                # Load the unique sets of stops and the set serving each flattened
+                # polygon from the packed tables written by Step 1.
+                stackedpointdict = featurestops.LoadFeatureStops(c, "StackedPoints")
+            else:
+                # Step 1 output from an older version of the tool.
+                # Find the stop_ids associated with each flattened polygon and put them in
+                # a dictionary. {ORIG_FID: [stop_id, stop_id,...]}
+                stackedpointdict = {}
+                GetStackedPtsStmt = "SELECT * FROM StackedPoints"
+                c.execute(GetStackedPtsStmt)
+                StackedPts = c.fetchall()
+                for PolyFID in StackedPts:
+                    stackedpointdict.setdefault(PolyFID[0], []).append(str(PolyFID[1]))
+            stage.rows = len(stackedpointdict)
     except:
         arcpy.AddError("Error retrieving list of stops associated with each polygon.")
         raise
 
 
+    #----- Calculate the statistics for each polygon -----
+    try:
+        arcpy.AddMessage("Calculating statistics for each polygon...")
+        with profiling.Stage("Calculate polygon statistics") as stage:
+            # Flattened polygons list the same stops over and over, so calculate the
+            # statistics once for each unique set of stops.
+            # {ORIG_FID: (NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime)},
+            # followed by the headway statistics if they were asked for
+            PolyStats = BBB_SharedFunctions.RetrieveStatsForSetsOfStops(
+                                stackedpointdict, stoptimedict, CalcWaitTime,
+                                start_sec, end_sec, stoptripbits, sortedstoptimes,
+                                CalcHeadwayStats)
+            stage.rows = len(PolyStats)
+    except:
+        arcpy.AddError("Error calculating statistics for each polygon.")
+        raise
+
+
     # ----- Generate output data -----
     try:
         arcpy.AddMessage("Writing output data...")
 
-        # Create the output file from FlatPolys.  We don't want to overwrite the
-        # original Step 1 template file.
-        arcpy.management.CopyFeatures(FlatPolys, outFile)
-        badpolys = []
+        with profiling.Stage("Write output") as stage:
+            # Create the output file from FlatPolys.  We don't want to overwrite the
+            # original Step 1 template file.
+            arcpy.management.CopyFeatures(FlatPolys, outFile)
+            badpolys = []
+
+            if ArcVersion == "10.0":
+                if ".shp" in outFilename:
+                    ucursor = arcpy.UpdateCursor(outFile, "", "",
+                                            "PolyID; NumTrips; NumTripsPe; NumStopsIn; MaxWaitTim")
+                    for row in ucursor:
+                        try:
+                            NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
+                                        PolyStats[str(row.getValue("PolyID"))][:4]
+                        except KeyError:
+                            badpolys.append(str(row.getValue("PolyID")))
+                            continue
+                        row.NumTrips = NumTrips
+                        row.TripsPerHr = NumTripsPerHr
+                        row.NumStops = NumStopsInRange
+                        if MaxWaitTime == None:
+                            row.MaxWaitTm = -1
+                        else:
+                            row.MaxWaitTm = MaxWaitTime
+                        ucursor.updateRow(row)
+                else:
+                    ucursor = arcpy.UpdateCursor(outFile, "", "",
+                                            "PolyID; NumTrips; NumTripsPerHr; NumStopsInRange; MaxWaitTime")
+                    for row in ucursor:
+                        try:
+                            NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
+                                        PolyStats[str(row.getValue("PolyID"))][:4]
+                        except KeyError:
+                            badpolys.append(str(row.getValue("PolyID")))
+                            continue
+                        row.NumTrips = NumTrips
+                        row.NumTripsPerHr = NumTripsPerHr
+                        row.NumStopsInRange = NumStopsInRange
+                        row.MaxWaitTime = MaxWaitTime
+                        ucursor.updateRow(row)
 
-        if ArcVersion == "10.0":
-            if ".shp" in outFilename:
-                ucursor = arcpy.UpdateCursor(outFile, "", "",
-                                        "PolyID; NumTrips; NumTripsPe; NumStopsIn; MaxWaitTim")
-                for row in ucursor:
-                    try:
-                        ImportantStops = stackedpointdict[str(row.getValue("PolyID"))]
-                    except KeyError:
-                        badpolys.append(str(row.getValue("PolyID")))
-                        continue
-                    NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
-                                BBB_SharedFunctions.RetrieveStatsForSetOfStops(
-                                    ImportantStops, stoptimedict, CalcWaitTime,
-                                    start_sec, end_sec)
-                    row.NumTrips = NumTrips
-                    row.TripsPerHr = NumTripsPerHr
-                    row.NumStops = NumStopsInRange
-                    if MaxWaitTime == None:
-                        row.MaxWaitTm = -1
-                    else:
-                        row.MaxWaitTm = MaxWaitTime
-                    ucursor.updateRow(row)
             else:
-                ucursor = arcpy.UpdateCursor(outFile, "", "",
-                                        "PolyID; NumTrips; NumTripsPerHr; NumStopsInRange; MaxWaitTime")
+                if ".shp" in outFilename:
+                    ucursor = arcpy.da.UpdateCursor(outFile,
+                                                    ["PolyID", "NumTrips",
+                                                     "NumTripsPe", "NumStopsIn",
+                                                     "MaxWaitTim"])
+                else:
+                    ucursor = arcpy.da.UpdateCursor(outFile,
+                                                ["PolyID", "NumTrips",
+                                                 "NumTripsPerHr", "NumStopsInRange",
+                                                 "MaxWaitTime"])
                 for row in ucursor:
                     try:
-                        ImportantStops = stackedpointdict[str(row.getValue("PolyID"))]
+                        NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
+                                    PolyStats[int(row[0])][:4]
                     except KeyError:
-                        badpolys.append(str(row.getValue("PolyID")))
+                        # If we got a KeyError here, then an output polygon never
+                        # got a point associated with it, probably the result of a
+                        # geometry problem because of the large cluster tolerance
+                        # used to generate the polygons in Step 1. Just skip this
+                        # polygon and alert the user.
+                        badpolys.append(row[0])
                         continue
-                    NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
-                                BBB_SharedFunctions.RetrieveStatsForSetOfStops(
-                                    ImportantStops, stoptimedict, CalcWaitTime,
-                                    start_sec, end_sec)
-                    row.NumTrips = NumTrips
-                    row.NumTripsPerHr = NumTripsPerHr
-                    row.NumStopsInRange = NumStopsInRange
-                    row.MaxWaitTime = MaxWaitTime
+                    row[1] = NumTrips
+                    row[2] = NumTripsPerHr
+                    row[3] = NumStopsInRange
+                    if ".shp" in outFilename and MaxWaitTime == None:
+                        row[4] = -1
+                    else:
+                        row[4] = MaxWaitTime
                     ucursor.updateRow(row)
 
-        else:
-            if ".shp" in outFilename:
-                ucursor = arcpy.da.UpdateCursor(outFile,
-                                                ["PolyID", "NumTrips",
-                                                 "NumTripsPe", "NumStopsIn",
-                                                 "MaxWaitTim"])
-            else:
-                ucursor = arcpy.da.UpdateCursor(outFile,
-                                            ["PolyID", "NumTrips",
-                                             "NumTripsPerHr", "NumStopsInRange",
-                                             "MaxWaitTime"])
-            for row in ucursor:
-                try:
-                    ImportantStops = stackedpointdict[int(row[0])]
-                except KeyError:
-                    # If we got a KeyError here, then an output polygon never
-                    # got a point associated with it, probably the result of a
-                    # geometry problem because of the large cluster tolerance
-                    # used to generate the polygons in Step 1. Just skip this
-                    # polygon and alert the user.
-                    badpolys.append(row[0])
-                    continue
-                NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
-                                BBB_SharedFunctions.RetrieveStatsForSetOfStops(
-                                    ImportantStops, stoptimedict, CalcWaitTime,
-                                    start_sec, end_sec)
-                row[1] = NumTrips
-                row[2] = NumTripsPerHr
-                row[3] = NumStopsInRange
-                if ".shp" in outFilename and MaxWaitTime == None:
-                    row[4] = -1
-                else:
-                    row[4] = MaxWaitTime
-                ucursor.updateRow(row)
-
-        if badpolys:
-            arcpy.AddWarning("Warning! BetterBusBuffers could not calculate trip \
+            if badpolys:
+                arcpy.AddWarning("Warning! BetterBusBuffers could not calculate trip \
 statistics for one or more polygons due to a geometry issue. These polygons will \
 appear in your output data, but all output values will be null. Bad polygon \
 PolyID values: " + str(badpolys))
+            stage.rows = len(PolyStats)
 
     except:
         arcpy.AddMessage("Error writing output.")
         raise
 
+
+    # ----- Write the headway statistics -----
+    if CalcHeadwayStats:
+        try:
+            arcpy.AddMessage("Writing the headway statistics...")
+
+            with profiling.Stage("Write headway statistics") as stage:
+                # They were calculated with the other statistics. Bad polygons
+                # were already reported above and are left null.
+                HeadwayFields = BBB_SharedFunctions.WriteHeadwayStats(outFile,
+                                    "PolyID", PolyStats, idconverter=int)
+                arcpy.AddMessage("Headway statistics written to %i fields." % len(HeadwayFields))
+                stage.rows = len(PolyStats)
+
+        except:
+            arcpy.AddError("Error writing the headway statistics.")
+            raise
+
+    # ----- Calculate the time-of-day profile -----
+    if ProfileStep:
+        try:
+            arcpy.AddMessage("Calculating the time-of-day profile...")
+
+            with profiling.Stage("Time-of-day profile") as stage:
+                # The stop times for the whole time window are already loaded, so
+                # just split them into the profile's time windows.
+                windows = BBB_SharedFunctions.MakeTimeWindows(start_sec, end_sec, float(ProfileStep) * 60)
+                if not BBB_SharedFunctions.frequencies_dict_initialized:
+                    # The stop_times came from the result cache.
+                    BBB_SharedFunctions.MakeFrequenciesDict()
+                stopwindowevents = BBB_SharedFunctions.MakeStopEventsForTimeWindows(stoptimedict,
+                                    windows, BBB_SharedFunctions.frequencies_dict)
+                PolyWindowStats = BBB_SharedFunctions.RetrieveStatsForSetsOfStopsForTimeWindows(
+                                    stackedpointdict, stopwindowevents, windows, CalcWaitTime)
+                fieldsuffixes = [BBB_SharedFunctions.MakeTimeWindowFieldSuffix(
+                                    window[0], window[1], ".shp" in outFilename) for window in windows]
+                # Bad polygons were already reported above and are left null.
+                ProfileFields = BBB_SharedFunctions.WriteStatsForFieldSets(outFile,
+                                    "PolyID", PolyWindowStats, fieldsuffixes,
+                                    idconverter=int)
+                arcpy.AddMessage("Time-of-day profile written to %i fields." % len(ProfileFields))
+                stage.rows = len(PolyWindowStats)
+
+        except:
+            arcpy.AddError("Error calculating the time-of-day profile.")
+            raise
+
+    # ----- Calculate the statistics for the other days of the week -----
+    if CompareDays:
+        try:
+            arcpy.AddMessage("Calculating the number of transit trips on the other days of the week...")
+
+            with profiling.Stage("Other days of the week") as stage:
+                DayStats = BBB_SharedFunctions.RetrieveStatsForSetsOfStopsForDays(
+                                    stackedpointdict, daystoptimedict, CompareDays,
+                                    CalcWaitTime, start_sec, end_sec)
+                fieldsuffixes = ["_" + day[0:3] for day in CompareDays]
+                DayFields = BBB_SharedFunctions.WriteStatsForFieldSets(outFile,
+                                    "PolyID", DayStats, fieldsuffixes,
+                                    idconverter=int)
+                arcpy.AddMessage("Statistics for the other days of the week written to %i fields." % len(DayFields))
+                stage.rows = len(DayStats)
+
+        except:
+            arcpy.AddError("Error calculating the statistics for the other days of the week.")
+            raise
+
+    # ----- Calculate the statistics for the range of dates -----
+    if DateRange:
+        try:
+            arcpy.AddMessage("Calculating the number of transit trips on each date in the date range...")
+
+            with profiling.Stage("Date range") as stage:
+                # Dates with the same service_ids share one set of stop_times and
+                # one calculation.
+                datestoptimedict = BBB_SharedFunctions.CountTripsAtStopsForDates(
+                                    DateRange, start_sec, end_sec, DepOrArr)
+                DateStats = BBB_SharedFunctions.RetrieveTripStatsForDates(
+                                    stackedpointdict, datestoptimedict, DateRange,
+                                    start_sec, end_sec)
+                DateFields = BBB_SharedFunctions.WriteDateRangeStats(outFile,
+                                    "PolyID", DateStats, idconverter=int)
+                arcpy.AddMessage("Statistics for %i dates written to %i fields." % (len(DateRange), len(DateFields)))
+                stage.rows = len(DateStats)
+
+        except:
+            arcpy.AddError("Error calculating the statistics for the date range.")
+            raise
+
+
     arcpy.AddMessage("Finished!")
     arcpy.AddMessage("Your output is located at " + outFile)
 
@@ -237,5 +391,7 @@ except:
     raise
 
 finally:
+    # Show the timing of a run that failed or was canceled too.
+    profiling.Report()
     # Reset overwriteOutput to what it was originally.
     arcpy.env.overwriteOutput = OverwriteOutput
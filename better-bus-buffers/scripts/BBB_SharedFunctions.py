@@ -4,7 +4,9 @@
 ## Created by: Melinda Morang, Esri, mmorang@esri.com
 ## Last updated: 23 October 2015
 ############################################################################
-''' This file contains shared functions used by various BetterBusBuffers tools.'''
+''' This file contains shared functions used by various BetterBusBuffers tools.
+The trip counting and statistics are done by the arcpy-free bbb_core package;
+this file adds the ArcGIS parts and module-level wrappers for the tools.'''
 ################################################################################
 '''Copyright 2015 Esri
    Licensed under the Apache License, Version 2.0 (the "License");
@@ -18,8 +20,26 @@
    limitations under the License.'''
 ################################################################################
 
-import sqlite3, os, operator
-import arcpy
+import os, sys
+from bbb_core import messages, sacache, sqltrace
+from bbb_core.gtfs import AnalysisContext, SecsInDay, days, parse_time, \
+    parse_date, MakeDateRange
+from bbb_core.stats import MakeStopTripBitsets, CountBits, MakeSortedStopTimes, \
+    MergeStopTimes, RetrieveStatsForSetOfStops, InternStopSets, \
+    RetrieveStatsForSetsOfStops, ReportStopSetCacheStats, \
+    RetrieveStatsForSetsOfStopsForDays, RetrieveTripStatsForDates, \
+    RetrieveHeadwayStatsForSetOfStops, CalculateMaxWaitTime, \
+    CalculateHeadwayStats, MakeTimeWindows, MakeStopEventsForTimeWindows, \
+    RetrieveStatsForSetOfStopsForTimeWindows, \
+    RetrieveStatsForSetsOfStopsForTimeWindows, MakeTimeWindowFieldSuffix
+
+# arcpy is imported by ImportArcpy() when it's first needed, unless the
+# calling tool has already imported it.
+arcpy = sys.modules.get("arcpy")
+
+# Show the messages from bbb_core in the tool dialog
+if arcpy:
+    messages.handler = arcpy
 
 # sqlite cursor - must be set from the script calling the functions explicitly
 # or using the ConnectToSQLDatabase() function
@@ -53,377 +73,111 @@ PARAMETER['Central_Meridian',0.0],PARAMETER['Standard_Parallel_1',0.0], \
 UNIT['Meter',1.0]];-20037700 -6364000 10000;-100000 10000;-100000 10000; \
 5;0.001;0.001;IsHighPrecision"
 
-# Number of seconds in a day.
-SecsInDay = 86400
+def ModuleGlobalProperty(name):
+    '''Make a property that reads and writes the module global with this name.'''
+    def getter(self):
+        return globals()[name]
+    def setter(self, value):
+        globals()[name] = value
+    return property(getter, setter)
 
-# Days of the week
-days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+class ModuleGlobalsContext(AnalysisContext):
+    '''The context used by the module-level functions. Its state lives in the
+    module globals (c, ConsiderYesterday, ...), so scripts that set
+    BBB_SharedFunctions.c directly keep working.'''
+    c = ModuleGlobalProperty("c")
+    ConsiderYesterday = ModuleGlobalProperty("ConsiderYesterday")
+    ConsiderTomorrow = ModuleGlobalProperty("ConsiderTomorrow")
+    frequencies_dict_initialized = ModuleGlobalProperty("frequencies_dict_initialized")
+    frequencies_dict = ModuleGlobalProperty("frequencies_dict")
+
+    def __init__(self):
+        self.conn = None
+
+
+ModuleContext = ModuleGlobalsContext()
 
 
 def MakeServiceIDList(day):
     '''Find the service ids for the selected day of the week and check for
     non-overlapping date ranges.'''
+    return ModuleContext.MakeServiceIDList(day)
 
-    # Find the service_ids that describe trips on our selected days of the week.
-    serviceidlist = []
-    startdatedict = {}
-    enddatedict = {}
-    serviceidfetch = '''
-        SELECT service_id, start_date, end_date FROM calendar
-        WHERE %s == "1"
-        ;''' % day.lower()
-    c.execute(serviceidfetch)
-    ids = c.fetchall()
-    for id in ids:
-        # Add to the list of service_ids
-        serviceidlist.append(id[0])
-        startdatedict[id[0]] = id[1]
-        enddatedict[id[0]] = id[2]
-
-    # Check for non-overlapping date ranges to prevent double-counting.
-    nonoverlappingsids = []
-    for sid in serviceidlist:
-        for eid in serviceidlist:
-            if startdatedict[sid] > enddatedict[eid]:
-                nonoverlappingsids.append((sid, eid))
-
-    return serviceidlist, nonoverlappingsids
+
+def MakeServiceIDListForDate(date):
+    '''Find the service ids running on a specific date, including the
+    calendar_dates exceptions.'''
+    return ModuleContext.MakeServiceIDListForDate(date)
 
 
 def GetServiceIDListsAndNonOverlaps(DayOfWeek, start_sec, end_sec, DepOrArr):
     ''' Get the lists of service ids for today, yesterday, and tomorrow, and
     combine non-overlapping date range list for all days'''
-
-    # Determine if it's early enough in the day that we need to consider trips
-    # still running from yesterday - these set global variables
-    if not ConsiderYesterday:
-        ShouldConsiderYesterday(start_sec, DepOrArr)
-    # If our time window spans midnight, we need to check tomorrow's trips, too.
-    if not ConsiderTomorrow:
-        ShouldConsiderTomorrow(end_sec)
-    # And what weekdays are yesterday and tomorrow?
-    Yesterday = days[(days.index(DayOfWeek) - 1)%7] # %7 wraps it around
-    Tomorrow = days[(days.index(DayOfWeek) + 1)%7] # %7 wraps it around
-
-    try:
-        # Get the service ids applicable for the current day of the week
-        # Furthermore, get list of service ids with non-overlapping date ranges.
-        serviceidlist, nonoverlappingsids = MakeServiceIDList(DayOfWeek)
-
-        # If we need to consider yesterday's trips, get the service ids.
-        serviceidlist_yest = []
-        nonoverlappingsids_yest = []
-        if ConsiderYesterday:
-            serviceidlist_yest, nonoverlappingsids_yest = MakeServiceIDList(Yesterday)
-
-        # If we need to consider tomorrow's trips, get the service ids.
-        serviceidlist_tom = []
-        nonoverlappingsids_tom = []
-        if ConsiderTomorrow:
-            serviceidlist_tom, nonoverlappingsids_tom = MakeServiceIDList(Tomorrow)
-    except:
-        arcpy.AddError("Error getting list of service_ids for time window.")
-        raise
-
-    # Make sure there is service on the day we're analyzing.
-    if not serviceidlist and not serviceidlist_yest and not serviceidlist_tom:
-        arcpy.AddWarning("There is no transit service during this time window. \
-No service_ids cover the weekday you have selected.")
-
-    # Combine lists of non-overlapping date range pairs of service ids
-    nonoverlappingsids += nonoverlappingsids_yest
-    nonoverlappingsids += nonoverlappingsids_tom
-    nonoverlappingsids = list(set(nonoverlappingsids))
-
-    return serviceidlist, serviceidlist_yest, serviceidlist_tom, nonoverlappingsids
+    return ModuleContext.GetServiceIDListsAndNonOverlaps(DayOfWeek, start_sec, end_sec, DepOrArr)
 
 
 def MakeTripList(serviceidlist):
     '''Select the trips with the service_ids of interest'''
-
-    triplist = []
-    for service_id in serviceidlist:
-        tripsfetch = '''
-            SELECT DISTINCT trip_id FROM trips
-            WHERE service_id == ?
-            ;'''
-        c.execute(tripsfetch, (service_id,))
-        selectedtrips = c.fetchall()
-        for tr in selectedtrips:
-            triplist.append(tr[0])
-    # There shouldn't be any duplicates, but check anyway.
-    triplist = list(set(triplist))
-
-    return triplist
+    return ModuleContext.MakeTripList(serviceidlist)
 
 
 def MakeFrequenciesDict():
     '''Put the frequencies.txt information into a dictionary'''
-    global frequencies_dict_initialized, frequencies_dict
-
-    # Check if the dataset uses frequency. If not, no need to do more.
-    tblnamelist = GetGTFSTableNames()
-    if not "frequencies" in tblnamelist:
-        frequencies_dict_initialized = True
-        return
-
-    # Fill the dictionary
-    frequencies_dict = {}
-    freqfetch = '''
-        SELECT trip_id, start_time, end_time, headway_secs
-        FROM frequencies
-        ;'''
-    c.execute(freqfetch)
-    freqlist = c.fetchall()
-    for freq in freqlist:
-        trip_id = freq[0]
-        trip_data = [freq[1], freq[2], freq[3]]
-        # {trip_id: [start_time, end_time, headway_secs]}
-        frequencies_dict.setdefault(trip_id, []).append(trip_data)
-    frequencies_dict_initialized = True
-    return
+    return ModuleContext.MakeFrequenciesDict()
 
 
 def GetStopTimesForStopsInTimeWindow(start, end, DepOrArr, triplist, day):
     '''Return a dictionary of {stop_id: [[trip_id, stop_time]]} for trips and
     stop_times in the time window. Adjust the stop_time value to today's time of
     day if it is a trip from yesterday or tomorrow.'''
+    return ModuleContext.GetStopTimesForStopsInTimeWindow(start, end, DepOrArr, triplist, day)
 
-    # Adjust times for trips from yesterday or tomorrow
-    if day == "yesterday":
-        start += SecsInDay
-        end += SecsInDay
-    if day == "tomorrow":
-        start = start - SecsInDay
-        end = end - SecsInDay
-
-    # If we haven't already, initialize the frequencies dictionary so we can
-    # find trips that use the frequencies table instead of stop_times and
-    # treat them accordingly.
-    if not frequencies_dict_initialized:
-        MakeFrequenciesDict()
-
-    stoptimedict = {} # {stop_id: [[trip_id, stop_time]]}
-    for trip in triplist:
-
-        # If the trip uses the frequencies.txt file, extrapolate the stop_times
-        # throughout the day using the relative time between the stops given in
-        # stop_times and the headways listed in frequencies.
-        if trip in frequencies_dict:
-
-            # Grab the stops stop_times for this trip
-            stopsfetch = '''
-                SELECT stop_id, %s FROM stop_times
-                WHERE trip_id == ?
-                ;''' % DepOrArr
-            c.execute(stopsfetch, (trip,))
-            StopTimes = c.fetchall()
-            # Sort by time
-            StopTimes.sort(key=operator.itemgetter(1))
-            # time 0 for this trip
-            initial_stop_time = int(StopTimes[0][1])
-
-            # Extrapolate using the headway and time windows from frequencies to
-            # find the stop visits. Add them to the dictionary if they fall within
-            # our analysis time window.
-            for window in frequencies_dict[trip]:
-                start_timeofday = window[0]
-                end_timeofday = window[1]
-                headway = window[2]
-                # Increment by by headway to create new stop visits
-                for i in range(int(round(start_timeofday, 0)), int(round(end_timeofday, 0)), headway):
-                    for stop in StopTimes:
-                        time_along_trip = int(stop[1]) - initial_stop_time
-                        stop_time = i + time_along_trip
-                        if start < stop_time < end:
-                            if day == "yesterday":
-                                stop_time = stop_time - SecsInDay
-                            elif day == "tomorrow":
-                                stop_time += SecsInDay
-                            # To distinguish between stop visits, since all frequency-based
-                            # trips have the same id, create a special id based on the day
-                            # and time of day: trip_id_DayStartTime. This ensures that the
-                            # number of trips will be counted correctly later and not eliminated
-                            # as being the same trip
-                            special_trip_name = trip + "_%s%s" % (day, str(i))
-                            stoptimedict.setdefault(stop[0], []).append([special_trip_name, stop_time])
-
-        # If the trip doesn't use frequencies, get the stop times directly
-        else:
-            # Grab the stop_times within the time window
-            stopsfetch = '''
-                SELECT stop_id, %s FROM stop_times
-                WHERE trip_id == ?
-                AND %s BETWEEN ? AND ?
-                ;''' % (DepOrArr, DepOrArr)
-            c.execute(stopsfetch, (trip, start, end,))
-            StopTimes = c.fetchall()
-
-            for stoptime in StopTimes:
-                stop_id = stoptime[0]
-                stop_time = int(stoptime[1])
-                if day == "yesterday":
-                    stop_time = stop_time - SecsInDay
-                elif day == "tomorrow":
-                    stop_time += SecsInDay
-                stoptimedict.setdefault(stop_id, []).append([trip, stop_time])
-
-    return stoptimedict
+
+def GetStopTimesForRouteDirectionsInTimeWindow(start, end, DepOrArr, pairtripdict):
+    '''Return a dictionary of {(route_id, direction_id): {stop_id: [[trip_id, stop_time]]}}
+    for the trips of each route and direction in {(route_id, direction_id): [trip_id, ...]},
+    including trips from yesterday and tomorrow that fall in the time window.'''
+    return ModuleContext.GetStopTimesForRouteDirectionsInTimeWindow(start, end, DepOrArr, pairtripdict)
 
 
 def ShouldConsiderYesterday(start_sec, DepOrArr):
     '''Determine if it's early enough in the day that we need to consider trips
     still running from the day before. Do this by finding the largest stop_time
     in the GTFS file and comparing it to the user's start time.'''
-    global ConsiderYesterday
-    ConsiderYesterday = 0
-    # Select the largest stop time
-    MaxTimeFetch = '''
-        SELECT MAX(%s) FROM stop_times
-        ;''' % (DepOrArr)
-    c.execute(MaxTimeFetch)
-    MaxTime = c.fetchone()[0]
-    if start_sec < MaxTime - SecsInDay:
-        ConsiderYesterday = 1
+    return ModuleContext.ShouldConsiderYesterday(start_sec, DepOrArr)
 
 
 def ShouldConsiderTomorrow(end_sec):
     '''Return whether a time is greater than midnight.'''
-    global ConsiderTomorrow
-    ConsiderTomorrow = 0
-    if end_sec > SecsInDay:
-        ConsiderTomorrow = 1
+    return ModuleContext.ShouldConsiderTomorrow(end_sec)
 
 
 def CountTripsAtStops(DayOfWeek, start_sec, end_sec, DepOrArr):
     '''Given a time window, return a dictionary of
     {stop_id: [[trip_id, stop_time]]}'''
+    return ModuleContext.CountTripsAtStops(DayOfWeek, start_sec, end_sec, DepOrArr)
 
-    serviceidlist, serviceidlist_yest, serviceidlist_tom, nonoverlappingsids = \
-        GetServiceIDListsAndNonOverlaps(DayOfWeek, start_sec, end_sec, DepOrArr)
-
-    # If there are nonoverlapping date ranges in our data, raise a warning.
-    if nonoverlappingsids:
-        overlapwarning = "Warning! Your calendar.txt file(s) contain(s) \
-non-overlapping date ranges. Your output might be double counting the number \
-of trips available. Please check the date ranges in your calendar.txt file(s). \
-See the User's Guide for further assistance.  Date ranges do not overlap in the \
-following pairs of service_ids used in \
-this analysis: " + str(nonoverlappingsids)
-        arcpy.AddWarning(overlapwarning)
-
-    try:
-        # Get the list of trips with these service ids.
-        triplist = MakeTripList(serviceidlist)
-
-        triplist_yest = []
-        if ConsiderYesterday:
-            # To save time, only get yesterday's trips if yesterday's service ids
-            # are different than today's.
-            if serviceidlist_yest != serviceidlist:
-                triplist_yest = MakeTripList(serviceidlist_yest)
-            else:
-                triplist_yest = triplist
-
-        triplist_tom = []
-        if ConsiderTomorrow:
-            # To save time, only get tomorrow's trips if tomorrow's service ids
-            # are different than today's.
-            if serviceidlist_tom == serviceidlist:
-                triplist_tom = triplist
-            elif serviceidlist_tom == serviceidlist_yest:
-                triplist_tom = triplist_yest
-            else:
-                triplist_tom = MakeTripList(serviceidlist_tom)
-    except:
-        arcpy.AddError("Error creating list of trips for time window.")
-        raise
-
-    # Make sure there is service on the day we're analyzing.
-    if not triplist and not triplist_yest and not triplist_tom:
-        arcpy.AddWarning("There is no transit service during this time window. \
-No trips are running.")
-
-    try:
-        # Get the stop_times that occur during this time window
-        stoptimedict = GetStopTimesForStopsInTimeWindow(start_sec, end_sec, DepOrArr, triplist, "today")
-        stoptimedict_yest = GetStopTimesForStopsInTimeWindow(start_sec, end_sec, DepOrArr, triplist, "yesterday")
-        stoptimedict_tom = GetStopTimesForStopsInTimeWindow(start_sec, end_sec, DepOrArr, triplist, "tomorrow")
-
-        # Combine the three dictionaries into one master
-        for stop in stoptimedict_yest:
-            stoptimedict[stop] = stoptimedict.setdefault(stop, []) + stoptimedict_yest[stop]
-        for stop in stoptimedict_tom:
-            stoptimedict[stop] = stoptimedict.setdefault(stop, []) + stoptimedict_tom[stop]
-
-    except:
-        arcpy.AddError("Error creating dictionary of stops and trips in time window.")
-        raise
-
-    return stoptimedict
-
-
-def RetrieveStatsForSetOfStops(stoplist, stoptimedict, CalcWaitTime, start_sec, end_sec):
-    '''For a set of stops, query the stoptimedict {stop_id: [[trip_id, stop_time]]}
-    and return the NumTrips, NumTripsPerHr, NumStopsInRange, and MaxWaitTime for
-    that set of stops.'''
-
-    # Number of stops (in range of the given point or polygon being studied)
-    NumStopsInRange = len(stoplist)
-
-    # Find the list of unique trips
-    triplist = []
-    StopTimesAtThisPoint = []
-    for stop in stoplist:
-        try:
-            stoptimelist = stoptimedict[stop]
-            for stoptime in stoptimelist:
-                trip = stoptime[0]
-                triplist.append(trip)
-                StopTimesAtThisPoint.append(stoptime[1])
-        except KeyError:
-            pass
-    triplist = list(set(triplist))
-    NumTrips = len(triplist)
-    NumTripsPerHr = round(float(NumTrips) / ((end_sec - start_sec) / 3600), 2)
-
-    MaxWaitTime = None
-    if CalcWaitTime == "true":
-        MaxWaitTime = CalculateMaxWaitTime(StopTimesAtThisPoint, start_sec, end_sec)
-
-    return NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime
-
-
-def CalculateMaxWaitTime(stoptimelist, start_sec, end_sec):
-    '''Calculate the max time in minutes between adjacent stop visits. Set value
-    to None if it can't be calculated.'''
-
-    maxWaitTime_toReturn = None
-
-    # Calculate max time between adjacent stop times.
-    if len(stoptimelist) > 1:
-        # Sort the list of stoptimes
-        stoptimelist.sort()
-        # Find time from time window start to earliest stop visit
-        TimeFromStart = stoptimelist[0] - start_sec
-        # and time from latest stop visit to end of time window
-        TimeToEnd = end_sec - stoptimelist[-1]
-        # and which is largest.
-        MaxEdge = max(TimeFromStart, TimeToEnd)
-        # Find the maximum difference between adjacent visits
-        MaxWaitTime = max(abs(x - y) for (x, y) in zip(stoptimelist[1:], stoptimelist[:-1]))
-        # Compare with distance to edge of time window
-        if (MaxEdge < MaxWaitTime):
-            # Exclude cases where the time to the time window boundaries is
-            # > MaxWaitTime because we can't properly determine MaxWaitTime.
-           maxWaitTime_toReturn = int(round(float(MaxWaitTime) / 60, 0)) # In minutes
-
-    return maxWaitTime_toReturn
+
+def CountTripsAtStopsForDays(DaysOfWeek, start_sec, end_sec, DepOrArr):
+    '''Given a list of weekdays and a time window, return a dictionary of
+    {DayOfWeek: {stop_id: [[trip_id, stop_time]]}}.  Weekdays with the same set
+    of service_ids share the same stoptimedict, so the trips and stop_times are
+    only extracted once for them.'''
+    return ModuleContext.CountTripsAtStopsForDays(DaysOfWeek, start_sec, end_sec, DepOrArr)
+
+
+def CountTripsAtStopsForDates(dates, start_sec, end_sec, DepOrArr):
+    '''Given a list of specific dates and a time window, return a dictionary of
+    {date: {stop_id: [[trip_id, stop_time]]}}.  Dates with the same service ids
+    share the same stoptimedict.'''
+    return ModuleContext.CountTripsAtStopsForDates(dates, start_sec, end_sec, DepOrArr)
 
 
 def MakeStopsFeatureClass(stopsfc, stoplist=None):
     '''Make a feature class of GTFS stops from the SQL table. Returns the path
     to the feature class and a list of stop IDs.'''
+    ImportArcpy()
 
     stopsfc_path = os.path.dirname(stopsfc)
     stopsfc_name = os.path.basename(stopsfc)
@@ -445,12 +199,11 @@ def MakeStopsFeatureClass(stopsfc, stoplist=None):
 
     # Get the stop info from the GTFS SQL file
     if stoplist:
-        StopTable = []
-        for stop_id in stoplist:
-            selectstoptablestmt = "SELECT * FROM stops WHERE stop_id='%s';" % stop_id
-            c.execute(selectstoptablestmt)
-            StopInfo = c.fetchall()
-            StopTable.append(StopInfo[0])
+        # Read the stops table once instead of querying each stop.
+        selectstoptablestmt = "SELECT * FROM stops;"
+        c.execute(selectstoptablestmt)
+        StopInfo = dict((stop[5], stop) for stop in c.fetchall())
+        StopTable = [StopInfo[stop_id] for stop_id in stoplist]
     else:
         selectstoptablestmt = "SELECT * FROM stops;"
         c.execute(selectstoptablestmt)
@@ -536,7 +289,82 @@ def MakeStopsFeatureClass(stopsfc, stoplist=None):
 
 def MakeServiceAreasAroundStops(StopsLayer, inNetworkDataset, impedanceAttribute, BufferSize, restrictions, TrimPolys, TrimPolysValue):
     '''Make Service Area polygons around transit stops and join the stop_id
+    field to the output polygons. If the service area cache is turned on, only
+    the stops that aren't in the cache are solved. Note: Assume NA license is
+    checked out.'''
+    ImportArcpy()
+
+    if not ArcVersion:
+        DetermineArcVersion()
+
+    if not sacache.CacheFile or ArcVersion == "10.0":
+        return SolveServiceAreasAroundStops(StopsLayer, inNetworkDataset,
+                    impedanceAttribute, BufferSize, restrictions, TrimPolys,
+                    TrimPolysValue)
+
+    # Get the stops' locations
+    WGSSpatialRef = arcpy.SpatialReference()
+    WGSSpatialRef.loadFromString(WGSCoords)
+    stops = []
+    with arcpy.da.SearchCursor(StopsLayer, ["stop_id", "SHAPE@XY"],
+                                spatial_reference=WGSSpatialRef) as cur:
+        for row in cur:
+            stops.append((row[0], row[1][1], row[1][0]))
+
+    solver = NetworkServiceAreaSolver(StopsLayer, inNetworkDataset,
+                impedanceAttribute, BufferSize, restrictions, TrimPolys,
+                TrimPolysValue)
+    polygons = sacache.GetServiceAreas(stops, solver)
+
+    # Write the polygons to a feature class in the network's spatial reference
+    outPolys = os.path.join("in_memory", "ServiceAreaPolygons")
+    arcpy.management.CreateFeatureclass("in_memory", "ServiceAreaPolygons",
+                    "POLYGON", spatial_reference=solver.spatialReference)
+    arcpy.management.AddField(outPolys, "stop_id", "TEXT")
+    with arcpy.da.InsertCursor(outPolys, ["stop_id", "SHAPE@WKB"]) as cur:
+        for stop_id, lat, lon in stops:
+            if stop_id in polygons:
+                cur.insertRow([stop_id, bytearray(polygons[stop_id])])
+
+    return arcpy.management.MakeFeatureLayer(outPolys, "ServiceAreaPolygons").getOutput(0)
+
+
+class NetworkServiceAreaSolver(sacache.ServiceAreaSolver):
+    '''Solve service areas around stops in a layer with Network Analyst, for
+    use with the service area cache.'''
+
+    def __init__(self, StopsLayer, inNetworkDataset, impedanceAttribute, BufferSize, restrictions, TrimPolys, TrimPolysValue):
+        self.StopsLayer = StopsLayer
+        self.settings = [inNetworkDataset, impedanceAttribute, BufferSize,
+                         restrictions, TrimPolys, TrimPolysValue]
+        self.spatialReference = arcpy.Describe(inNetworkDataset).spatialReference
+
+    def GetSettings(self):
+        settings = list(self.settings)
+        settings[0] = arcpy.Describe(settings[0]).catalogPath
+        return settings
+
+    def Solve(self, stops):
+        # Select the stops to solve from the stops layer
+        stopidField = arcpy.AddFieldDelimiters(self.StopsLayer, "stop_id")
+        WhereClause = stopidField + " IN (" + \
+            ", ".join(["'" + stop[0].replace("'", "''") + "'" for stop in stops]) + ")"
+        arcpy.management.MakeFeatureLayer(self.StopsLayer, "StopsToSolve", WhereClause)
+
+        polygonsSubLayer = SolveServiceAreasAroundStops("StopsToSolve", *self.settings)
+        polygons = {}
+        with arcpy.da.SearchCursor(polygonsSubLayer, ["stop_id", "SHAPE@WKB"],
+                                    spatial_reference=self.spatialReference) as cur:
+            for row in cur:
+                polygons[row[0]] = bytes(row[1])
+        arcpy.management.Delete("StopsToSolve")
+        return polygons
+
+
+def SolveServiceAreasAroundStops(StopsLayer, inNetworkDataset, impedanceAttribute, BufferSize, restrictions, TrimPolys, TrimPolysValue):
+    '''Solve Service Area polygons around transit stops and join the stop_id
     field to the output polygons. Note: Assume NA license is checked out.'''
+    ImportArcpy()
 
     # Name to refer to Service Area layer
     outNALayer_SA = "ServiceAreas"
@@ -626,36 +454,228 @@ def MakeServiceAreasAroundStops(StopsLayer, inNetworkDataset, impedanceAttribute
     return polygonsSubLayer
 
 
-def ConnectToSQLDatabase(SQLDbase):
-    '''Connect to a SQL database'''
-    conn = sqlite3.connect(SQLDbase)
+def GetPointLocations(inPointsLayer, idField):
+    '''Return lists of the ids (as strings), latitudes, and longitudes of the
+    features in a point layer.'''
+    ImportArcpy()
+
+    pointids = []
+    pointlats = []
+    pointlons = []
+    WGSSpatialRef = arcpy.SpatialReference()
+    WGSSpatialRef.loadFromString(WGSCoords)
+
+    if not ArcVersion:
+        DetermineArcVersion()
+
+    if ArcVersion == "10.0":
+        shapeField = arcpy.Describe(inPointsLayer).shapeFieldName
+        cur = arcpy.SearchCursor(inPointsLayer, "", WGSSpatialRef,
+                                    idField + "; " + shapeField)
+        for row in cur:
+            pt = row.getValue(shapeField).getPart()
+            pointids.append(str(row.getValue(idField)))
+            pointlats.append(pt.Y)
+            pointlons.append(pt.X)
+        del cur
+
+    else:
+        # For everything 10.1 and forward
+        cur = arcpy.da.SearchCursor(inPointsLayer, [idField, "SHAPE@XY"],
+                                    spatial_reference=WGSSpatialRef)
+        for row in cur:
+            pointids.append(str(row[0]))
+            pointlats.append(row[1][1])
+            pointlons.append(row[1][0])
+        del cur
+
+    return pointids, pointlats, pointlons
+
+
+def WriteStatsForFieldSets(outFC, idField, featurestatsdict, fieldsuffixes, nostats=None, idconverter=str):
+    '''Add a set of NumTrips, NumTripsPerHr, and MaxWaitTime fields to outFC for
+    each suffix in fieldsuffixes and fill them in a single cursor pass.
+    featurestatsdict is {feature_id: [(NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime), ...]},
+    with one stats tuple for each field set, keyed by idconverter(idField value).
+    Features missing from featurestatsdict get the stats in nostats, or are
+    skipped if nostats is None. Returns the list of fields added.'''
+    ImportArcpy()
+
+    isShapefile = ".shp" in outFC
+    if isShapefile:
+        # Shapefiles can't have long field names
+        basefields = ["NT", "TPH", "MWT"]
+    else:
+        basefields = ["NumTrips", "NumTripsPerHr", "MaxWaitTime"]
+    fieldtypes = ["SHORT", "DOUBLE", "SHORT"]
+
+    fields = []
+    for suffix in fieldsuffixes:
+        for field, fieldtype in zip(basefields, fieldtypes):
+            arcpy.management.AddField(outFC, field + suffix, fieldtype)
+            fields.append(field + suffix)
+
+    def FillRow(stats):
+        '''Return the list of output values for a feature's stats.'''
+        values = []
+        for NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime in stats:
+            if isShapefile and MaxWaitTime == None:
+                # Shapefile output can't handle null values.
+                MaxWaitTime = -1
+            values += [NumTrips, NumTripsPerHr, MaxWaitTime]
+        return values
+
+    FillFields(outFC, idField, fields, featurestatsdict, FillRow, nostats, idconverter)
+    return fields
+
+
+def WriteHeadwayStats(outFC, idField, featurestatsdict, nostats=None, idconverter=str):
+    '''Add MedianHeadway, Headway90, HeadwayCV, and ExpectedWait fields to
+    outFC and fill them in a single cursor pass.  featurestatsdict is
+    {feature_id: (NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime,
+    MedianHeadway, Headway90, HeadwayCV, ExpectedWait)} from
+    RetrieveStatsForSetsOfStops() with HeadwayStats=True, keyed by
+    idconverter(idField value). Features missing from featurestatsdict get the
+    stats in nostats, or are skipped if nostats is None. Returns the list of
+    fields added.'''
+    ImportArcpy()
+
+    isShapefile = ".shp" in outFC
+    if isShapefile:
+        # Shapefiles can't have long field names
+        fields = ["MedHdwy", "Hdwy90", "HdwyCV", "ExpWait"]
+    else:
+        fields = ["MedianHeadway", "Headway90", "HeadwayCV", "ExpectedWait"]
+    fieldtypes = ["SHORT", "SHORT", "DOUBLE", "DOUBLE"]
+    for field, fieldtype in zip(fields, fieldtypes):
+        arcpy.management.AddField(outFC, field, fieldtype)
+
+    def FillRow(stats):
+        '''Return the list of output values for a feature's stats.'''
+        values = list(stats[4:8])
+        if len(values) < 4:
+            # Features with no stops have no headways.
+            values = [None] * 4
+        if isShapefile:
+            # Shapefile output can't handle null values.
+            values = [-1 if value == None else value for value in values]
+        return values
+
+    FillFields(outFC, idField, fields, featurestatsdict, FillRow, nostats, idconverter)
+    return fields
+
+
+def WriteDateRangeStats(outFC, idField, featurestatsdict, nostats=None, idconverter=str):
+    '''Add MeanNumTrips, MinNumTrips, and MaxNumTrips fields to outFC and fill
+    them in a single cursor pass.  featurestatsdict is
+    {feature_id: (MeanNumTrips, MinNumTrips, MaxNumTrips)} from
+    RetrieveTripStatsForDates(), keyed by idconverter(idField value). Features
+    missing from featurestatsdict get the stats in nostats, or are skipped if
+    nostats is None. Returns the list of fields added.'''
+    ImportArcpy()
+
+    if ".shp" in outFC:
+        # Shapefiles can't have long field names
+        fields = ["MeanNT", "MinNT", "MaxNT"]
+    else:
+        fields = ["MeanNumTrips", "MinNumTrips", "MaxNumTrips"]
+    fieldtypes = ["DOUBLE", "SHORT", "SHORT"]
+    for field, fieldtype in zip(fields, fieldtypes):
+        arcpy.management.AddField(outFC, field, fieldtype)
+
+    FillFields(outFC, idField, fields, featurestatsdict, list, nostats, idconverter)
+    return fields
+
+
+def FillFields(outFC, idField, fields, featurestatsdict, FillRow, nostats=None, idconverter=str):
+    '''Fill the fields of outFC with FillRow(stats) in a single cursor pass,
+    where stats is featurestatsdict[idconverter(idField value)]. Features
+    missing from featurestatsdict get FillRow(nostats), or are skipped if
+    nostats is None.'''
+
+    if not ArcVersion:
+        DetermineArcVersion()
+
+    if ArcVersion == "10.0":
+        ucursor = arcpy.UpdateCursor(outFC, "", "", "; ".join([idField] + fields))
+        for row in ucursor:
+            try:
+                stats = featurestatsdict[idconverter(row.getValue(idField))]
+            except KeyError:
+                if nostats is None:
+                    continue
+                stats = nostats
+            for field, value in zip(fields, FillRow(stats)):
+                row.setValue(field, value)
+            ucursor.updateRow(row)
+        del ucursor
+
+    else:
+        # For everything 10.1 and forward
+        ucursor = arcpy.da.UpdateCursor(outFC, [idField] + fields)
+        for row in ucursor:
+            try:
+                stats = featurestatsdict[idconverter(row[0])]
+            except KeyError:
+                if nostats is None:
+                    continue
+                stats = nostats
+            ucursor.updateRow([row[0]] + FillRow(stats))
+        del ucursor
+
+
+def ConnectToSQLDatabase(SQLDbase, trace=None):
+    '''Connect to a SQL database and return the connection. The statements are
+    traced if trace is True, or by default if the GTFS_SQL_TRACE environment
+    variable is set (see bbb_core.sqltrace).'''
+    conn = sqltrace.connect(SQLDbase, trace)
     global c
     c = conn.cursor()
+    return conn
+
+
+def GetFeedHash():
+    '''Return a hash of the contents of the connected GTFS SQL database, for
+    use in result cache keys.'''
+    return ModuleContext.GetFeedHash()
 
 
 def GetGTFSTableNames():
     '''Return a list of SQL database table names'''
-    GetTblNamesStmt = "SELECT name FROM sqlite_master WHERE type='table';"
-    c.execute(GetTblNamesStmt)
-    tblnames = c.fetchall()
-    tblnamelist = []
-    for name in tblnames:
-        tblnamelist.append(name[0])
-    return tblnamelist
+    return ModuleContext.GetGTFSTableNames()
+
+
+def GetStopLocations():
+    '''Return lists of the stop_ids, latitudes, and longitudes of the stops.'''
+    return ModuleContext.GetStopLocations()
 
 
-def parse_time(HMS):
-    '''Convert HH:MM:SS to seconds since midnight, for comparison purposes.'''
-    H, M, S = HMS.split(':')
-    seconds = (float(H) * 3600) + (float(M) * 60) + float(S)
-    return seconds
+def GetStopGroups(tolerance=0):
+    '''Group the stops in the same station, or in the same grid cell of
+    tolerance meters, for the network analyses. Returns a dictionary of
+    {representative stop_id: [stop_id, ...]}.'''
+    return ModuleContext.GetStopGroups(tolerance)
+
+
+def ImportArcpy():
+    '''Import arcpy the first time it's needed and return it. Importing arcpy
+    is slow, so it's only done by the functions that use ArcGIS, and the SQL
+    and statistics functions can be used without it.'''
+    global arcpy
+    if arcpy is None:
+        import arcpy
+        messages.handler = arcpy
+    return arcpy
 
 
 def DetermineArcVersion():
-    '''Figure out what version of ArcGIS the user is running'''
-    ArcVersionInfo = arcpy.GetInstallInfo("desktop")
+    '''Figure out what version of ArcGIS the user is running. The version is
+    only looked up the first time.'''
     global ArcVersion
-    ArcVersion = ArcVersionInfo['Version']
+    if not ArcVersion:
+        ArcVersionInfo = ImportArcpy().GetInstallInfo("desktop")
+        ArcVersion = ArcVersionInfo['Version']
+    return ArcVersion
 
 
 class CustomError(Exception):
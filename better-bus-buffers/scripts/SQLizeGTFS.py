@@ -35,6 +35,7 @@ used as input by all the BetterBusBuffers tools.
 
 import arcpy
 import sqlize_csv
+from bbb_core import sqltrace
 
 class CustomError(Exception):
     pass
@@ -62,6 +63,7 @@ try:
     # The main SQLizing work is done in the sqlize_csv module
     # written by Luitien Pan.
     # Connect to or create the SQL file.
+    sqltrace.Reset()
     sqlize_csv.connect(SQLDbase)
     # Create tables.
     for tblname in sqlize_csv.sql_schema:
@@ -86,6 +88,10 @@ try:
     arcpy.AddMessage("Successfully created SQL database of GTFS data:")
     arcpy.AddMessage("- " + SQLDbase)
 
+    SQLReport = sqltrace.FormatReport()
+    if SQLReport:
+        arcpy.AddMessage(SQLReport)
+
 except CustomError:
     arcpy.AddMessage("Failed to create SQL database of GTFS data.")
     pass
@@ -0,0 +1,34 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core
+## Last updated: 18 October 2026
+############################################################################
+''' The BetterBusBuffers compute core: the trip counting and statistics used by
+the BetterBusBuffers tools, in pure Python with no arcpy dependency.  It can be
+run without ArcGIS from the command line with python -m bbb_core (see
+bbb_core.cli), and its statistics can be served to other programs over HTTP
+with python -m bbb_core.server (see bbb_core.server).  The ArcGIS tools use it
+through BBB_SharedFunctions.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+from bbb_core.gtfs import AnalysisContext, SecsInDay, days, parse_time, \
+    parse_date, MakeDateRange
+from bbb_core.stats import MakeStopTripBitsets, CountBits, MakeSortedStopTimes, \
+    MergeStopTimes, RetrieveStatsForSetOfStops, InternStopSets, \
+    RetrieveStatsForSetsOfStops, ReportStopSetCacheStats, \
+    RetrieveStatsForSetsOfStopsForDays, RetrieveTripStatsForDates, \
+    RetrieveHeadwayStatsForSetOfStops, CalculateMaxWaitTime, \
+    CalculateHeadwayStats, MakeTimeWindows, MakeStopEventsForTimeWindows, \
+    RetrieveStatsForSetOfStopsForTimeWindows, \
+    RetrieveStatsForSetsOfStopsForTimeWindows, MakeTimeWindowFieldSuffix
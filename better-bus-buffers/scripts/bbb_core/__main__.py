@@ -0,0 +1,6 @@
+''' Run the BetterBusBuffers core from the command line: python -m bbb_core'''
+
+import sys
+from bbb_core import cli
+
+sys.exit(cli.main())
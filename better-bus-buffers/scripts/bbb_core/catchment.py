@@ -0,0 +1,129 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Straight-Line Catchments
+## Last updated: 18 October 2026
+############################################################################
+''' This file finds the stops within a straight-line distance of a set of
+points, as a faster alternative to a network OD cost matrix for screening
+studies.  It doesn't use arcpy, but it does require numpy.
+
+The stops are indexed in a grid of latitude/longitude cells sized so that all
+the stops within the distance of a point are in the point's cell or one of the
+8 cells around it.  The points are grouped by cell too, and the great circle
+distances between each cell's points and its candidate stops are checked in
+one vectorized step.  The grid columns wrap around at the 180th meridian, so
+locations on opposite sides of it are matched too.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import math
+import numpy as np
+from bbb_core.featurestops import MakeFeatureStopsCSR
+
+# Mean radius of the earth in meters
+EarthRadius = 6371008.8
+
+# Maximum number of point-stop distances to calculate at once
+MaxBlockSize = 1000000
+
+
+def GroupByCell(rows, cols):
+    '''Group the indexes of items by grid cell. Returns a dictionary of
+    {(row, col): array of item indexes}.'''
+
+    order = np.lexsort((cols, rows))
+    rows = rows[order]
+    cols = cols[order]
+    # Find where each run of items in the same cell starts
+    newcell = np.ones(len(order), dtype=bool)
+    newcell[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    starts = np.flatnonzero(newcell)
+    ends = np.append(starts[1:], len(order))
+
+    celldict = {}
+    for start, end in zip(starts, ends):
+        celldict[(int(rows[start]), int(cols[start]))] = order[start:end]
+    return celldict
+
+
+def FindStopsWithinDistance(pointids, pointlats, pointlons, stopids, stoplats, stoplons, distance):
+    '''Find the stops within a straight-line (great circle) distance in meters
+    of each point.  The locations are given in decimal degrees.  Returns a
+    FeatureStopsCSR with a row for each point, in the order given.'''
+
+    # Indexes of the points and the stops within the distance of them
+    pointidxs = []
+    stopidxs = []
+    if not len(pointids) or not len(stopids):
+        return MakeFeatureStopsCSR(pointids, stopids, pointidxs, stopidxs)
+
+    plat = np.radians(np.asarray(pointlats, dtype=float))
+    plon = np.radians(np.asarray(pointlons, dtype=float))
+    slat = np.radians(np.asarray(stoplats, dtype=float))
+    slon = np.radians(np.asarray(stoplons, dtype=float))
+
+    # Size the cells so that a stop within the distance of a point is never
+    # more than one cell away.  Two locations within the distance are at most
+    # distance / EarthRadius apart in latitude, and, from the haversine
+    # formula, at most 2 * asin(sin(distance / (2 * EarthRadius)) / cos(lat))
+    # apart in longitude, where lat is the latitude furthest from the equator.
+    maxlat = min(max(np.abs(plat).max(), np.abs(slat).max()), math.pi / 2)
+    cellheight = float(distance) / EarthRadius
+    sinhalf = math.sin(cellheight / 2)
+    if sinhalf < math.cos(maxlat):
+        cellwidth = 2 * math.asin(sinhalf / math.cos(maxlat))
+    else:
+        # Near the poles, every longitude is within range.
+        cellwidth = 2 * math.pi
+    cellheight = max(cellheight, 1e-9)
+    # Widen the cells so that a whole number of columns goes around the earth,
+    # and the first and last columns are next to each other.
+    numcols = max(1, int(2 * math.pi / max(cellwidth, 1e-9)))
+    cellwidth = 2 * math.pi / numcols
+
+    stopcells = GroupByCell(np.floor(slat / cellheight).astype(np.int64),
+                            np.floor((slon + math.pi) / cellwidth).astype(np.int64) % numcols)
+    pointcells = GroupByCell(np.floor(plat / cellheight).astype(np.int64),
+                             np.floor((plon + math.pi) / cellwidth).astype(np.int64) % numcols)
+
+    # Compare with the haversine of the distance instead of calculating the
+    # distances themselves.
+    maxhav = sinhalf ** 2
+    cosslat = np.cos(slat)
+
+    for (row, col), cellpoints in pointcells.items():
+        # Gather the stops in this cell and the 8 cells around it.  With fewer
+        # than 3 columns, some of the cells around it are the same cell.
+        neighbors = set((row + drow, (col + dcol) % numcols)
+                        for drow in (-1, 0, 1) for dcol in (-1, 0, 1))
+        candidates = [stopcells[cell] for cell in neighbors if cell in stopcells]
+        if not candidates:
+            continue
+        candidates = np.concatenate(candidates)
+
+        # Check the distances in blocks of points to limit the memory used.
+        blocksize = max(1, MaxBlockSize // len(candidates))
+        for blockstart in range(0, len(cellpoints), blocksize):
+            block = cellpoints[blockstart:blockstart + blocksize]
+            dlat = plat[block][:, None] - slat[candidates][None, :]
+            dlon = plon[block][:, None] - slon[candidates][None, :]
+            hav = np.sin(dlat / 2) ** 2 + np.cos(plat[block])[:, None] * \
+                    cosslat[candidates][None, :] * np.sin(dlon / 2) ** 2
+            blockpoints, blockstops = np.nonzero(hav <= maxhav)
+            pointidxs.append(block[blockpoints])
+            stopidxs.append(candidates[blockstops])
+
+    if pointidxs:
+        pointidxs = np.concatenate(pointidxs)
+        stopidxs = np.concatenate(stopidxs)
+    return MakeFeatureStopsCSR(pointids, stopids, pointidxs, stopidxs)
@@ -0,0 +1,280 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Command Line
+## Last updated: 18 October 2026
+############################################################################
+''' Count the trips at stops, or at features served by sets of stops, in a time
+window without ArcGIS.
+
+Usage:
+    python -m bbb_core GTFS.sql Output --day Monday --start 07:00 --end 09:00
+        [--stops FeatureStops.csv | --points Points.csv --distance Meters]
+        [--arrivals] [--max-wait] [--headway-stats]
+        [--start-date YYYYMMDD --end-date YYYYMMDD] [--cache Cache.sqlite]
+        [--processes N]
+        [--profile Profile.jsonl] [--trace-sql]
+
+GTFS.sql is a SQL database made by the Preprocess GTFS tool.
+
+Without --stops, the trips are counted at each stop in the GTFS data, like the
+Count Trips at Stops tool.  With --stops, they are counted for each feature
+(point, polygon, etc.) in FeatureStops.csv, like the Count Trips at Points and
+Count Trips in Polygon Buffers around Stops tools.  FeatureStops.csv has a
+header row and two columns: the feature's id and the stop_id of a stop serving
+it, with one row for each stop serving the feature.  A feature with an empty
+stop_id is served by no stops.
+
+With --points and --distance, the trips are counted for each point in
+Points.csv using the stops within a straight-line distance in meters of the
+point.  Points.csv has a header row and three columns: the point's id, its
+latitude, and its longitude.  This needs numpy.
+
+Output gets one row for each stop or feature with the NumTrips,
+NumTripsPerHr, NumStopsInRange, and MaxWaitTime (if --max-wait is used).
+With --headway-stats, it also gets the MedianHeadway, Headway90, HeadwayCV,
+and ExpectedWait - see bbb_core.headways.  This needs numpy.  With
+--start-date and --end-date, it also gets the MeanNumTrips, MinNumTrips, and
+MaxNumTrips over the specific dates from the start date to the end date, in the
+same time window, including the holidays and other exceptions in
+calendar_dates.txt.  It can be a CSV file (.csv), a GeoJSON-lines file (.geojsonl), or a GeoPackage
+(.gpkg) - see bbb_core.writers.  The stops and points are written with their
+locations.
+
+The time taken by each stage is shown at the end.  With --profile, the
+profile is also appended to a JSON-lines file - see bbb_core.profiling.  With
+--trace-sql, the time taken by each SQL statement is shown too - see
+bbb_core.sqltrace.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import os, csv, argparse
+from bbb_core import gtfs, stats, messages, resultcache, writers, profiling, sqltrace
+from bbb_core.writers import OpenCSV
+
+
+def ReadFeatureStops(FeatureStopsCSV):
+    '''Read a CSV file of (feature id, stop_id) pairs. Returns the name of the
+    feature id field, the list of feature ids in the order they first appear,
+    and a dictionary of {feature_id: [stop_id, ...]}.'''
+
+    featureids = []
+    featurestopsdict = {}
+    with OpenCSV(FeatureStopsCSV, "r") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        for row in reader:
+            if not row:
+                continue
+            feature = row[0]
+            if feature not in featurestopsdict:
+                featureids.append(feature)
+                featurestopsdict[feature] = []
+            if len(row) > 1 and row[1]:
+                featurestopsdict[feature].append(row[1])
+
+    return header[0], featureids, featurestopsdict
+
+
+def ReadPoints(PointsCSV):
+    '''Read a CSV file of (point id, latitude, longitude). Returns the name of
+    the point id field and lists of the point ids, latitudes, and longitudes.'''
+
+    pointids = []
+    pointlats = []
+    pointlons = []
+    with OpenCSV(PointsCSV, "r") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        for row in reader:
+            if not row:
+                continue
+            pointids.append(row[0])
+            pointlats.append(float(row[1]))
+            pointlons.append(float(row[2]))
+
+    return header[0], pointids, pointlats, pointlons
+
+
+def WriteStats(Output, idField, featureids, featurestatsdict, CalcWaitTime, lats=None, lons=None, HeadwayStats=False, datestatsdict=None):
+    '''Write the stats {feature_id: (NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime)}
+    to a CSV, GeoJSON-lines, or GeoPackage file, with the features' locations
+    if lists of their latitudes and longitudes are given.  If HeadwayStats is
+    True, the stats also have the headway statistics, which are written too.
+    The stats {feature_id: (MeanNumTrips, MinNumTrips, MaxNumTrips)} in
+    datestatsdict are written too if it's given.'''
+
+    fields = [("NumTrips", "INTEGER"), ("NumTripsPerHr", "REAL"),
+              ("NumStopsInRange", "INTEGER")]
+    statsidxs = [0, 1, 2]
+    if CalcWaitTime == "true":
+        fields.append(("MaxWaitTime", "REAL"))
+        statsidxs.append(3)
+    if HeadwayStats:
+        fields += [("MedianHeadway", "REAL"), ("Headway90", "REAL"),
+                   ("HeadwayCV", "REAL"), ("ExpectedWait", "REAL")]
+        statsidxs += [4, 5, 6, 7]
+    if datestatsdict is not None:
+        fields += [("MeanNumTrips", "REAL"), ("MinNumTrips", "INTEGER"),
+                   ("MaxNumTrips", "INTEGER")]
+    hasLocation = lats is not None
+    with writers.OpenStatsWriter(Output, idField, fields, hasLocation) as writer:
+        for idx, feature in enumerate(featureids):
+            stats = featurestatsdict[feature]
+            values = [stats[statsidx] for statsidx in statsidxs]
+            if datestatsdict is not None:
+                values += list(datestatsdict[feature])
+            location = (lats[idx], lons[idx]) if hasLocation else None
+            writer.Write(feature, values, location)
+
+
+def RunAnalysis(args, start_sec, end_sec, DepOrArr, DateRange, CalcWaitTime):
+    '''Count the trips, calculate the statistics for the features, and write
+    the output for the parsed command line arguments.'''
+
+    context = gtfs.AnalysisContext(args.SQLDbase)
+    try:
+        with profiling.Stage("Count trips") as stage:
+            stoptimedict = context.CountTripsAtStops(args.day, start_sec, end_sec, DepOrArr)
+            stage.rows = len(stoptimedict)
+        if DateRange:
+            with profiling.Stage("Count trips on dates") as stage:
+                datestoptimedict = context.CountTripsAtStopsForDates(DateRange,
+                                        start_sec, end_sec, DepOrArr)
+                stage.rows = len(DateRange)
+        featurelats = featurelons = None
+
+        with profiling.Stage("Get stops for features") as stage:
+            if args.FeatureStopsCSV:
+                idField, featureids, featurestopsdict = ReadFeatureStops(args.FeatureStopsCSV)
+            elif args.PointsCSV:
+                # numpy is only needed for straight-line distances
+                from bbb_core import catchment
+                idField, featureids, featurelats, featurelons = ReadPoints(args.PointsCSV)
+                stopids, stoplats, stoplons = context.GetStopLocations()
+                # FeatureStopsCSR with a row for each point
+                featurestopsdict = catchment.FindStopsWithinDistance(featureids,
+                                    featurelats, featurelons, stopids, stoplats,
+                                    stoplons, args.distance)
+            else:
+                # Each stop is its own feature.
+                idField = "stop_id"
+                featureids, featurelats, featurelons = context.GetStopLocations()
+                featurestopsdict = dict((stop_id, [stop_id]) for stop_id in featureids)
+            stage.rows = len(featureids)
+    finally:
+        context.close()
+
+    with profiling.Stage("Calculate statistics") as stage:
+        stoptripbits = stats.MakeStopTripBitsets(stoptimedict)
+        sortedstoptimes = None
+        if CalcWaitTime == "true" or args.headway_stats:
+            sortedstoptimes = stats.MakeSortedStopTimes(stoptimedict)
+        featurestatsdict = stats.RetrieveStatsForSetsOfStops(featurestopsdict,
+                                stoptimedict, CalcWaitTime, start_sec, end_sec,
+                                stoptripbits, sortedstoptimes, args.headway_stats)
+        datestatsdict = None
+        if DateRange:
+            datestatsdict = stats.RetrieveTripStatsForDates(featurestopsdict,
+                                datestoptimedict, DateRange, start_sec, end_sec)
+        stage.rows = len(featurestatsdict)
+
+    with profiling.Stage("Write output") as stage:
+        WriteStats(args.Output, idField, featureids, featurestatsdict, CalcWaitTime,
+                   featurelats, featurelons, args.headway_stats, datestatsdict)
+        stage.rows = len(featureids)
+    messages.AddMessage("Wrote statistics for %i features to %s." % (len(featureids), args.Output))
+
+
+def main(argv=None):
+    '''Run the command line tool. Returns the exit code.'''
+
+    parser = argparse.ArgumentParser(prog="python -m bbb_core",
+                description="Count the trips at stops, or at features served by \
+sets of stops, in a time window, using a GTFS SQL database made by the \
+BetterBusBuffers Preprocess GTFS tool.")
+    parser.add_argument("SQLDbase", help="GTFS SQL database")
+    parser.add_argument("Output", help="output CSV (.csv), GeoJSON-lines \
+(.geojsonl), or GeoPackage (.gpkg) file")
+    parser.add_argument("--day", required=True, choices=gtfs.days, help="weekday")
+    parser.add_argument("--start", required=True, help="time window start, HH:MM")
+    parser.add_argument("--end", required=True, help="time window end, HH:MM (may be later than 24:00)")
+    features = parser.add_mutually_exclusive_group()
+    features.add_argument("--stops", dest="FeatureStopsCSV",
+                help="CSV file of (feature id, stop_id) pairs. If not given, trips \
+are counted at each stop.")
+    features.add_argument("--points", dest="PointsCSV",
+                help="CSV file of (point id, latitude, longitude). Use with --distance.")
+    parser.add_argument("--distance", type=float,
+                help="straight-line distance in meters from the points to the stops")
+    parser.add_argument("--arrivals", action="store_true",
+                help="count arrivals instead of departures")
+    parser.add_argument("--max-wait", action="store_true",
+                help="calculate the max wait time")
+    parser.add_argument("--headway-stats", action="store_true",
+                help="calculate the median and 90th percentile headway, the \
+coefficient of variation of the headways, and the expected wait (needs numpy)")
+    parser.add_argument("--start-date", help="first date of a range of dates \
+to count trips on, YYYYMMDD. Use with --end-date.")
+    parser.add_argument("--end-date", help="last date of the range of dates, YYYYMMDD")
+    parser.add_argument("--processes", type=int, help="number of processes to \
+calculate the statistics with (default: the BBB_PROCESSES environment variable, or 1)")
+    parser.add_argument("--cache", help="result cache database (default: the \
+BBB_RESULT_CACHE environment variable)")
+    parser.add_argument("--profile", help="file to append the JSON profile of \
+the run to (default: the BBB_PROFILE environment variable)")
+    parser.add_argument("--trace-sql", action="store_true", help="trace and time \
+the SQL statements (default: on if the GTFS_SQL_TRACE environment variable is set)")
+    args = parser.parse_args(argv)
+
+    try:
+        start_sec = gtfs.parse_time(args.start + ":00")
+        end_sec = gtfs.parse_time(args.end + ":00")
+    except ValueError:
+        parser.error("Times must be in HH:MM format.")
+    if end_sec <= start_sec:
+        parser.error("Your time window ends before or at the same time it starts.")
+    if bool(args.PointsCSV) != (args.distance is not None):
+        parser.error("--points and --distance must be used together.")
+    if bool(args.start_date) != bool(args.end_date):
+        parser.error("--start-date and --end-date must be used together.")
+    DateRange = []
+    if args.start_date:
+        try:
+            DateRange = gtfs.MakeDateRange(gtfs.parse_date(args.start_date),
+                                           gtfs.parse_date(args.end_date))
+        except ValueError:
+            parser.error("Dates must be in YYYYMMDD format.")
+        if not DateRange:
+            parser.error("Your date range ends before it starts.")
+    if not os.path.exists(args.SQLDbase):
+        parser.error("The GTFS SQL database %s does not exist." % args.SQLDbase)
+
+    DepOrArr = "arrival_time" if args.arrivals else "departure_time"
+    CalcWaitTime = "true" if args.max_wait else "false"
+    if args.cache:
+        resultcache.CacheFile = args.cache
+    if args.processes:
+        stats.NumProcesses = args.processes
+    if args.profile:
+        profiling.ProfileFile = args.profile
+        profiling.TrackMemory = True
+    if args.trace_sql:
+        sqltrace.Enabled = True
+    profiling.Start("Command line")
+    try:
+        RunAnalysis(args, start_sec, end_sec, DepOrArr, DateRange, CalcWaitTime)
+    finally:
+        # Show the timing of a run that failed too, since that's often the
+        # slow one.
+        profiling.Report()
+    return 0
@@ -0,0 +1,229 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Feature Stops
+## Last updated: 18 October 2026
+############################################################################
+''' This file stores which stops serve which features (points, polygons, etc.)
+compactly, for analyses with millions of features.  Instead of a dictionary of
+{feature_id: [stop_id, ...]} with a list of strings for every feature, the
+stops are stored in compressed sparse row (CSR) form: each feature is a row,
+the stops serving all the features are stored as integer stop indexes in one
+array, and an offsets array says where each feature's stops start and end.
+
+A FeatureStopsCSR can be used anywhere the statistics functions take a
+{feature_id: [stop_id, ...]} dictionary.  It doesn't use arcpy, but it does
+require numpy.
+
+The stops serving the features can also be saved to SQL tables with one row
+for each feature and one row for each unique set of stops, and loaded back as
+an InternedFeatureStops without any per-stop string handling.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import array, sqlite3
+import numpy as np
+
+
+class FeatureStopsCSR(object):
+    '''The stops serving each feature. featureids and stopids are lists of ids;
+    the stops serving featureids[i] are stopids[stopidxs[k]] for k from
+    offsets[i] to offsets[i + 1], in increasing stop index order. offsets and
+    stopidxs are int32 numpy arrays.'''
+
+    def __init__(self, featureids, stopids, offsets, stopidxs):
+        self.featureids = featureids
+        self.stopids = stopids
+        self.offsets = offsets
+        self.stopidxs = stopidxs
+
+    def __len__(self):
+        return len(self.featureids)
+
+    def __iter__(self):
+        return iter(self.featureids)
+
+    def GetStops(self, row):
+        '''Return the list of stop_ids serving the feature in this row.'''
+        return [self.stopids[stopidx] for stopidx in
+                    self.stopidxs[self.offsets[row]:self.offsets[row + 1]]]
+
+    def InternStopSets(self):
+        '''Intern the set of stops serving each feature to an integer id, like
+        InternStopSets() does for a {feature_id: [stop_id, ...]} dictionary.
+        Returns a dictionary of {feature_id: stopset_id} and a list of the
+        unique stop sets as sorted tuples of stop_ids, indexed by stopset_id.'''
+
+        offsets = self.offsets.tolist()
+        stopidxs = self.stopidxs.tolist()
+        stopsetiddict = {} # {tuple of stop indexes: stopset_id}
+        stopsets = []
+        featurestopsetdict = {}
+        for row, feature in enumerate(self.featureids):
+            stopset = tuple(stopidxs[offsets[row]:offsets[row + 1]])
+            try:
+                stopset_id = stopsetiddict[stopset]
+            except KeyError:
+                stopset_id = stopsetiddict[stopset] = len(stopsets)
+                stopsets.append(stopset)
+            featurestopsetdict[feature] = stopset_id
+
+        # The stop indexes are in increasing order, but the stop_ids might not be.
+        stopsets = [tuple(sorted([self.stopids[stopidx] for stopidx in stopset]))
+                        for stopset in stopsets]
+        return featurestopsetdict, stopsets
+
+
+def MakeFeatureStopsCSR(featureids, stopids, featureidxs, stopidxs):
+    '''Make a FeatureStopsCSR from parallel sequences of feature indexes into
+    featureids and stop indexes into stopids, one pair for each stop serving a
+    feature, in any order.  Duplicate pairs are dropped.'''
+
+    featureidxs = np.asarray(featureidxs, dtype=np.int32)
+    stopidxs = np.asarray(stopidxs, dtype=np.int32)
+
+    # Sort the pairs by feature, then by stop, and drop the duplicates.
+    order = np.lexsort((stopidxs, featureidxs))
+    featureidxs = featureidxs[order]
+    stopidxs = stopidxs[order]
+    if len(order):
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = (featureidxs[1:] != featureidxs[:-1]) | (stopidxs[1:] != stopidxs[:-1])
+        featureidxs = featureidxs[keep]
+        stopidxs = stopidxs[keep]
+
+    offsets = np.zeros(len(featureids) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(featureidxs, minlength=len(featureids)), out=offsets[1:])
+    return FeatureStopsCSR(featureids, stopids, offsets, stopidxs)
+
+
+class FeatureStopsCSRBuilder(object):
+    '''Build a FeatureStopsCSR one (feature_id, stop_id) pair at a time, such as
+    from the lines of an OD cost matrix, without keeping a list of strings for
+    every feature.'''
+
+    def __init__(self):
+        self.featureids = []
+        self.stopids = []
+        self.featureindexdict = {}
+        self.stopindexdict = {}
+        self.featureidxs = array.array('i')
+        self.stopidxs = array.array('i')
+
+    def Add(self, feature, stop):
+        '''Add a stop serving a feature.'''
+        try:
+            featureidx = self.featureindexdict[feature]
+        except KeyError:
+            featureidx = self.featureindexdict[feature] = len(self.featureids)
+            self.featureids.append(feature)
+        try:
+            stopidx = self.stopindexdict[stop]
+        except KeyError:
+            stopidx = self.stopindexdict[stop] = len(self.stopids)
+            self.stopids.append(stop)
+        self.featureidxs.append(featureidx)
+        self.stopidxs.append(stopidx)
+
+    def Finish(self):
+        '''Return the FeatureStopsCSR.'''
+        return MakeFeatureStopsCSR(self.featureids, self.stopids,
+                    np.frombuffer(self.featureidxs, dtype=np.int32) if self.featureidxs else [],
+                    np.frombuffer(self.stopidxs, dtype=np.int32) if self.stopidxs else [])
+
+
+class InternedFeatureStops(object):
+    '''The stops serving each feature, already interned: a dictionary of
+    {feature_id: stopset_id} and a list of the unique sets of stops as tuples of
+    stop_ids, indexed by stopset_id.  Can be used anywhere the statistics
+    functions take a {feature_id: [stop_id, ...]} dictionary.'''
+
+    def __init__(self, featurestopsetdict, stopsets):
+        self.featurestopsetdict = featurestopsetdict
+        self.stopsets = stopsets
+
+    def __len__(self):
+        return len(self.featurestopsetdict)
+
+    def __iter__(self):
+        return iter(self.featurestopsetdict)
+
+    def InternStopSets(self):
+        '''Return the dictionary of {feature_id: stopset_id} and the list of
+        unique stop sets.'''
+        return self.featurestopsetdict, self.stopsets
+
+
+def PackStopIndexes(stopidxs):
+    '''Pack an array of stop indexes into a blob of little-endian int32s.'''
+    return sqlite3.Binary(np.asarray(stopidxs, dtype="<i4").tobytes())
+
+
+def UnpackStopIndexes(data):
+    '''Unpack a blob made by PackStopIndexes() into an array of stop indexes.'''
+    return np.frombuffer(bytes(data), dtype="<i4")
+
+
+def SaveFeatureStops(c, csr, TablePrefix):
+    '''Save a FeatureStopsCSR to three SQL tables:
+    [TablePrefix]Stops (stop_idx, stop_id) - stop dictionary
+    [TablePrefix]StopSets (set_id, stop_idxs) - unique sets of stops, as packed
+        stop indexes
+    [TablePrefix]Features (feature_id, set_id) - the set of stops serving each
+        feature
+    Features with no stops are left out.  The feature ids must be integers.'''
+
+    StopsTable = TablePrefix + "Stops"
+    StopSetsTable = TablePrefix + "StopSets"
+    FeaturesTable = TablePrefix + "Features"
+    for table in [StopsTable, StopSetsTable, FeaturesTable]:
+        c.execute("DROP TABLE IF EXISTS %s;" % table)
+    c.execute("CREATE TABLE %s (stop_idx INTEGER PRIMARY KEY, stop_id TEXT);" % StopsTable)
+    c.execute("CREATE TABLE %s (set_id INTEGER PRIMARY KEY, stop_idxs BLOB);" % StopSetsTable)
+    c.execute("CREATE TABLE %s (feature_id INTEGER PRIMARY KEY, set_id INTEGER);" % FeaturesTable)
+
+    c.executemany("INSERT INTO %s (stop_idx, stop_id) VALUES (?, ?);" % StopsTable,
+                    enumerate(csr.stopids))
+
+    offsets = csr.offsets.tolist()
+    stopsetiddict = {} # {packed stop indexes: set_id}
+    FeatureSets = []
+    for row, feature in enumerate(csr.featureids):
+        if offsets[row] == offsets[row + 1]:
+            continue
+        stopset = csr.stopidxs[offsets[row]:offsets[row + 1]].astype("<i4").tobytes()
+        try:
+            set_id = stopsetiddict[stopset]
+        except KeyError:
+            set_id = stopsetiddict[stopset] = len(stopsetiddict)
+        FeatureSets.append((feature, set_id))
+    c.executemany("INSERT INTO %s (set_id, stop_idxs) VALUES (?, ?);" % StopSetsTable,
+                    [(set_id, sqlite3.Binary(stopset)) for stopset, set_id in stopsetiddict.items()])
+    c.executemany("INSERT INTO %s (feature_id, set_id) VALUES (?, ?);" % FeaturesTable,
+                    FeatureSets)
+
+
+def LoadFeatureStops(c, TablePrefix):
+    '''Load the stops serving each feature saved by SaveFeatureStops() as an
+    InternedFeatureStops.'''
+
+    c.execute("SELECT stop_id FROM %sStops ORDER BY stop_idx;" % TablePrefix)
+    stopids = [stop[0] for stop in c.fetchall()]
+
+    c.execute("SELECT stop_idxs FROM %sStopSets ORDER BY set_id;" % TablePrefix)
+    stopsets = [tuple([stopids[stopidx] for stopidx in UnpackStopIndexes(stopset[0])])
+                    for stopset in c.fetchall()]
+
+    c.execute("SELECT feature_id, set_id FROM %sFeatures;" % TablePrefix)
+    featurestopsetdict = dict(c.fetchall())
+
+    return InternedFeatureStops(featurestopsetdict, stopsets)
@@ -0,0 +1,635 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - GTFS Queries
+## Last updated: 18 October 2026
+############################################################################
+''' This file contains the queries that find the trips and stop_times serving
+each stop in a time window in a GTFS SQL database made by the Preprocess GTFS
+tool.  It doesn't use arcpy.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import sqlite3, operator, datetime
+from bbb_core import messages, resultcache, sqltrace, stopgroups
+
+# Number of seconds in a day.
+SecsInDay = 86400
+
+# Days of the week
+days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+class AnalysisContext(object):
+    '''The state of one BetterBusBuffers analysis: a read-only connection to a
+    GTFS SQL database plus the settings and caches derived from it.  Each
+    context is independent, so several analyses (for different GTFS datasets or
+    time windows, for instance) can run at the same time in one process, with
+    one context per thread.  BBB_SharedFunctions wraps these methods in
+    module-level functions of the same names for the ArcGIS tools.'''
+
+    def __init__(self, SQLDbase=None, cursor=None):
+        '''Open a read-only connection to the SQLDbase, or use an existing
+        sqlite cursor.'''
+        self.conn = None
+        if SQLDbase:
+            self.conn = sqltrace.connect(SQLDbase)
+            self.conn.execute("PRAGMA query_only = ON;")
+            cursor = self.conn.cursor()
+        # sqlite cursor
+        self.c = cursor
+        # Whether or not to consider trips from yesterday or tomorrow
+        self.ConsiderYesterday = None
+        self.ConsiderTomorrow = None
+        # If the dataset uses a frequencies table, store the info in a dictionary
+        self.frequencies_dict_initialized = False
+        self.frequencies_dict = {}
+
+    def close(self):
+        '''Close the context's connection, if it opened one.'''
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def MakeServiceIDList(self, day):
+        '''Find the service ids for the selected day of the week and check for
+        non-overlapping date ranges.'''
+
+        # Find the service_ids that describe trips on our selected days of the week.
+        serviceidlist = []
+        startdatedict = {}
+        enddatedict = {}
+        serviceidfetch = '''
+            SELECT service_id, start_date, end_date FROM calendar
+            WHERE %s == "1"
+            ;''' % day.lower()
+        self.c.execute(serviceidfetch)
+        ids = self.c.fetchall()
+        for id in ids:
+            # Add to the list of service_ids
+            serviceidlist.append(id[0])
+            startdatedict[id[0]] = id[1]
+            enddatedict[id[0]] = id[2]
+
+        # Check for non-overlapping date ranges to prevent double-counting.
+        nonoverlappingsids = []
+        for sid in serviceidlist:
+            for eid in serviceidlist:
+                if startdatedict[sid] > enddatedict[eid]:
+                    nonoverlappingsids.append((sid, eid))
+
+        return serviceidlist, nonoverlappingsids
+
+
+    def MakeServiceIDListForDate(self, date):
+        '''Find the service ids running on a specific date (a datetime.date):
+        the ones in calendar whose date range and weekdays include the date,
+        with the calendar_dates exceptions for the date added or removed.'''
+
+        datestring = date.strftime("%Y%m%d")
+        serviceidfetch = '''
+            SELECT service_id FROM calendar
+            WHERE %s == "1"
+            AND start_date <= ? AND end_date >= ?
+            ;''' % days[date.weekday()].lower()
+        self.c.execute(serviceidfetch, (datestring, datestring))
+        serviceids = set([sid[0] for sid in self.c.fetchall()])
+
+        if "calendar_dates" in self.GetGTFSTableNames():
+            exceptionfetch = '''
+                SELECT service_id, exception_type FROM calendar_dates
+                WHERE date == ?
+                ;'''
+            self.c.execute(exceptionfetch, (datestring,))
+            for service_id, exception_type in self.c.fetchall():
+                if int(exception_type) == 1:
+                    serviceids.add(service_id)
+                elif int(exception_type) == 2:
+                    serviceids.discard(service_id)
+
+        return sorted(serviceids)
+
+
+    def GetServiceIDListsAndNonOverlaps(self, DayOfWeek, start_sec, end_sec, DepOrArr):
+        ''' Get the lists of service ids for today, yesterday, and tomorrow, and
+        combine non-overlapping date range list for all days'''
+
+        # Determine if it's early enough in the day that we need to consider trips
+        # still running from yesterday - these set global variables
+        if not self.ConsiderYesterday:
+            self.ShouldConsiderYesterday(start_sec, DepOrArr)
+        # If our time window spans midnight, we need to check tomorrow's trips, too.
+        if not self.ConsiderTomorrow:
+            self.ShouldConsiderTomorrow(end_sec)
+        # And what weekdays are yesterday and tomorrow?
+        Yesterday = days[(days.index(DayOfWeek) - 1)%7] # %7 wraps it around
+        Tomorrow = days[(days.index(DayOfWeek) + 1)%7] # %7 wraps it around
+
+        try:
+            # Get the service ids applicable for the current day of the week
+            # Furthermore, get list of service ids with non-overlapping date ranges.
+            serviceidlist, nonoverlappingsids = self.MakeServiceIDList(DayOfWeek)
+
+            # If we need to consider yesterday's trips, get the service ids.
+            serviceidlist_yest = []
+            nonoverlappingsids_yest = []
+            if self.ConsiderYesterday:
+                serviceidlist_yest, nonoverlappingsids_yest = self.MakeServiceIDList(Yesterday)
+
+            # If we need to consider tomorrow's trips, get the service ids.
+            serviceidlist_tom = []
+            nonoverlappingsids_tom = []
+            if self.ConsiderTomorrow:
+                serviceidlist_tom, nonoverlappingsids_tom = self.MakeServiceIDList(Tomorrow)
+        except:
+            messages.AddError("Error getting list of service_ids for time window.")
+            raise
+
+        # Make sure there is service on the day we're analyzing.
+        if not serviceidlist and not serviceidlist_yest and not serviceidlist_tom:
+            messages.AddWarning("There is no transit service during this time window. \
+No service_ids cover the weekday you have selected.")
+
+        # Combine lists of non-overlapping date range pairs of service ids
+        nonoverlappingsids += nonoverlappingsids_yest
+        nonoverlappingsids += nonoverlappingsids_tom
+        nonoverlappingsids = list(set(nonoverlappingsids))
+
+        return serviceidlist, serviceidlist_yest, serviceidlist_tom, nonoverlappingsids
+
+
+    def MakeTripList(self, serviceidlist):
+        '''Select the trips with the service_ids of interest'''
+
+        triplist = []
+        for service_id in serviceidlist:
+            tripsfetch = '''
+                SELECT DISTINCT trip_id FROM trips
+                WHERE service_id == ?
+                ;'''
+            self.c.execute(tripsfetch, (service_id,))
+            selectedtrips = self.c.fetchall()
+            for tr in selectedtrips:
+                triplist.append(tr[0])
+        # There shouldn't be any duplicates, but check anyway.
+        triplist = list(set(triplist))
+
+        return triplist
+
+
+    def MakeFrequenciesDict(self):
+        '''Put the frequencies.txt information into a dictionary'''
+
+        # Check if the dataset uses frequency. If not, no need to do more.
+        tblnamelist = self.GetGTFSTableNames()
+        if not "frequencies" in tblnamelist:
+            self.frequencies_dict_initialized = True
+            return
+
+        # Fill the dictionary
+        self.frequencies_dict = {}
+        freqfetch = '''
+            SELECT trip_id, start_time, end_time, headway_secs
+            FROM frequencies
+            ;'''
+        self.c.execute(freqfetch)
+        freqlist = self.c.fetchall()
+        for freq in freqlist:
+            trip_id = freq[0]
+            trip_data = [freq[1], freq[2], freq[3]]
+            # {trip_id: [start_time, end_time, headway_secs]}
+            self.frequencies_dict.setdefault(trip_id, []).append(trip_data)
+        self.frequencies_dict_initialized = True
+        return
+
+
+    def GetStopTimesForStopsInTimeWindow(self, start, end, DepOrArr, triplist, day):
+        '''Return a dictionary of {stop_id: [[trip_id, stop_time]]} for trips and
+        stop_times in the time window. Adjust the stop_time value to today's time of
+        day if it is a trip from yesterday or tomorrow.'''
+
+        # Adjust times for trips from yesterday or tomorrow
+        if day == "yesterday":
+            start += SecsInDay
+            end += SecsInDay
+        if day == "tomorrow":
+            start = start - SecsInDay
+            end = end - SecsInDay
+
+        # If we haven't already, initialize the frequencies dictionary so we can
+        # find trips that use the frequencies table instead of stop_times and
+        # treat them accordingly.
+        if not self.frequencies_dict_initialized:
+            self.MakeFrequenciesDict()
+
+        stoptimedict = {} # {stop_id: [[trip_id, stop_time]]}
+        for trip in triplist:
+
+            # If the trip uses the frequencies.txt file, extrapolate the stop_times
+            # throughout the day using the relative time between the stops given in
+            # stop_times and the headways listed in frequencies.
+            if trip in self.frequencies_dict:
+
+                # Grab the stops stop_times for this trip
+                stopsfetch = '''
+                    SELECT stop_id, %s FROM stop_times
+                    WHERE trip_id == ?
+                    ;''' % DepOrArr
+                self.c.execute(stopsfetch, (trip,))
+                StopTimes = self.c.fetchall()
+                # Sort by time
+                StopTimes.sort(key=operator.itemgetter(1))
+                # time 0 for this trip
+                initial_stop_time = int(StopTimes[0][1])
+
+                # Extrapolate using the headway and time windows from frequencies to
+                # find the stop visits. Add them to the dictionary if they fall within
+                # our analysis time window.
+                for window in self.frequencies_dict[trip]:
+                    start_timeofday = window[0]
+                    end_timeofday = window[1]
+                    headway = window[2]
+                    # Increment by by headway to create new stop visits
+                    for i in range(int(round(start_timeofday, 0)), int(round(end_timeofday, 0)), headway):
+                        for stop in StopTimes:
+                            time_along_trip = int(stop[1]) - initial_stop_time
+                            stop_time = i + time_along_trip
+                            if start < stop_time < end:
+                                if day == "yesterday":
+                                    stop_time = stop_time - SecsInDay
+                                elif day == "tomorrow":
+                                    stop_time += SecsInDay
+                                # To distinguish between stop visits, since all frequency-based
+                                # trips have the same id, create a special id based on the day
+                                # and time of day: trip_id_DayStartTime. This ensures that the
+                                # number of trips will be counted correctly later and not eliminated
+                                # as being the same trip
+                                special_trip_name = trip + "_%s%s" % (day, str(i))
+                                stoptimedict.setdefault(stop[0], []).append([special_trip_name, stop_time])
+
+            # If the trip doesn't use frequencies, get the stop times directly
+            else:
+                # Grab the stop_times within the time window
+                stopsfetch = '''
+                    SELECT stop_id, %s FROM stop_times
+                    WHERE trip_id == ?
+                    AND %s BETWEEN ? AND ?
+                    ;''' % (DepOrArr, DepOrArr)
+                self.c.execute(stopsfetch, (trip, start, end,))
+                StopTimes = self.c.fetchall()
+
+                for stoptime in StopTimes:
+                    stop_id = stoptime[0]
+                    stop_time = int(stoptime[1])
+                    if day == "yesterday":
+                        stop_time = stop_time - SecsInDay
+                    elif day == "tomorrow":
+                        stop_time += SecsInDay
+                    stoptimedict.setdefault(stop_id, []).append([trip, stop_time])
+
+        return stoptimedict
+
+
+    def GetStopTimesForRouteDirectionsInTimeWindow(self, start, end, DepOrArr, pairtripdict):
+        '''For each (route_id, direction_id) pair in {pair: [trip_id, ...]},
+        find the stop_times of the pair's trips in the time window today, and
+        the ones from yesterday and tomorrow that fall in the time window.
+        Returns a dictionary of {pair: {stop_id: [[trip_id, stop_time]]}}, like
+        calling GetStopTimesForStopsInTimeWindow() for today, yesterday, and
+        tomorrow for each pair, but with one query for all the pairs. A
+        direction_id of None or "" means the route's trips in any direction.'''
+
+        if not self.frequencies_dict_initialized:
+            self.MakeFrequenciesDict()
+
+        pairstoptimedict = {} # {pair: {stop_id: [[trip_id, stop_time]]}}
+        trippairdict = {} # {trip_id: [pair, ...]} for trips that don't use frequencies
+        for pair in pairtripdict:
+            pairstoptimedict[pair] = {}
+            freqtrips = []
+            for trip in pairtripdict[pair]:
+                if trip in self.frequencies_dict:
+                    freqtrips.append(trip)
+                else:
+                    trippairdict.setdefault(trip, []).append(pair)
+            # Trips that use frequencies.txt are extrapolated from their headways.
+            if freqtrips:
+                stoptimedict = pairstoptimedict[pair]
+                for day in ["today", "yesterday", "tomorrow"]:
+                    daystoptimedict = self.GetStopTimesForStopsInTimeWindow(start, end, DepOrArr, freqtrips, day)
+                    for stop in daystoptimedict:
+                        stoptimedict.setdefault(stop, []).extend(daystoptimedict[stop])
+
+        # The time window today, and the same time of day in yesterday's and
+        # tomorrow's times, with the adjustment back to today's time of day.
+        windows = [(start, end, 0),
+                   (start + SecsInDay, end + SecsInDay, -SecsInDay),
+                   (start - SecsInDay, end - SecsInDay, SecsInDay)]
+
+        # Select the stop_times for all the pairs at once, in batches of pairs
+        # to stay under the SQL variable limit.
+        pairs = list(pairtripdict)
+        for batchstart in range(0, len(pairs), 200):
+            batch = set(pairs[batchstart:batchstart + 200])
+            conditions = []
+            params = []
+            for route_id, direction_id in batch:
+                if direction_id in (None, ""):
+                    conditions.append("trips.route_id = ?")
+                    params.append(route_id)
+                else:
+                    conditions.append("(trips.route_id = ? AND trips.direction_id = ?)")
+                    params += [route_id, direction_id]
+            stopsfetch = '''
+                SELECT trips.trip_id, stop_times.stop_id, stop_times.%s
+                FROM trips JOIN stop_times ON trips.trip_id = stop_times.trip_id
+                WHERE (%s)
+                AND (stop_times.%s BETWEEN ? AND ?
+                    OR stop_times.%s BETWEEN ? AND ?
+                    OR stop_times.%s BETWEEN ? AND ?)
+                ;''' % (DepOrArr, " OR ".join(conditions), DepOrArr, DepOrArr, DepOrArr)
+            for window in windows:
+                params += [window[0], window[1]]
+            self.c.execute(stopsfetch, params)
+
+            for trip, stop_id, stop_time in self.c:
+                if trip not in trippairdict:
+                    continue
+                stop_time = int(stop_time)
+                for windowstart, windowend, adjustment in windows:
+                    if windowstart <= stop_time <= windowend:
+                        for pair in trippairdict[trip]:
+                            if pair in batch:
+                                pairstoptimedict[pair].setdefault(stop_id, []).append([trip, stop_time + adjustment])
+
+        return pairstoptimedict
+
+
+    def ShouldConsiderYesterday(self, start_sec, DepOrArr):
+        '''Determine if it's early enough in the day that we need to consider trips
+        still running from the day before. Do this by finding the largest stop_time
+        in the GTFS file and comparing it to the user's start time.'''
+        self.ConsiderYesterday = 0
+        # Select the largest stop time
+        MaxTimeFetch = '''
+            SELECT MAX(%s) FROM stop_times
+            ;''' % (DepOrArr)
+        self.c.execute(MaxTimeFetch)
+        MaxTime = self.c.fetchone()[0]
+        if start_sec < MaxTime - SecsInDay:
+            self.ConsiderYesterday = 1
+
+
+    def ShouldConsiderTomorrow(self, end_sec):
+        '''Return whether a time is greater than midnight.'''
+        self.ConsiderTomorrow = 0
+        if end_sec > SecsInDay:
+            self.ConsiderTomorrow = 1
+
+
+    def CountTripsAtStops(self, DayOfWeek, start_sec, end_sec, DepOrArr):
+        '''Given a time window, return a dictionary of
+        {stop_id: [[trip_id, stop_time]]}'''
+
+        return self.CountTripsAtStopsForDays([DayOfWeek], start_sec, end_sec, DepOrArr)[DayOfWeek]
+
+
+    def CountTripsAtStopsForDays(self, DaysOfWeek, start_sec, end_sec, DepOrArr):
+        '''Given a list of weekdays and a time window, return a dictionary of
+        {DayOfWeek: {stop_id: [[trip_id, stop_time]]}}.  The trips from the day
+        before and after are taken from the service ids running on those
+        weekdays, as CountTripsAtStopsForDates() does for dates.  Weekdays with
+        the same service_ids on the day and the days around it share the same
+        stoptimedict, so the trips and stop_times are only extracted once for
+        them.'''
+
+        triplistdict = {} # {sorted tuple of service_ids: triplist}
+        stoptimedictdict = {} # {(today's, yesterday's, tomorrow's sorted service_ids): stoptimedict}
+        daystoptimedict = {} # {DayOfWeek: stoptimedict}
+
+        def GetTripList(serviceidlist):
+            '''Get the list of trips with these service ids, reusing the list if
+            it was already made for another day.'''
+            serviceidkey = tuple(sorted(serviceidlist))
+            try:
+                return triplistdict[serviceidkey]
+            except KeyError:
+                triplist = triplistdict[serviceidkey] = self.MakeTripList(serviceidlist)
+                return triplist
+
+        for DayOfWeek in DaysOfWeek:
+            if DayOfWeek in daystoptimedict:
+                continue
+
+            serviceidlist, serviceidlist_yest, serviceidlist_tom, nonoverlappingsids = \
+                self.GetServiceIDListsAndNonOverlaps(DayOfWeek, start_sec, end_sec, DepOrArr)
+
+            # If there are nonoverlapping date ranges in our data, raise a warning.
+            if nonoverlappingsids:
+                overlapwarning = "Warning! Your calendar.txt file(s) contain(s) \
+non-overlapping date ranges. Your output might be double counting the number \
+of trips available. Please check the date ranges in your calendar.txt file(s). \
+See the User's Guide for further assistance.  Date ranges do not overlap in the \
+following pairs of service_ids used in \
+this analysis: " + str(nonoverlappingsids)
+                messages.AddWarning(overlapwarning)
+
+            # Days with the same service ids on the day and the days around it
+            # have the same stop_times.
+            serviceidkey = (tuple(sorted(serviceidlist)), tuple(sorted(serviceidlist_yest)),
+                            tuple(sorted(serviceidlist_tom)))
+            if serviceidkey in stoptimedictdict:
+                daystoptimedict[DayOfWeek] = stoptimedictdict[serviceidkey]
+                continue
+
+            # Check if this query has been run on this GTFS dataset before.
+            cachekey = None
+            if resultcache.CacheFile:
+                cachekey = resultcache.MakeKey(self.GetFeedHash(), "stops",
+                                    serviceidkey, start_sec, end_sec, DepOrArr)
+                stoptimedict = resultcache.LoadStopTimes(cachekey)
+                if stoptimedict is not None:
+                    messages.AddMessage("Loaded stop_times for %s from the result cache." % DayOfWeek)
+                    stoptimedictdict[serviceidkey] = daystoptimedict[DayOfWeek] = stoptimedict
+                    continue
+
+            try:
+                # Get the list of trips with these service ids.
+                triplist = GetTripList(serviceidlist)
+
+                # Yesterday's and tomorrow's trips are only fetched if their service
+                # ids are different than ones we already have trips for.
+                triplist_yest = []
+                if self.ConsiderYesterday:
+                    triplist_yest = GetTripList(serviceidlist_yest)
+
+                triplist_tom = []
+                if self.ConsiderTomorrow:
+                    triplist_tom = GetTripList(serviceidlist_tom)
+            except:
+                messages.AddError("Error creating list of trips for time window.")
+                raise
+
+            # Make sure there is service on the day we're analyzing.
+            if not triplist and not triplist_yest and not triplist_tom:
+                messages.AddWarning("There is no transit service during this time window. \
+No trips are running.")
+
+
+            try:
+                # Get the stop_times that occur during this time window
+                stoptimedict = self.GetStopTimesForStopsInTimeWindow(start_sec, end_sec, DepOrArr, triplist, "today")
+                stoptimedict_yest = self.GetStopTimesForStopsInTimeWindow(start_sec, end_sec, DepOrArr, triplist_yest, "yesterday")
+                stoptimedict_tom = self.GetStopTimesForStopsInTimeWindow(start_sec, end_sec, DepOrArr, triplist_tom, "tomorrow")
+
+                # Combine the three dictionaries into one master
+                for stop in stoptimedict_yest:
+                    stoptimedict[stop] = stoptimedict.setdefault(stop, []) + stoptimedict_yest[stop]
+                for stop in stoptimedict_tom:
+                    stoptimedict[stop] = stoptimedict.setdefault(stop, []) + stoptimedict_tom[stop]
+
+            except:
+                messages.AddError("Error creating dictionary of stops and trips in time window.")
+                raise
+
+            stoptimedictdict[serviceidkey] = daystoptimedict[DayOfWeek] = stoptimedict
+            if cachekey:
+                resultcache.StoreStopTimes(cachekey, stoptimedict)
+
+        if resultcache.CacheFile:
+            messages.AddMessage("Result cache: %i hits, %i misses." % (resultcache.Hits, resultcache.Misses))
+
+        return daystoptimedict
+
+
+    def CountTripsAtStopsForDates(self, dates, start_sec, end_sec, DepOrArr):
+        '''Given a list of specific dates (datetime.dates) and a time window,
+        return a dictionary of {date: {stop_id: [[trip_id, stop_time]]}}.  The
+        trips from the day before and after are taken from the service ids
+        running on those dates.  The stop_times of each service id are only
+        extracted once, and dates with the same service ids on the date and
+        the days around it share the same stoptimedict.'''
+
+        if not self.ConsiderYesterday:
+            self.ShouldConsiderYesterday(start_sec, DepOrArr)
+        if not self.ConsiderTomorrow:
+            self.ShouldConsiderTomorrow(end_sec)
+        oneday = datetime.timedelta(days=1)
+
+        serviceiddict = {} # {date: tuple of service_ids}
+        def GetServiceIDs(date):
+            '''Get the service ids running on a date, reusing them if they were
+            already found for another date.'''
+            try:
+                return serviceiddict[date]
+            except KeyError:
+                serviceids = serviceiddict[date] = tuple(self.MakeServiceIDListForDate(date))
+                return serviceids
+
+        sidstoptimedict = {} # {(service_id, day): stoptimedict}
+        stoptimedictdict = {} # {(today's, yesterday's, tomorrow's service_ids): stoptimedict}
+        datestoptimedict = {} # {date: stoptimedict}
+        try:
+            for date in dates:
+                serviceidkey = (GetServiceIDs(date),
+                                GetServiceIDs(date - oneday) if self.ConsiderYesterday else (),
+                                GetServiceIDs(date + oneday) if self.ConsiderTomorrow else ())
+                if serviceidkey in stoptimedictdict:
+                    datestoptimedict[date] = stoptimedictdict[serviceidkey]
+                    continue
+
+                if not serviceidkey[0]:
+                    messages.AddWarning("There is no transit service on %s. \
+No service_ids cover this date." % date.strftime("%Y%m%d"))
+
+                # Combine the stop_times of the service ids running on the date
+                # and, adjusted to the date's time of day, the days around it.
+                stoptimedict = {}
+                for day, serviceids in zip(["today", "yesterday", "tomorrow"], serviceidkey):
+                    for service_id in serviceids:
+                        if (service_id, day) not in sidstoptimedict:
+                            triplist = self.MakeTripList([service_id])
+                            sidstoptimedict[(service_id, day)] = self.GetStopTimesForStopsInTimeWindow(
+                                                start_sec, end_sec, DepOrArr, triplist, day)
+                        sidstoptimes = sidstoptimedict[(service_id, day)]
+                        for stop in sidstoptimes:
+                            stoptimedict.setdefault(stop, []).extend(sidstoptimes[stop])
+
+                stoptimedictdict[serviceidkey] = datestoptimedict[date] = stoptimedict
+        except:
+            messages.AddError("Error creating dictionary of stops and trips for the dates.")
+            raise
+
+        messages.AddMessage("The %i dates have %i unique sets of service_ids." %
+                            (len(datestoptimedict), len(stoptimedictdict)))
+
+        return datestoptimedict
+
+
+    def GetFeedHash(self):
+        '''Return a hash of the contents of the connected GTFS SQL database, for
+        use in result cache keys.'''
+        self.c.execute("PRAGMA database_list;")
+        for db in self.c.fetchall():
+            if db[1] == "main":
+                return resultcache.GetFeedHash(db[2])
+
+
+    def GetStopLocations(self):
+        '''Return lists of the stop_ids, latitudes, and longitudes of the stops.'''
+        stopids = []
+        stoplats = []
+        stoplons = []
+        self.c.execute("SELECT stop_id, stop_lat, stop_lon FROM stops;")
+        for stop in self.c.fetchall():
+            stopids.append(stop[0])
+            stoplats.append(float(stop[1]))
+            stoplons.append(float(stop[2]))
+        return stopids, stoplats, stoplons
+
+
+    def GetStopGroups(self, tolerance=0):
+        '''Group the stops in the same station, or in the same grid cell of
+        tolerance meters, for the network analyses. Returns a dictionary of
+        {representative stop_id: [stop_id, ...]} - see stopgroups.'''
+        self.c.execute("SELECT stop_id, stop_lat, stop_lon, parent_station FROM stops;")
+        stops = [(stop[0], float(stop[1]), float(stop[2]), stop[3]) for stop in self.c.fetchall()]
+        return stopgroups.GroupStops(stops, tolerance)
+
+
+    def GetGTFSTableNames(self):
+        '''Return a list of SQL database table names'''
+        GetTblNamesStmt = "SELECT name FROM sqlite_master WHERE type='table';"
+        self.c.execute(GetTblNamesStmt)
+        tblnames = self.c.fetchall()
+        tblnamelist = []
+        for name in tblnames:
+            tblnamelist.append(name[0])
+        return tblnamelist
+
+
+def parse_date(YMD):
+    '''Convert a YYYYMMDD date string to a datetime.date.'''
+    return datetime.datetime.strptime(YMD, "%Y%m%d").date()
+
+
+def MakeDateRange(start_date, end_date):
+    '''Return the list of dates from start_date to end_date, inclusive.'''
+    return [start_date + datetime.timedelta(days=offset)
+            for offset in range((end_date - start_date).days + 1)]
+
+
+def parse_time(HMS):
+    '''Convert HH:MM:SS to seconds since midnight, for comparison purposes.'''
+    H, M, S = HMS.split(':')
+    seconds = (float(H) * 3600) + (float(M) * 60) + float(S)
+    return seconds
@@ -0,0 +1,174 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Headways
+## Last updated: 18 October 2026
+############################################################################
+''' This file calculates the trip counts, max wait times, and headways for many
+groups of stop times (for instance, the stops of several routes) at once with
+vectorized numpy operations instead of one Python loop per group.  The stop
+times of all the groups are stored in one array, with an offsets array saying
+where each group's times start and end, like the FeatureStopsCSR in
+featurestops.  It doesn't use arcpy, but it does require numpy.
+
+It also calculates the distribution of the headways for sets of stops: the
+median and 90th percentile headway, the coefficient of variation of the
+headways, and the expected wait for a passenger arriving at a random time,
+E[h^2] / 2E[h].'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import numpy as np
+from bbb_core.stats import MergeStopTimes, RoundToMinutes
+
+# Number of sets of stops to calculate the headway statistics for at once
+ChunkSize = 5000
+
+
+def MakeGroupedStopTimes(stoptimelists, presorted=False):
+    '''Put a list of lists of stop times into one array of the times, sorted
+    within each group, and an array of offsets: the times of group i are
+    times[offsets[i]:offsets[i + 1]].  If presorted is True, the lists are
+    already sorted.'''
+
+    counts = np.array([len(stoptimelist) for stoptimelist in stoptimelists], dtype=np.int64)
+    offsets = np.zeros(len(stoptimelists) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    times = np.zeros(offsets[-1], dtype=np.int64)
+    for idx, stoptimelist in enumerate(stoptimelists):
+        times[offsets[idx]:offsets[idx + 1]] = stoptimelist
+    if not presorted:
+        # Sort each group's times by sorting on (group, time).
+        groups = np.repeat(np.arange(len(stoptimelists)), counts)
+        times = times[np.lexsort((times, groups))]
+    return times, offsets
+
+
+def CalculateHeadwayStatsForGroups(stoptimelists, start_sec, end_sec):
+    '''For each list of stop times in a time window, return the number of stop
+    visits, the max wait time, and the average headway in minutes, like
+    CalculateHeadwayStats() does for one list.  Returns three lists, with None
+    for the max wait times and headways that can't be calculated.'''
+
+    times, offsets = MakeGroupedStopTimes(stoptimelists)
+    counts = np.diff(offsets)
+    NumGroups = len(counts)
+    MaxWaitTimes = [None] * NumGroups
+    AvgHeadways = [None] * NumGroups
+
+    # Only groups with at least two stop visits have headways.
+    multi = np.flatnonzero(counts > 1)
+    if len(multi):
+        firsts = times[offsets[multi]]
+        lasts = times[offsets[multi + 1] - 1]
+
+        # The headways between adjacent visits in the same group. The
+        # differences across the boundaries between groups are set to -1 so
+        # they never win the max.
+        headways = np.diff(times)
+        boundaries = offsets[1:-1] - 1
+        headways[boundaries[(boundaries >= 0) & (boundaries < len(headways))]] = -1
+        MaxHeadways = np.maximum.reduceat(headways, offsets[multi])
+
+        # Exclude cases where the time to the time window boundaries is
+        # > MaxWaitTime because we can't properly determine MaxWaitTime.
+        MaxEdges = np.maximum(firsts - start_sec, end_sec - lasts)
+        valid = MaxEdges < MaxHeadways
+        MaxWaitTimeMinutes = RoundToMinutes(MaxHeadways)
+        # The headways sum to the time between the first and last visits.
+        AvgHeadwayMinutes = RoundToMinutes((lasts - firsts) / (counts[multi] - 1).astype(float))
+
+        for idx, group in enumerate(multi.tolist()):
+            if valid[idx]:
+                MaxWaitTimes[group] = int(MaxWaitTimeMinutes[idx])
+            AvgHeadways[group] = int(AvgHeadwayMinutes[idx])
+
+    return counts.tolist(), MaxWaitTimes, AvgHeadways
+
+
+def CalculateHeadwayDistributionForGroups(times, offsets, start_sec, end_sec):
+    '''For each group of sorted stop times from MakeGroupedStopTimes(), return
+    the max wait time, median headway, and 90th percentile headway in minutes,
+    the coefficient of variation of the headways, and the expected wait in
+    minutes for a passenger arriving at a random time.  Returns a list of
+    (MaxWaitTime, MedianHeadway, Headway90, HeadwayCV, ExpectedWait) tuples,
+    with None for the values that can't be calculated.'''
+
+    counts = np.diff(offsets)
+    NumGroups = len(counts)
+    groupstats = [(None, None, None, None, None)] * NumGroups
+
+    # Only groups with at least two stop visits have headways.
+    multi = np.flatnonzero(counts > 1)
+    if not len(multi):
+        return groupstats
+
+    # The headways between adjacent visits in the same group, sorted within
+    # each group. The differences across the boundaries between groups are
+    # dropped.
+    headways = np.diff(times)
+    groups = np.repeat(np.arange(NumGroups), counts)[:-1]
+    valid = np.ones(len(headways), dtype=bool)
+    boundaries = offsets[1:-1] - 1
+    valid[boundaries[(boundaries >= 0) & (boundaries < len(headways))]] = False
+    headways = headways[valid]
+    groups = groups[valid]
+    order = np.lexsort((headways, groups))
+    headways = headways[order].astype(float)
+    groups = groups[order]
+
+    NumHeadways = (counts[multi] - 1)
+    starts = np.zeros(NumGroups + 1, dtype=np.int64)
+    np.cumsum(np.maximum(counts - 1, 0), out=starts[1:])
+    starts = starts[multi]
+
+    SumHeadways = np.bincount(groups, weights=headways, minlength=NumGroups)[multi]
+    SumSquares = np.bincount(groups, weights=headways * headways, minlength=NumGroups)[multi]
+    MeanHeadways = SumHeadways / NumHeadways
+
+    # Exclude cases where the time to the time window boundaries is
+    # > MaxWaitTime because we can't properly determine MaxWaitTime.
+    MaxHeadways = headways[starts + NumHeadways - 1]
+    MaxEdges = np.maximum(times[offsets[multi]] - start_sec, end_sec - times[offsets[multi + 1] - 1])
+    MaxWaitTimes = RoundToMinutes(MaxHeadways)
+    # Median, and nearest-rank 90th percentile like CalculateHeadwayStats()
+    Medians = RoundToMinutes((headways[starts + (NumHeadways - 1) // 2] +
+                              headways[starts + NumHeadways // 2]) / 2)
+    Headway90s = RoundToMinutes(headways[starts + np.ceil(0.9 * NumHeadways).astype(np.int64) - 1])
+    Variances = np.maximum(SumSquares / NumHeadways - MeanHeadways * MeanHeadways, 0)
+
+    for idx, group in enumerate(multi.tolist()):
+        MaxWaitTime = HeadwayCV = ExpectedWait = None
+        if MaxEdges[idx] < MaxHeadways[idx]:
+            MaxWaitTime = int(MaxWaitTimes[idx])
+        if SumHeadways[idx] > 0:
+            HeadwayCV = round(float(np.sqrt(Variances[idx]) / MeanHeadways[idx]), 2)
+            ExpectedWait = round(float(SumSquares[idx] / (2 * SumHeadways[idx])) / 60, 2)
+        groupstats[group] = (MaxWaitTime, int(Medians[idx]), int(Headway90s[idx]),
+                             HeadwayCV, ExpectedWait)
+
+    return groupstats
+
+
+def CalculateHeadwayDistributionForStopSets(stopsets, sortedstoptimes, start_sec, end_sec):
+    '''For each set of stops, merge the presorted stop times
+    {stop_id: [stop_time, ...]} from MakeSortedStopTimes() and return the
+    (MaxWaitTime, MedianHeadway, Headway90, HeadwayCV, ExpectedWait) for that
+    set of stops, calculated ChunkSize sets of stops at a time.'''
+
+    stopsetstats = []
+    for chunkstart in range(0, len(stopsets), ChunkSize):
+        stoptimelists = [MergeStopTimes(stopset, sortedstoptimes)
+                         for stopset in stopsets[chunkstart:chunkstart + ChunkSize]]
+        times, offsets = MakeGroupedStopTimes(stoptimelists, True)
+        stopsetstats += CalculateHeadwayDistributionForGroups(times, offsets, start_sec, end_sec)
+    return stopsetstats
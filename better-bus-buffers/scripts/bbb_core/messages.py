@@ -0,0 +1,49 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Messages
+## Last updated: 18 October 2026
+############################################################################
+''' This file passes the messages from the BetterBusBuffers core functions on to
+whatever is running them.  The ArcGIS tools set handler to arcpy so that the
+messages show up in the tool dialog.  Otherwise they are written to stderr.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import sys
+
+# Object with AddMessage, AddWarning, and AddError methods, such as arcpy.
+handler = None
+
+
+def AddMessage(message):
+    '''Report an informative message.'''
+    if handler:
+        handler.AddMessage(message)
+    else:
+        sys.stderr.write(message + "\n")
+
+
+def AddWarning(message):
+    '''Report a warning.'''
+    if handler:
+        handler.AddWarning(message)
+    else:
+        sys.stderr.write("WARNING: " + message + "\n")
+
+
+def AddError(message):
+    '''Report an error.'''
+    if handler:
+        handler.AddError(message)
+    else:
+        sys.stderr.write("ERROR: " + message + "\n")
@@ -0,0 +1,141 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Profiling
+## Last updated: 18 October 2026
+############################################################################
+''' This file times the stages of the BetterBusBuffers tools, so a slow run
+shows whether the time went into the network solve, counting the trips, or
+writing the output.  Each stage is run in a Stage context manager, which
+records its wall time, CPU time, and number of rows, and Report() shows a
+summary table at the end of the tool, including when the tool fails or is
+canceled.
+
+The peak memory of each stage is only tracked when the BBB_PROFILE
+environment variable is set to a file path (or the command line tool's
+--profile option is used), because tracemalloc slows the analysis down.  It
+needs Python 3, so the Peak (MB) column is empty under ArcMap's Python 2 and
+in runs that aren't writing a profile.  Each run's profile is appended to the
+file as one line of JSON for tracking trends over many runs.
+
+If SQL tracing is on (see sqltrace), Report() also shows the SQL statement
+report.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import os, time, json
+from bbb_core import messages, sqltrace
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 doesn't have tracemalloc.
+    tracemalloc = None
+
+# Path to the JSON-lines profile file. No file is written if this is empty.
+ProfileFile = os.environ.get("BBB_PROFILE", "")
+
+# Track the peak memory of each stage. tracemalloc slows the analysis down, so
+# it's only on when a profile file is written.
+TrackMemory = bool(ProfileFile)
+
+# Name of the tool being profiled and the stages recorded so far
+ToolName = None
+Stages = []
+
+
+def CPUTime():
+    '''Return the CPU time used by this process so far, in seconds.'''
+    times = os.times()
+    return times[0] + times[1]
+
+
+def Start(toolname):
+    '''Start profiling a run of a tool, forgetting the stages of earlier runs.'''
+    global ToolName, Stages
+    ToolName = toolname
+    Stages = []
+    sqltrace.Reset()
+
+
+class Stage(object):
+    '''Context manager that records the wall time, CPU time, peak memory, and
+    number of rows of one stage of a tool.  Set the rows attribute in the
+    with block to record a row count. Stages shouldn't be nested, because the
+    peak memory is reset at the start of each stage.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+
+    def __enter__(self):
+        if TrackMemory and tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        self.wall_start = time.time()
+        self.cpu_start = CPUTime()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stage = {"stage": self.name,
+                 "wall_time": time.time() - self.wall_start,
+                 "cpu_time": CPUTime() - self.cpu_start,
+                 "peak_memory": None,
+                 "rows": self.rows,
+                 "failed": exc_type is not None}
+        if TrackMemory and tracemalloc and tracemalloc.is_tracing():
+            stage["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        Stages.append(stage)
+        return False
+
+
+def Report():
+    '''Show a summary table of the stages and the traced SQL statements and, if
+    ProfileFile is set, append the profile to it.'''
+
+    SQLReport = sqltrace.FormatReport()
+    if SQLReport:
+        messages.AddMessage(SQLReport)
+
+    if not Stages:
+        return
+
+    lines = ["Stage timing:",
+             "%-40s %10s %10s %10s %10s" % ("Stage", "Wall (s)", "CPU (s)", "Peak (MB)", "Rows")]
+    for stage in Stages:
+        peak = ""
+        if stage["peak_memory"] is not None:
+            peak = "%.1f" % (stage["peak_memory"] / (1024.0 * 1024.0))
+        rows = "" if stage["rows"] is None else str(stage["rows"])
+        name = stage["stage"] + (" (failed)" if stage["failed"] else "")
+        lines.append("%-40s %10.2f %10.2f %10s %10s" % (name[:40],
+                        stage["wall_time"], stage["cpu_time"], peak, rows))
+    lines.append("%-40s %10.2f %10.2f" % ("Total",
+                    sum([stage["wall_time"] for stage in Stages]),
+                    sum([stage["cpu_time"] for stage in Stages])))
+    if not tracemalloc:
+        lines.append("Peak memory isn't tracked in Python 2.")
+    elif not TrackMemory:
+        lines.append("Set the BBB_PROFILE environment variable to a file path to track \
+the peak memory.")
+    messages.AddMessage("\n".join(lines))
+
+    if ProfileFile:
+        # Report() runs when the tool fails too, so don't hide its error.
+        try:
+            with open(ProfileFile, "a") as f:
+                f.write(json.dumps({"tool": ToolName, "timestamp": time.time(),
+                                    "stages": Stages}) + "\n")
+        except (IOError, OSError) as e:
+            messages.AddWarning("Couldn't write the profile to %s: %s" % (ProfileFile, e))
@@ -0,0 +1,356 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - RAPTOR Routing
+## Last updated: 18 October 2026
+############################################################################
+''' This file finds the earliest arrival time at every stop from one or more
+origin stops with RAPTOR (Round-bAsed Public Transit Optimized Router, Delling,
+Pajor, and Werneck 2012), straight from the GTFS SQL database, without
+building and solving a network dataset.  It doesn't use arcpy, but it does
+require numpy.
+
+The trips running on a date are grouped into routes: trips that visit the same
+sequence of stops, let passengers board and get off at the same stops, and
+never overtake each other.  The trips from the day
+before that run past midnight are shifted to the date's time of day, like the
+tools do.  Trips that use the frequencies table are expanded into one trip per
+headway, like GetStopTimesForStopsInTimeWindow() does.  Each stop of each
+route is a column, and the departure and arrival times of a column's trips
+are stored together in flat arrays in trip order, so a whole RAPTOR round is
+a handful of vectorized numpy steps over all the routes at once:
+
+1. Find the earliest trip that can be boarded at the columns of the stops
+   improved in the last round (one searchsorted over all the departures).
+2. Carry the earliest trip boarded so far along each route (a running minimum
+   over the columns, kept from leaking between routes by a per-route offset).
+3. Look up the arrival times of those trips and keep the improvements.
+4. Walk from the improved stops to the stops near them, if walking transfers
+   were made.
+
+Round k finds the trips with k vehicles, so MaxTransfers + 1 rounds are run.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import datetime
+import numpy as np
+from bbb_core import gtfs, messages
+from bbb_core.catchment import FindStopsWithinDistance, EarthRadius
+
+# Arrival time of the stops that can't be reached
+Unreachable = np.iinfo(np.int32).max
+
+# The departure times are kept between MinTime and MinTime + ColumnKeyStep
+# (the trips from yesterday start before midnight) to sort them by column.
+MinTime = -gtfs.SecsInDay
+ColumnKeyStep = 2 ** 32
+
+DefaultMaxTransfers = 4
+
+# Walking speed for the walking transfers, in meters per second
+DefaultWalkSpeed = 1.34
+
+
+class RaptorTimetable(object):
+    '''The trips running on a date, grouped into routes and laid out in flat
+    arrays for RAPTOR queries.
+
+    stopids is the list of stop_ids, and the stops are referred to by their
+    index in it.  Route r has the columns route_coloffsets[r] to
+    route_coloffsets[r + 1] - 1, one for each stop it visits, in order, and
+    route_numtrips[r] trips.  Column c is at stop col_stops[c], and its trips'
+    departure and arrival times are departures[k] and arrivals[k] for k from
+    col_eventoffsets[c] to col_eventoffsets[c + 1] - 1, in the same trip order
+    for every column of the route.  Passengers can board the trips of column c
+    if col_canboard[c] and get off if col_canalight[c] (pickup_type and
+    drop_off_type aren't 1).  The walking transfers from stop
+    transfer_from[i] to transfer_to[i] take transfer_secs[i] seconds.'''
+
+    def __init__(self, SQLDbase, date, MaxWalkDistance=0, WalkSpeed=DefaultWalkSpeed):
+        '''Load the trips running on a date (a datetime.date) from the GTFS SQL
+        database.  If MaxWalkDistance is more than 0, passengers can also
+        transfer between stops up to that many meters apart (in a straight
+        line), walking at WalkSpeed meters per second.'''
+
+        context = gtfs.AnalysisContext(SQLDbase)
+        try:
+            self.stopids, stoplats, stoplons = context.GetStopLocations()
+            self.stopindexdict = dict((stop_id, idx) for idx, stop_id in enumerate(self.stopids))
+            trips = self.GetTripsForDate(context, date)
+        finally:
+            context.close()
+
+        self.MakeRoutes(trips)
+        self.MakeTransfers(stoplats, stoplons, MaxWalkDistance, WalkSpeed)
+
+
+    def GetTripsForDate(self, context, date):
+        '''Return a list of the trips running on the date as (stop indexes,
+        arrival times, departure times, whether passengers can't board at each
+        stop, whether passengers can't get off at each stop).'''
+
+        serviceids_today = set(context.MakeServiceIDListForDate(date))
+        serviceids_yest = set(context.MakeServiceIDListForDate(date - datetime.timedelta(days=1)))
+        if not serviceids_today and not serviceids_yest:
+            messages.AddWarning("There is no transit service on %s." % date.strftime("%Y%m%d"))
+        if not context.frequencies_dict_initialized:
+            context.MakeFrequenciesDict()
+
+        stoptimesfetch = '''
+            SELECT stop_times.trip_id, stop_id, arrival_time, departure_time,
+                pickup_type, drop_off_type
+            FROM stop_times JOIN trips ON stop_times.trip_id == trips.trip_id
+            WHERE trips.service_id == ?
+            ORDER BY stop_times.trip_id, stop_sequence
+            ;'''
+
+        trips = []
+        for service_id in sorted(serviceids_today | serviceids_yest):
+            # Days this service_id's trips run on, as the seconds to shift their
+            # times by.  Yesterday's trips are kept if they run past midnight.
+            shifts = []
+            if service_id in serviceids_today:
+                shifts.append(("today", 0))
+            if service_id in serviceids_yest:
+                shifts.append(("yesterday", -gtfs.SecsInDay))
+
+            context.c.execute(stoptimesfetch, (service_id,))
+            stoptimes = context.c.fetchall()
+            start = 0
+            while start < len(stoptimes):
+                trip_id = stoptimes[start][0]
+                end = start
+                while end < len(stoptimes) and stoptimes[end][0] == trip_id:
+                    end += 1
+                tripstoptimes = stoptimes[start:end]
+                start = end
+
+                stops = tuple([self.stopindexdict[stoptime[1]] for stoptime in tripstoptimes])
+                arrivals = [int(stoptime[2]) for stoptime in tripstoptimes]
+                departures = [int(stoptime[3]) for stoptime in tripstoptimes]
+                noboarding = [stoptime[4] == 1 for stoptime in tripstoptimes]
+                nodropoff = [stoptime[5] == 1 for stoptime in tripstoptimes]
+
+                # Trips using frequencies visit the stops every headway, with the
+                # same relative times as their stop_times.
+                starttimes = [0]
+                if trip_id in context.frequencies_dict:
+                    initial_stop_time = departures[0]
+                    arrivals = [stop_time - initial_stop_time for stop_time in arrivals]
+                    departures = [stop_time - initial_stop_time for stop_time in departures]
+                    starttimes = []
+                    for window in context.frequencies_dict[trip_id]:
+                        starttimes += range(int(round(window[0], 0)), int(round(window[1], 0)), window[2])
+
+                for day, shift in shifts:
+                    for starttime in starttimes:
+                        offset = starttime + shift
+                        if day == "yesterday" and arrivals[-1] + offset < 0:
+                            continue
+                        trips.append((stops,
+                            [stop_time + offset for stop_time in arrivals],
+                            [stop_time + offset for stop_time in departures],
+                            noboarding, nodropoff))
+
+        return trips
+
+
+    def MakeRoutes(self, trips):
+        '''Group the trips into routes of trips that visit the same stops and
+        don't overtake each other, and lay out their times in flat arrays.'''
+
+        # Trips are only in the same route if passengers can board and get off
+        # at the same stops, so the earliest trip is always the best one.
+        # {(tuple of stop indexes, no boarding flags, no drop-off flags): [trip, ...]}
+        patterns = {}
+        for trip in trips:
+            if len(trip[0]) > 1:
+                patterns.setdefault((trip[0], tuple(trip[3]), tuple(trip[4])), []).append(trip)
+
+        routes = [] # [(pattern, [trip, ...])]
+        for pattern in sorted(patterns):
+            # Trips that pass another trip of the pattern go in a separate route,
+            # because RAPTOR assumes a later trip never arrives earlier.
+            patterntrips = sorted(patterns[pattern], key=lambda trip: trip[2])
+            patternroutes = []
+            for trip in patterntrips:
+                for routetrips in patternroutes:
+                    lasttrip = routetrips[-1]
+                    if all([a <= b for a, b in zip(lasttrip[1], trip[1])]) and \
+                       all([a <= b for a, b in zip(lasttrip[2], trip[2])]):
+                        routetrips.append(trip)
+                        break
+                else:
+                    patternroutes.append([trip])
+            routes += [(pattern, routetrips) for routetrips in patternroutes]
+
+        numroutes = len(routes)
+        self.route_numtrips = np.array([len(routetrips) for pattern, routetrips in routes], dtype=np.int32)
+        self.route_coloffsets = np.zeros(numroutes + 1, dtype=np.int64)
+        np.cumsum([len(pattern[0]) for pattern, routetrips in routes], out=self.route_coloffsets[1:])
+        numcols = int(self.route_coloffsets[-1])
+        self.col_routes = np.repeat(np.arange(numroutes, dtype=np.int32),
+                                    np.diff(self.route_coloffsets))
+        self.col_stops = np.zeros(numcols, dtype=np.int32)
+        self.col_eventoffsets = np.zeros(numcols + 1, dtype=np.int64)
+        np.cumsum(self.route_numtrips[self.col_routes], out=self.col_eventoffsets[1:])
+        numevents = int(self.col_eventoffsets[-1])
+        self.departures = np.zeros(numevents, dtype=np.int32)
+        self.arrivals = np.zeros(numevents, dtype=np.int32)
+        self.col_canboard = np.zeros(numcols, dtype=bool)
+        self.col_canalight = np.zeros(numcols, dtype=bool)
+        for route, ((stops, noboarding, nodropoff), routetrips) in enumerate(routes):
+            firstcol = self.route_coloffsets[route]
+            self.col_stops[firstcol:firstcol + len(stops)] = stops
+            self.col_canboard[firstcol:firstcol + len(stops)] = np.logical_not(noboarding)
+            self.col_canalight[firstcol:firstcol + len(stops)] = np.logical_not(nodropoff)
+            # The times are stored column by column: all the trips' times at
+            # the route's first stop, then at its second stop, and so on.
+            first = self.col_eventoffsets[firstcol]
+            last = self.col_eventoffsets[firstcol + len(stops)]
+            self.arrivals[first:last] = np.array([trip[1] for trip in routetrips]).T.ravel()
+            self.departures[first:last] = np.array([trip[2] for trip in routetrips]).T.ravel()
+
+        # The departures are sorted within each column, so adding a multiple of
+        # the column number makes them sorted overall, and the earliest trip
+        # leaving a column after a time can be found for all the columns at
+        # once with searchsorted.
+        col_events = np.repeat(np.arange(numcols, dtype=np.int64), np.diff(self.col_eventoffsets))
+        self.departurekeys = col_events * ColumnKeyStep + self.departures - MinTime
+
+        # Offsets that make each route's trip numbers smaller than all the
+        # earlier routes', so a running minimum over all the columns never
+        # carries a trip from one route into the next.
+        self.maxtrips = int(self.route_numtrips.max()) if numroutes else 0
+        self.col_routekeys = (numroutes - 1 - self.col_routes).astype(np.int64) * (self.maxtrips + 1)
+        self.col_isfirst = np.zeros(numcols, dtype=bool)
+        self.col_isfirst[self.route_coloffsets[:-1]] = True
+
+        messages.AddMessage("Made %i routes with %i trips visiting %i stops." %
+                            (numroutes, len(trips), len(set(self.col_stops.tolist()))))
+
+
+    def MakeTransfers(self, stoplats, stoplons, MaxWalkDistance, WalkSpeed):
+        '''Make the walking transfers between the stops up to MaxWalkDistance
+        meters apart.'''
+
+        self.transfer_from = np.zeros(0, dtype=np.int32)
+        self.transfer_to = np.zeros(0, dtype=np.int32)
+        self.transfer_secs = np.zeros(0, dtype=np.int64)
+        if MaxWalkDistance <= 0 or not self.stopids:
+            return
+
+        nearby = FindStopsWithinDistance(self.stopids, stoplats, stoplons,
+                            self.stopids, stoplats, stoplons, MaxWalkDistance)
+        fromidxs = np.repeat(np.arange(len(self.stopids), dtype=np.int32), np.diff(nearby.offsets))
+        toidxs = nearby.stopidxs
+        keep = fromidxs != toidxs
+        fromidxs = fromidxs[keep]
+        toidxs = toidxs[keep]
+
+        lats = np.radians(np.asarray(stoplats, dtype=float))
+        lons = np.radians(np.asarray(stoplons, dtype=float))
+        hav = np.sin((lats[toidxs] - lats[fromidxs]) / 2) ** 2 + np.cos(lats[fromidxs]) * \
+                np.cos(lats[toidxs]) * np.sin((lons[toidxs] - lons[fromidxs]) / 2) ** 2
+        distances = 2 * EarthRadius * np.arcsin(np.sqrt(np.minimum(hav, 1)))
+        self.transfer_from = fromidxs
+        self.transfer_to = toidxs
+        self.transfer_secs = np.ceil(distances / WalkSpeed).astype(np.int64)
+
+
+    def EarliestArrival(self, origins, departure_time, MaxTransfers=DefaultMaxTransfers, TransferTime=0):
+        '''Find the earliest arrival time at every stop leaving from the origins
+        at departure_time (seconds since midnight).  origins is a list of
+        stop_ids, or a dictionary of {stop_id: seconds to get to the stop}.
+        Origins that aren't in the stops table are skipped with a warning.
+        Passengers use at most MaxTransfers + 1 vehicles and need TransferTime
+        seconds to change vehicles at a stop.  Returns arrays of the arrival
+        time at each stop (Unreachable for the stops that can't be reached) and
+        the number of vehicles used to get there (-1 if unreachable).'''
+
+        numstops = len(self.stopids)
+        best = np.full(numstops, Unreachable, dtype=np.int64)
+        if not isinstance(origins, dict):
+            origins = dict((stop_id, 0) for stop_id in origins)
+        for stop_id, accesstime in origins.items():
+            try:
+                stop = self.stopindexdict[stop_id]
+            except KeyError:
+                messages.AddWarning("Origin stop %s isn't in the stops table, so it was skipped." % stop_id)
+                continue
+            best[stop] = min(best[stop], departure_time + int(accesstime))
+        marked = best < Unreachable
+        vehicles = np.where(marked, 0, -1).astype(np.int8)
+        # The stops reached by walking don't need the TransferTime.
+        walked = marked.copy()
+        self.Walk(best, marked, walked, vehicles, 0)
+
+        for numvehicles in range(1, MaxTransfers + 2):
+            if not marked.any() or not len(self.departures):
+                break
+
+            # 1. The earliest trip of each column that can be boarded at a stop
+            # improved in the last round
+            cols = np.flatnonzero(marked[self.col_stops] & self.col_canboard)
+            stops = self.col_stops[cols]
+            boardtimes = best[stops] + np.where(walked[stops], 0, TransferTime)
+            events = np.searchsorted(self.departurekeys, cols * ColumnKeyStep + boardtimes - MinTime)
+            firsttrips = np.full(len(self.col_stops), self.maxtrips, dtype=np.int64)
+            firsttrips[cols] = np.minimum(events - self.col_eventoffsets[cols], self.maxtrips)
+
+            # 2. The earliest trip boarded at or before each column of its route
+            firsttrips = np.minimum.accumulate(firsttrips + self.col_routekeys) - self.col_routekeys
+            # ... and so the trip ridden to each column, boarded at an earlier column
+            ridden = np.empty_like(firsttrips)
+            ridden[1:] = firsttrips[:-1]
+            ridden[self.col_isfirst] = self.maxtrips
+            cols = np.flatnonzero((ridden < self.route_numtrips[self.col_routes]) & self.col_canalight)
+
+            # 3. The arrival times of those trips, where they're an improvement
+            arrivals = self.arrivals[self.col_eventoffsets[cols] + ridden[cols]]
+            stops = self.col_stops[cols]
+            improved = arrivals < best[stops]
+            stops = stops[improved]
+            np.minimum.at(best, stops, arrivals[improved])
+            marked[:] = False
+            marked[stops] = True
+            walked[:] = False
+            vehicles[stops] = numvehicles
+
+            # 4. Walking transfers from the improved stops
+            self.Walk(best, marked, walked, vehicles, numvehicles)
+
+        return best, vehicles
+
+
+    def Walk(self, best, marked, walked, vehicles, numvehicles):
+        '''Relax the walking transfers from the marked stops, updating the
+        arrays in place.'''
+
+        if not len(self.transfer_from):
+            return
+        transfers = np.flatnonzero(marked[self.transfer_from])
+        arrivals = best[self.transfer_from[transfers]] + self.transfer_secs[transfers]
+        stops = self.transfer_to[transfers]
+        improved = arrivals < best[stops]
+        stops = stops[improved]
+        np.minimum.at(best, stops, arrivals[improved])
+        marked[stops] = True
+        walked[stops] = True
+        vehicles[stops] = numvehicles
+
+
+    def MakeArrivalDict(self, arrivals):
+        '''Return a dictionary of {stop_id: arrival time} for the stops that can
+        be reached, from the arrival times returned by EarliestArrival().'''
+        return dict((self.stopids[stop], int(arrivals[stop]))
+                    for stop in np.flatnonzero(arrivals < Unreachable))
@@ -0,0 +1,235 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Result Cache
+## Last updated: 18 October 2026
+############################################################################
+''' This file contains an on-disk cache of the stop_times found in a time window
+by the BetterBusBuffers tools, so repeated runs of identical queries against the
+same GTFS SQL database don't have to be recalculated from scratch.
+
+The cache is a SQLite database.  Each entry holds one
+{stop_id: [[trip_id, stop_time]]} dictionary packed into a compressed binary
+blob, keyed by the content hash of the GTFS SQL database and the parameters of
+the query.  When the total size of the entries and the log of hits, misses,
+and evictions exceeds MaxCacheSize, the least recently used entries are
+evicted.  Only the last MaxLogRows events are kept in the log.
+
+The cache is off unless CacheFile is set, either directly or with the
+BBB_RESULT_CACHE environment variable.  The size limit in MB can be set with
+the BBB_RESULT_CACHE_MAXSIZE environment variable.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import sqlite3, os, sys, time, hashlib, zlib, marshal, array, threading
+
+# Path to the cache database. Caching is turned off if this is empty.
+CacheFile = os.environ.get("BBB_RESULT_CACHE", "")
+
+# Maximum total size of the cached entries and the log, in bytes
+MaxCacheSize = int(os.environ.get("BBB_RESULT_CACHE_MAXSIZE", "500")) * 1024 * 1024
+
+# Number of the most recent hits, misses, and evictions kept in the log
+MaxLogRows = 10000
+
+# Approximate size of a log row apart from its key, in bytes
+LogRowSize = 24
+
+# Hits and misses during this session
+Hits = 0
+Misses = 0
+CounterLock = threading.Lock()
+
+# Bump this if the format of the stored entries changes. The Python version is
+# part of the format because marshal data is version-specific.
+CacheFormat = "1-py%i.%i" % sys.version_info[:2]
+
+# Connections to the cache database. sqlite connections can't be shared between
+# threads, so each thread gets its own.
+local = threading.local()
+
+
+def ConnectToCache():
+    '''Connect to the cache database, creating its tables if needed.'''
+    conn = getattr(local, "conn", None)
+    if conn is None:
+        conn = local.conn = sqlite3.connect(CacheFile, timeout=60)
+        conn.execute('''CREATE TABLE IF NOT EXISTS results
+                    (key TEXT PRIMARY KEY, data BLOB, size INTEGER, last_used REAL);''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS results_index_lastUsed
+                    ON results (last_used);''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS feedhashes
+                    (path TEXT PRIMARY KEY, filesize INTEGER, mtime REAL, hash TEXT);''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS log
+                    (timestamp REAL, key TEXT, event TEXT);''')
+        conn.commit()
+    return conn
+
+
+def GetFeedHash(SQLDbase):
+    '''Return a hash of the contents of the GTFS SQL database.  The hash is
+    stored with the file's size and modification time, so the file is only
+    read again if it has changed.'''
+
+    SQLDbase = os.path.abspath(SQLDbase)
+    filesize = os.path.getsize(SQLDbase)
+    mtime = os.path.getmtime(SQLDbase)
+    cacheconn = ConnectToCache()
+    hashfetch = "SELECT hash FROM feedhashes WHERE path=? AND filesize=? AND mtime=?;"
+    hashrow = cacheconn.execute(hashfetch, (SQLDbase, filesize, mtime)).fetchone()
+    if hashrow:
+        return hashrow[0]
+
+    feedhash = HashFile(SQLDbase)
+    cacheconn.execute("INSERT OR REPLACE INTO feedhashes (path, filesize, mtime, hash) VALUES (?, ?, ?, ?);",
+                      (SQLDbase, filesize, mtime, feedhash))
+    cacheconn.commit()
+    return feedhash
+
+
+def HashFile(path):
+    '''Return the SHA-1 hash of the contents of a file.'''
+    filehash = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            filehash.update(chunk)
+    return filehash.hexdigest()
+
+
+def MakeKey(*parts):
+    '''Make a cache key from the feed hash and the query parameters.'''
+    return "|".join([CacheFormat] + [str(part) for part in parts])
+
+
+def ArrayToBytes(arr):
+    '''Return the raw bytes of an array.array.'''
+    if hasattr(arr, "tobytes"):
+        return arr.tobytes()
+    return arr.tostring()
+
+
+def ArrayFromBytes(typecode, data):
+    '''Make an array.array from raw bytes.'''
+    arr = array.array(typecode)
+    if hasattr(arr, "frombytes"):
+        arr.frombytes(data)
+    else:
+        arr.fromstring(data)
+    return arr
+
+
+def PackStopTimes(stoptimedict):
+    '''Pack a {stop_id: [[trip_id, stop_time]]} dictionary into a compressed
+    binary blob.  The stop_ids and trip_ids are stored once each in string
+    tables, and the stop visits are stored as integer arrays of per-stop visit
+    counts, trip indexes, and stop times.'''
+
+    stopids = []
+    tripids = []
+    tripindexdict = {}
+    counts = array.array('i')
+    tripidxs = array.array('i')
+    stoptimes = array.array('i')
+    for stop in stoptimedict:
+        stopids.append(stop)
+        counts.append(len(stoptimedict[stop]))
+        for trip, stop_time in stoptimedict[stop]:
+            try:
+                tripidx = tripindexdict[trip]
+            except KeyError:
+                tripidx = tripindexdict[trip] = len(tripids)
+                tripids.append(trip)
+            tripidxs.append(tripidx)
+            stoptimes.append(int(stop_time))
+
+    return zlib.compress(marshal.dumps((stopids, tripids, ArrayToBytes(counts),
+                            ArrayToBytes(tripidxs), ArrayToBytes(stoptimes))))
+
+
+def UnpackStopTimes(data):
+    '''Unpack a blob made by PackStopTimes() into a
+    {stop_id: [[trip_id, stop_time]]} dictionary.'''
+
+    stopids, tripids, counts, tripidxs, stoptimes = marshal.loads(zlib.decompress(data))
+    counts = ArrayFromBytes('i', counts)
+    tripidxs = ArrayFromBytes('i', tripidxs)
+    stoptimes = ArrayFromBytes('i', stoptimes)
+
+    stoptimedict = {}
+    pos = 0
+    for stop, count in zip(stopids, counts):
+        stoptimedict[stop] = [[tripids[tripidxs[i]], stoptimes[i]] for i in range(pos, pos + count)]
+        pos += count
+    return stoptimedict
+
+
+def LogEvent(cacheconn, key, event):
+    '''Add a hit, miss, or eviction to the log, and delete the events before
+    the last MaxLogRows.  The caller commits.'''
+    rowid = cacheconn.execute("INSERT INTO log (timestamp, key, event) VALUES (?, ?, ?);",
+                              (time.time(), key, event)).lastrowid
+    cacheconn.execute("DELETE FROM log WHERE rowid<=?;", (rowid - MaxLogRows,))
+
+
+def GetLogSize(cacheconn):
+    '''Return the approximate size of the log, in bytes.'''
+    numrows, keysize = cacheconn.execute("SELECT COUNT(*), SUM(LENGTH(key)) FROM log;").fetchone()
+    return numrows * LogRowSize + (keysize or 0)
+
+
+def LoadStopTimes(key):
+    '''Return the cached {stop_id: [[trip_id, stop_time]]} dictionary for this
+    key, or None if it isn't in the cache.'''
+    global Hits, Misses
+
+    cacheconn = ConnectToCache()
+    row = cacheconn.execute("SELECT data FROM results WHERE key=?;", (key,)).fetchone()
+    if row is None:
+        with CounterLock:
+            Misses += 1
+        LogEvent(cacheconn, key, "miss")
+        cacheconn.commit()
+        return None
+
+    with CounterLock:
+        Hits += 1
+    cacheconn.execute("UPDATE results SET last_used=? WHERE key=?;", (time.time(), key))
+    LogEvent(cacheconn, key, "hit")
+    cacheconn.commit()
+    return UnpackStopTimes(bytes(row[0]))
+
+
+def StoreStopTimes(key, stoptimedict):
+    '''Add a {stop_id: [[trip_id, stop_time]]} dictionary to the cache, and
+    evict the least recently used entries if the cache is too big.'''
+
+    data = PackStopTimes(stoptimedict)
+    cacheconn = ConnectToCache()
+    cacheconn.execute("INSERT OR REPLACE INTO results (key, data, size, last_used) VALUES (?, ?, ?, ?);",
+                      (key, sqlite3.Binary(data), len(data), time.time()))
+
+    # Evict the least recently used entries until the cache fits. The newest
+    # entry is kept even if it's too big by itself.
+    totalsize = cacheconn.execute("SELECT SUM(size) FROM results;").fetchone()[0] + GetLogSize(cacheconn)
+    if totalsize > MaxCacheSize:
+        entries = cacheconn.execute("SELECT key, size FROM results WHERE key<>? ORDER BY last_used;", (key,)).fetchall()
+        for oldkey, size in entries:
+            if totalsize <= MaxCacheSize:
+                break
+            cacheconn.execute("DELETE FROM results WHERE key=?;", (oldkey,))
+            LogEvent(cacheconn, oldkey, "evict")
+            # The eviction's log row takes up some of the space freed.
+            totalsize -= size - len(oldkey) - LogRowSize
+    cacheconn.commit()
@@ -0,0 +1,126 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Service Area Cache
+## Last updated: 18 October 2026
+############################################################################
+''' This file contains an on-disk cache of the service area polygons made
+around transit stops, so the Polygons and Analyze Individual Route tools don't
+have to solve the service areas again for stops that were solved before with
+the same network and service area settings.
+
+The cache is a SQLite database.  Each entry holds one stop's service area
+polygon as WKB, keyed by the solver's settings (network, impedance, buffer
+size, restrictions, and trim settings), the stop_id, and the stop's location.
+Only the stops that aren't in the cache or have moved are sent to the solver.
+
+The solver is anything with the ServiceAreaSolver interface: the ArcGIS tools
+use Network Analyst (see BBB_SharedFunctions), but any other solver can be
+used, such as a stand-in for testing.
+
+The cache is off unless CacheFile is set, either directly or with the
+BBB_SA_CACHE environment variable.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import sqlite3, os, hashlib
+from bbb_core import messages
+
+# Path to the cache database. Caching is turned off if this is empty.
+CacheFile = os.environ.get("BBB_SA_CACHE", "")
+
+# Stops that have moved less than this many decimal degrees are treated as
+# the same location.
+LocationPrecision = 7
+
+
+class ServiceAreaSolver(object):
+    '''Interface for the service area solvers used with the cache.'''
+
+    def GetSettings(self):
+        '''Return a list of the settings that affect the service area polygons,
+        such as the network, impedance attribute, and buffer size.'''
+        raise NotImplementedError
+
+    def Solve(self, stops):
+        '''Solve the service areas around a list of stops given as
+        (stop_id, lat, lon). Returns a dictionary of {stop_id: WKB polygon}.
+        Stops that couldn't be solved can be left out.'''
+        raise NotImplementedError
+
+
+def ConnectToCache():
+    '''Connect to the cache database, creating its tables if needed.'''
+    conn = sqlite3.connect(CacheFile, timeout=60)
+    conn.execute('''CREATE TABLE IF NOT EXISTS serviceareas
+                (settings TEXT, stop_id TEXT, location TEXT, polygon BLOB,
+                PRIMARY KEY (settings, stop_id));''')
+    conn.commit()
+    return conn
+
+
+def MakeSettingsKey(solver):
+    '''Make a cache key for the solver's settings.'''
+    settings = "|".join([str(setting) for setting in solver.GetSettings()])
+    return hashlib.sha1(settings.encode("utf-8")).hexdigest()
+
+
+def MakeLocationKey(lat, lon):
+    '''Make a cache key for a stop's location.'''
+    return "%.*f,%.*f" % (LocationPrecision, lat, LocationPrecision, lon)
+
+
+def GetServiceAreas(stops, solver):
+    '''Return a dictionary of {stop_id: WKB polygon} with the service areas
+    around a list of stops given as (stop_id, lat, lon).  The service areas
+    are taken from the cache where possible, and only the other stops are sent
+    to the solver.  Stops with no service area are left out.'''
+
+    if not CacheFile:
+        return solver.Solve(stops)
+
+    settings = MakeSettingsKey(solver)
+    conn = ConnectToCache()
+    try:
+        cached = {} # {stop_id: (location, polygon)}
+        for stop_id, location, polygon in conn.execute(
+                "SELECT stop_id, location, polygon FROM serviceareas WHERE settings=?;",
+                (settings,)):
+            cached[stop_id] = (location, polygon)
+
+        polygons = {}
+        tosolve = []
+        for stop_id, lat, lon in stops:
+            entry = cached.get(stop_id)
+            if entry is not None and entry[0] == MakeLocationKey(lat, lon):
+                if entry[1] is not None:
+                    polygons[stop_id] = bytes(entry[1])
+            else:
+                tosolve.append((stop_id, lat, lon))
+
+        messages.AddMessage("Found %i of %i stops in the service area cache." % \
+                            (len(stops) - len(tosolve), len(stops)))
+        if not tosolve:
+            return polygons
+
+        solved = solver.Solve(tosolve)
+        # Stops with no service area are stored too, so they aren't solved again.
+        conn.executemany('''INSERT OR REPLACE INTO serviceareas
+                    (settings, stop_id, location, polygon) VALUES (?, ?, ?, ?);''',
+                    [(settings, stop_id, MakeLocationKey(lat, lon),
+                      sqlite3.Binary(solved[stop_id]) if stop_id in solved else None)
+                     for stop_id, lat, lon in tosolve])
+        conn.commit()
+        polygons.update(solved)
+        return polygons
+    finally:
+        conn.close()
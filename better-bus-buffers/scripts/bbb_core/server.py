@@ -0,0 +1,330 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Statistics Server
+## Last updated: 18 October 2026
+############################################################################
+''' A long-running local HTTP service that answers trip count queries for
+stops, so a dashboard can ask for statistics for any time window without
+running a tool that reads the GTFS SQL database again every time.
+
+Usage:
+    python -m bbb_core.server GTFS.sql [--host 127.0.0.1] [--port 8000]
+        [--preload]
+
+Requests:
+    GET /stops/stats?day=Monday&start=07:00&end=09:00&stops=S1,S2
+        [&arrivals=true]
+
+Returns the NumTrips, NumTripsPerHr, and MaxWaitTime for each stop in stops
+and, as "combined", the NumTrips, NumTripsPerHr, NumStopsInRange, and
+MaxWaitTime for the whole set of stops, like a point or polygon served by
+those stops.  Without stops, all the stops are returned.  The end of the time
+window may be as late as 48:00.
+
+    GET /status
+
+Returns the hash of the GTFS SQL database and the days that are loaded.
+
+The first request for a weekday loads that day's stop_times into an index of
+the sorted visits to each stop, covering 48 hours with the trips from the day
+before and after shifted like the tools do.  Later requests just slice the
+visits in their time window out of the index and calculate the statistics
+with RetrieveStatsForSetOfStops(), so they take milliseconds.  With
+--preload, every weekday is loaded at startup.  Requests are handled in
+parallel threads.
+
+If the GTFS SQL database is replaced or changed, its hash is checked when the
+next request comes in, and if it's different the indexes are thrown away and
+loaded again from the new database.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import os, sys, json, bisect, argparse, threading, operator
+from bbb_core import gtfs, stats, messages, resultcache
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+# The stop indexes cover the visits from midnight to this many seconds later.
+IndexEnd = 2 * gtfs.SecsInDay
+
+
+class StopVisitIndex(object):
+    '''The visits to each stop on one weekday, sorted by time, for slicing out
+    the visits in any time window up to IndexEnd.'''
+
+    def __init__(self, SQLDbase, DayOfWeek, DepOrArr):
+        context = gtfs.AnalysisContext(SQLDbase)
+        try:
+            # The trips from the day before and after are shifted to this day's
+            # time of day, so any time window in the index gets the same visits
+            # as CountTripsAtStops() for that time window.
+            stoptimedict = context.CountTripsAtStops(DayOfWeek, 0, IndexEnd, DepOrArr)
+            if not context.frequencies_dict_initialized:
+                # The stop_times came from the result cache.
+                context.MakeFrequenciesDict()
+            frequencytrips = context.frequencies_dict
+        finally:
+            context.close()
+
+        # The visits of trips that use frequencies are only counted if they're
+        # strictly inside the time window, but the ones from stop_times are
+        # counted at the ends of the time window too, so they're kept apart.
+        self.stoptimes = {} # {stop_id: ([stop_time, ...], [trip_id, ...])}
+        self.frequencystoptimes = {} # same, for the visits of frequency trips
+        for stop in stoptimedict:
+            stoptimelist = sorted(stoptimedict[stop], key=operator.itemgetter(1))
+            scheduled = [stoptime for stoptime in stoptimelist if not
+                            stats.IsFrequencyVisit(stoptime[0], frequencytrips)]
+            frequency = [stoptime for stoptime in stoptimelist if
+                            stats.IsFrequencyVisit(stoptime[0], frequencytrips)]
+            self.stoptimes[stop] = ([stoptime[1] for stoptime in scheduled],
+                                    [stoptime[0] for stoptime in scheduled])
+            if frequency:
+                self.frequencystoptimes[stop] = ([stoptime[1] for stoptime in frequency],
+                                                 [stoptime[0] for stoptime in frequency])
+
+    def GetStopTimes(self, stoplist, start_sec, end_sec):
+        '''Return a stoptimedict {stop_id: [[trip_id, stop_time]]} and a
+        dictionary of sorted stop times {stop_id: [stop_time, ...]} for the
+        visits to the stops in stoplist in the time window.'''
+        stoptimedict = {}
+        sortedstoptimes = {}
+        for stop in stoplist:
+            try:
+                stoptimes, trips = self.stoptimes[stop]
+            except KeyError:
+                continue
+            lo = bisect.bisect_left(stoptimes, start_sec)
+            hi = bisect.bisect_right(stoptimes, end_sec)
+            times = stoptimes[lo:hi]
+            visits = [[trip, stoptime] for trip, stoptime in zip(trips[lo:hi], times)]
+            if stop in self.frequencystoptimes:
+                stoptimes, trips = self.frequencystoptimes[stop]
+                lo = bisect.bisect_right(stoptimes, start_sec)
+                hi = bisect.bisect_left(stoptimes, end_sec)
+                visits += [[trip, stoptime] for trip, stoptime in zip(trips[lo:hi], stoptimes[lo:hi])]
+                times = sorted(times + stoptimes[lo:hi])
+            sortedstoptimes[stop] = times
+            stoptimedict[stop] = visits
+        return stoptimedict, sortedstoptimes
+
+
+class StatsService(object):
+    '''The stop visit indexes for a GTFS SQL database, loaded when they're
+    first needed and thrown away when the database changes.'''
+
+    def __init__(self, SQLDbase):
+        self.SQLDbase = SQLDbase
+        self.lock = threading.Lock()
+        self.indexes = {} # {(DayOfWeek, DepOrArr): StopVisitIndex}
+        self.signature = None
+        self.feedhash = None
+        self.allstops = []
+        self.CheckForReload()
+
+    def CheckForReload(self):
+        '''Throw away the indexes if the GTFS SQL database has changed. The
+        database is only hashed again if its size or modification time has
+        changed.'''
+        filestat = os.stat(self.SQLDbase)
+        signature = (filestat.st_size, filestat.st_mtime)
+        if signature == self.signature:
+            return
+        with self.lock:
+            if signature == self.signature:
+                return
+            feedhash = resultcache.HashFile(self.SQLDbase)
+            if feedhash != self.feedhash:
+                if self.feedhash:
+                    messages.AddMessage("%s has changed. Reloading." % self.SQLDbase)
+                context = gtfs.AnalysisContext(self.SQLDbase)
+                try:
+                    allstops = context.GetStopLocations()[0]
+                finally:
+                    context.close()
+                self.indexes = {}
+                self.allstops = allstops
+                self.feedhash = feedhash
+            self.signature = signature
+
+    def GetIndex(self, DayOfWeek, DepOrArr):
+        '''Return the StopVisitIndex for a weekday, loading it if needed.'''
+        key = (DayOfWeek, DepOrArr)
+        index = self.indexes.get(key)
+        if index is None:
+            with self.lock:
+                index = self.indexes.get(key)
+                if index is None:
+                    messages.AddMessage("Loading the %s for %s..." % (DepOrArr, DayOfWeek))
+                    index = self.indexes[key] = StopVisitIndex(self.SQLDbase, DayOfWeek, DepOrArr)
+        return index
+
+    def GetStats(self, DayOfWeek, start_sec, end_sec, DepOrArr, stoplist=None):
+        '''Return a dictionary of the statistics for each stop in stoplist (or
+        all the stops) and for the whole set of stops in the time window.'''
+        self.CheckForReload()
+        if stoplist is None:
+            stoplist = self.allstops
+        index = self.GetIndex(DayOfWeek, DepOrArr)
+        stoptimedict, sortedstoptimes = index.GetStopTimes(stoplist, start_sec, end_sec)
+
+        stopstats = {}
+        for stop in stoplist:
+            NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
+                        stats.RetrieveStatsForSetOfStops([stop], stoptimedict,
+                            "true", start_sec, end_sec, None, sortedstoptimes)
+            stopstats[stop] = {"NumTrips": NumTrips, "NumTripsPerHr": NumTripsPerHr,
+                               "MaxWaitTime": MaxWaitTime}
+        NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime = \
+                    stats.RetrieveStatsForSetOfStops(stoplist, stoptimedict,
+                        "true", start_sec, end_sec, None, sortedstoptimes)
+
+        return {"day": DayOfWeek, "start": start_sec, "end": end_sec,
+                "stops": stopstats,
+                "combined": {"NumTrips": NumTrips, "NumTripsPerHr": NumTripsPerHr,
+                             "NumStopsInRange": NumStopsInRange,
+                             "MaxWaitTime": MaxWaitTime}}
+
+    def GetStatus(self):
+        '''Return a dictionary of the database hash and the loaded indexes.'''
+        return {"database": self.SQLDbase, "hash": self.feedhash,
+                "loaded": sorted(["%s %s" % key for key in self.indexes])}
+
+
+class RequestError(Exception):
+    '''An error in the parameters of a request.'''
+    pass
+
+
+def ParseStatsRequest(query):
+    '''Read the parameters of a /stops/stats request from its parsed query
+    string. Returns (DayOfWeek, start_sec, end_sec, DepOrArr, stoplist).'''
+
+    def GetParameter(name, default=None):
+        values = query.get(name)
+        if not values or not values[0]:
+            if default is None:
+                raise RequestError("Missing parameter: %s" % name)
+            return default
+        return values[0]
+
+    DayOfWeek = GetParameter("day").capitalize()
+    if DayOfWeek not in gtfs.days:
+        raise RequestError("day must be one of %s." % ", ".join(gtfs.days))
+    try:
+        start_sec = gtfs.parse_time(GetParameter("start") + ":00")
+        end_sec = gtfs.parse_time(GetParameter("end") + ":00")
+    except ValueError:
+        raise RequestError("Times must be in HH:MM format.")
+    if end_sec <= start_sec:
+        raise RequestError("The time window ends before or at the same time it starts.")
+    if start_sec < 0 or end_sec > IndexEnd:
+        raise RequestError("The time window must be between 00:00 and 48:00.")
+    DepOrArr = "departure_time"
+    if GetParameter("arrivals", "false").lower() in ("true", "1"):
+        DepOrArr = "arrival_time"
+    stoplist = None
+    if GetParameter("stops", ""):
+        stoplist = GetParameter("stops").split(",")
+
+    return DayOfWeek, start_sec, end_sec, DepOrArr, stoplist
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    '''Answers the requests with JSON from the server's StatsService.'''
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            if url.path == "/stops/stats":
+                result = self.server.service.GetStats(*ParseStatsRequest(parse_qs(url.query)))
+            elif url.path == "/status":
+                result = self.server.service.GetStatus()
+            else:
+                self.SendJSON(404, {"error": "Not found: %s" % url.path})
+                return
+        except RequestError as err:
+            self.SendJSON(400, {"error": str(err)})
+            return
+        except Exception as err:
+            messages.AddError("Error answering %s: %s" % (self.path, err))
+            self.SendJSON(500, {"error": str(err)})
+            return
+        self.SendJSON(200, result)
+
+    def SendJSON(self, status, result):
+        '''Send a JSON response.'''
+        body = json.dumps(result).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't log every request. The dashboard sends many of them.
+        pass
+
+
+class StatsServer(ThreadingMixIn, HTTPServer):
+    '''HTTP server that handles each request in its own thread.'''
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        HTTPServer.__init__(self, address, StatsRequestHandler)
+        self.service = service
+
+
+def main(argv=None):
+    '''Run the server until it's interrupted. Returns the exit code.'''
+
+    parser = argparse.ArgumentParser(prog="python -m bbb_core.server",
+                description="Answer trip count queries for stops over HTTP, \
+using a GTFS SQL database made by the BetterBusBuffers Preprocess GTFS tool.")
+    parser.add_argument("SQLDbase", help="GTFS SQL database")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on (default: 8000)")
+    parser.add_argument("--preload", action="store_true",
+                help="load the departures for every weekday at startup")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.SQLDbase):
+        parser.error("The GTFS SQL database %s does not exist." % args.SQLDbase)
+
+    service = StatsService(args.SQLDbase)
+    if args.preload:
+        for DayOfWeek in gtfs.days:
+            service.GetIndex(DayOfWeek, "departure_time")
+
+    server = StatsServer((args.host, args.port), service)
+    messages.AddMessage("Serving statistics for %s at http://%s:%i/" %
+                        (args.SQLDbase, args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
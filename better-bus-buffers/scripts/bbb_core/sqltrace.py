@@ -0,0 +1,218 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - SQL Tracing
+## Last updated: 18 October 2026
+############################################################################
+''' This file traces the SQL statements run on a GTFS SQL database, to find
+the queries that are run many times or are slow because of a missing index.
+
+Connections made with connect() are traced if trace=True or the
+GTFS_SQL_TRACE environment variable is set.  Each statement is normalized into
+a template, with its literal values and parameters replaced by ? and lists of
+values collapsed to (...), and the number of calls, total and max time
+(including fetching the rows), and number of rows returned are added up for
+each template.  The first time a statement takes longer than SlowTime seconds,
+its EXPLAIN QUERY PLAN is saved.  FormatReport() shows the results.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import sqlite3, os, re, time, threading
+
+# Trace the connections made with connect() by default
+Enabled = bool(os.environ.get("GTFS_SQL_TRACE"))
+
+# Statements that take longer than this many seconds get their query plan saved.
+SlowTime = 0.1
+
+# {template: [calls, total time, max time, rows]}
+Statements = {}
+# {template: (time, sql, [query plan lines])} for the slow statements
+Plans = {}
+lock = threading.Lock()
+
+if hasattr(time, "perf_counter"):
+    timer = time.perf_counter
+else:
+    timer = time.time
+
+
+def MakeTemplate(sql):
+    '''Normalize a SQL statement into a template by replacing its literal
+    values with ? and collapsing lists of values to (...).'''
+    template = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    template = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?\b", "?", template)
+    template = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(...)", template)
+    return " ".join(template.split())
+
+
+def Reset():
+    '''Forget the statements traced so far.'''
+    with lock:
+        Statements.clear()
+        Plans.clear()
+
+
+class TracingCursor(sqlite3.Cursor):
+    '''sqlite3 cursor that adds up the time and rows of its statements.'''
+
+    def __init__(self, *args, **kwargs):
+        sqlite3.Cursor.__init__(self, *args, **kwargs)
+        self.trace_template = None
+        self.trace_sql = None
+        self.trace_parameters = None
+        self.trace_time = 0
+
+    def Begin(self, sql, parameters):
+        '''Start tracing a new statement.'''
+        self.trace_template = MakeTemplate(sql)
+        self.trace_sql = sql
+        self.trace_parameters = parameters
+        self.trace_time = 0
+        with lock:
+            Statements.setdefault(self.trace_template, [0, 0, 0, 0])[0] += 1
+
+    def Add(self, elapsed, rows):
+        '''Add the time and rows of a call to the current statement.'''
+        if self.trace_template is None:
+            return
+        self.trace_time += elapsed
+        with lock:
+            stats = Statements[self.trace_template]
+            stats[1] += elapsed
+            stats[2] = max(stats[2], self.trace_time)
+            stats[3] += rows
+            explain = self.trace_time > SlowTime and self.trace_template not in Plans
+            if explain:
+                Plans[self.trace_template] = None
+        if explain:
+            Plans[self.trace_template] = (self.trace_time, self.trace_sql, self.Explain())
+
+    def Explain(self):
+        '''Return the lines of the query plan of the current statement.'''
+        if self.trace_parameters is None:
+            return ["(statement run with executemany)"]
+        try:
+            # Use a plain cursor so the EXPLAIN itself isn't traced.
+            plan = sqlite3.Cursor(self.connection).execute(
+                        "EXPLAIN QUERY PLAN " + self.trace_sql,
+                        self.trace_parameters).fetchall()
+        except sqlite3.Error as err:
+            return ["(no query plan: %s)" % err]
+        return [str(row[-1]) for row in plan]
+
+    def execute(self, sql, parameters=()):
+        self.Begin(sql, parameters)
+        start = timer()
+        try:
+            return sqlite3.Cursor.execute(self, sql, parameters)
+        finally:
+            self.Add(timer() - start, 0)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.Begin(sql, None)
+        start = timer()
+        try:
+            return sqlite3.Cursor.executemany(self, sql, seq_of_parameters)
+        finally:
+            self.Add(timer() - start, 0)
+
+    def fetchone(self):
+        start = timer()
+        row = sqlite3.Cursor.fetchone(self)
+        self.Add(timer() - start, row is not None)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = timer()
+        rows = sqlite3.Cursor.fetchmany(self, *args, **kwargs)
+        self.Add(timer() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = timer()
+        rows = sqlite3.Cursor.fetchall(self)
+        self.Add(timer() - start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = timer()
+        try:
+            row = sqlite3.Cursor.__next__(self)
+        except StopIteration:
+            self.Add(timer() - start, 0)
+            raise
+        self.Add(timer() - start, 1)
+        return row
+
+    def next(self):
+        start = timer()
+        try:
+            row = sqlite3.Cursor.next(self)
+        except StopIteration:
+            self.Add(timer() - start, 0)
+            raise
+        self.Add(timer() - start, 1)
+        return row
+
+
+class TracingConnection(sqlite3.Connection):
+    '''sqlite3 connection whose cursors are TracingCursors.'''
+
+    def cursor(self, factory=TracingCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(dbname, trace=None, **kwargs):
+    '''Connect to a SQLite database like sqlite3.connect(), tracing the
+    connection's statements if trace is True, or by default if Enabled.'''
+    if trace is None:
+        trace = Enabled
+    if trace:
+        kwargs["factory"] = TracingConnection
+    return sqlite3.connect(dbname, **kwargs)
+
+
+def FormatReport(limit=25):
+    '''Return a report of the limit statements that took the most total time
+    and the query plans of the slow statements, or "" if nothing was traced.'''
+
+    with lock:
+        statements = sorted(Statements.items(), key=lambda item: -item[1][1])
+        plans = sorted([item for item in Plans.items() if item[1] is not None],
+                       key=lambda item: -item[1][0])
+    if not statements:
+        return ""
+
+    lines = ["SQL statements (%i templates, %i calls, %.2f s):" % (len(statements),
+                sum([stats[0] for template, stats in statements]),
+                sum([stats[1] for template, stats in statements])),
+             "%8s %10s %10s %10s  %s" % ("Calls", "Total (s)", "Max (s)", "Rows", "Statement")]
+    for template, stats in statements[:limit]:
+        lines.append("%8i %10.3f %10.3f %10i  %s" % (stats[0], stats[1],
+                        stats[2], stats[3], template[:200]))
+    if len(statements) > limit:
+        lines.append("(%i more statements)" % (len(statements) - limit))
+
+    if plans:
+        lines.append("Statements slower than %g s and their query plans:" % SlowTime)
+        for template, (elapsed, sql, plan) in plans:
+            lines.append("%.3f s: %s" % (elapsed, template[:200]))
+            for step in plan:
+                lines.append("    " + step)
+    return "\n".join(lines)
@@ -0,0 +1,524 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Statistics
+## Last updated: 18 October 2026
+############################################################################
+''' This file contains the functions that calculate the number of trips,
+trips per hour, and max wait time for sets of stops from the stop_times found by
+bbb_core.gtfs.  It doesn't use arcpy.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import os, re, operator, heapq, math, bisect, multiprocessing
+from bbb_core import messages
+
+# Number of processes to calculate the statistics for sets of stops with. Set
+# it directly or with the BBB_PROCESSES environment variable.
+NumProcesses = int(os.environ.get("BBB_PROCESSES", "1"))
+
+# Don't start a process pool for fewer sets of stops than this.
+MinStopSetsForPool = 1000
+
+# Set in the parent process before the pool is started, so the workers get them
+# from the forked memory instead of having them pickled for every task:
+# (stopsets, function, args)
+PoolData = None
+
+# The names GetStopTimesForStopsInTimeWindow() gives the visits of the trips
+# that use the frequencies table
+FrequencyVisitName = re.compile(r"^(.*)_(?:today|yesterday|tomorrow)\d+$")
+
+
+def MakeStopTripBitsets(stoptimedict):
+    '''Map each trip instance in the stoptimedict {stop_id: [[trip_id, stop_time]]}
+    to a dense integer and return a dictionary of {stop_id: tripbits}, where
+    tripbits is a bitset (stored as a Python integer) with bit i set if trip
+    instance i visits the stop during the time window.  The number of unique
+    trips serving a set of stops is then just the number of bits set in the OR
+    of the stops' bitsets.'''
+
+    tripindexdict = {} # {trip_id: dense integer index}
+    stoptripbits = {} # {stop_id: tripbits}
+    for stop in stoptimedict:
+        tripbits = 0
+        for stoptime in stoptimedict[stop]:
+            trip = stoptime[0]
+            try:
+                tripidx = tripindexdict[trip]
+            except KeyError:
+                tripidx = tripindexdict[trip] = len(tripindexdict)
+            tripbits |= 1 << tripidx
+        stoptripbits[stop] = tripbits
+
+    return stoptripbits
+
+
+def CountBits(bits):
+    '''Return the number of bits set in a Python integer bitset.'''
+    return bin(bits).count("1")
+
+
+def MakeSortedStopTimes(stoptimedict):
+    '''Return a dictionary of {stop_id: [stop_time, stop_time, ...]} from the
+    stoptimedict {stop_id: [[trip_id, stop_time]]}, with each stop's times
+    sorted once so that the times for a set of stops can be merged instead of
+    sorted from scratch for every output feature.'''
+
+    sortedstoptimes = {}
+    for stop in stoptimedict:
+        stoptimelist = [stoptime[1] for stoptime in stoptimedict[stop]]
+        stoptimelist.sort()
+        sortedstoptimes[stop] = stoptimelist
+
+    return sortedstoptimes
+
+
+def MergeStopTimes(stoplist, sortedstoptimes):
+    '''Merge the presorted stop times {stop_id: [stop_time, ...]} of a set of
+    stops into a single sorted list of stop times.'''
+
+    stoptimelists = []
+    for stop in stoplist:
+        try:
+            stoptimelists.append(sortedstoptimes[stop])
+        except KeyError:
+            pass
+    if len(stoptimelists) == 1:
+        return stoptimelists[0]
+    return list(heapq.merge(*stoptimelists))
+
+
+def RetrieveStatsForSetOfStops(stoplist, stoptimedict, CalcWaitTime, start_sec, end_sec, stoptripbits=None, sortedstoptimes=None):
+    '''For a set of stops, query the stoptimedict {stop_id: [[trip_id, stop_time]]}
+    and return the NumTrips, NumTripsPerHr, NumStopsInRange, and MaxWaitTime for
+    that set of stops.  If stoptripbits {stop_id: tripbits} from
+    MakeStopTripBitsets() is given, the unique trips are found by OR-ing the
+    stops' trip bitsets instead of by building a set of trip_ids.  If
+    sortedstoptimes {stop_id: [stop_time, ...]} from MakeSortedStopTimes() is
+    given, the MaxWaitTime is calculated by merging the stops' presorted times.'''
+
+    # Number of stops (in range of the given point or polygon being studied)
+    NumStopsInRange = len(stoplist)
+
+    if stoptripbits is not None:
+        # Find the number of unique trips from the union of the stops' trip bitsets
+        tripbits = 0
+        for stop in stoplist:
+            try:
+                tripbits |= stoptripbits[stop]
+            except KeyError:
+                pass
+        NumTrips = CountBits(tripbits)
+
+    else:
+        # Find the list of unique trips
+        triplist = []
+        for stop in stoplist:
+            try:
+                stoptimelist = stoptimedict[stop]
+                for stoptime in stoptimelist:
+                    triplist.append(stoptime[0])
+            except KeyError:
+                pass
+        triplist = list(set(triplist))
+        NumTrips = len(triplist)
+    NumTripsPerHr = round(float(NumTrips) / ((end_sec - start_sec) / 3600), 2)
+
+    MaxWaitTime = None
+    if CalcWaitTime == "true":
+        if sortedstoptimes is not None:
+            StopTimesAtThisPoint = MergeStopTimes(stoplist, sortedstoptimes)
+            MaxWaitTime = CalculateHeadwayStats(StopTimesAtThisPoint, start_sec, end_sec)[0]
+        else:
+            StopTimesAtThisPoint = []
+            for stop in stoplist:
+                try:
+                    stoptimelist = stoptimedict[stop]
+                    for stoptime in stoptimelist:
+                        StopTimesAtThisPoint.append(stoptime[1])
+                except KeyError:
+                    pass
+            MaxWaitTime = CalculateMaxWaitTime(StopTimesAtThisPoint, start_sec, end_sec)
+
+    return NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime
+
+
+def InternStopSets(featurestopsdict):
+    '''Canonicalize the set of stops for each feature in {feature_id: [stop_id, ...]}
+    to a sorted tuple and intern it to an integer id. Returns a dictionary of
+    {feature_id: stopset_id} and a list of the unique stop sets, indexed by
+    stopset_id.  featurestopsdict can also be a FeatureStopsCSR or an
+    InternedFeatureStops.'''
+
+    if hasattr(featurestopsdict, "InternStopSets"):
+        return featurestopsdict.InternStopSets()
+
+    stopsetiddict = {} # {sorted tuple of stop_ids: stopset_id}
+    stopsets = []
+    featurestopsetdict = {}
+    for feature in featurestopsdict:
+        stopset = tuple(sorted(featurestopsdict[feature]))
+        try:
+            stopset_id = stopsetiddict[stopset]
+        except KeyError:
+            stopset_id = stopsetiddict[stopset] = len(stopsets)
+            stopsets.append(stopset)
+        featurestopsetdict[feature] = stopset_id
+
+    return featurestopsetdict, stopsets
+
+
+def RetrieveStatsForSetsOfStops(featurestopsdict, stoptimedict, CalcWaitTime, start_sec, end_sec, stoptripbits=None, sortedstoptimes=None, HeadwayStats=False):
+    '''For each feature in {feature_id: [stop_id, ...]}, return a dictionary of
+    {feature_id: (NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime)}.
+    Features served by an identical set of stops share one calculation.
+
+    If HeadwayStats is True, the tuples also have the MedianHeadway,
+    Headway90, HeadwayCV, and ExpectedWait from bbb_core.headways, calculated
+    from the same merge of the stops' sorted times as the MaxWaitTime.  This
+    needs numpy.'''
+
+    featurestopsetdict, stopsets = InternStopSets(featurestopsdict)
+
+    # Calculate the statistics once for each unique set of stops
+    if HeadwayStats:
+        # numpy is only needed for the headway statistics
+        from bbb_core import headways
+        if sortedstoptimes is None:
+            sortedstoptimes = MakeSortedStopTimes(stoptimedict)
+        # The max wait time is calculated with the rest of the headway
+        # statistics, for all the sets of stops at once.
+        stopsetstats = CalculateStatsForStopSets(stopsets, RetrieveStatsForSetOfStops,
+                        (stoptimedict, "false", start_sec, end_sec, stoptripbits))
+        stopsetheadways = headways.CalculateHeadwayDistributionForStopSets(
+                        stopsets, sortedstoptimes, start_sec, end_sec)
+        for idx, headwaystats in enumerate(stopsetheadways):
+            MaxWaitTime = None
+            if CalcWaitTime == "true":
+                MaxWaitTime = headwaystats[0]
+            stopsetstats[idx] = stopsetstats[idx][:3] + (MaxWaitTime,) + headwaystats[1:]
+    else:
+        stopsetstats = CalculateStatsForStopSets(stopsets, RetrieveStatsForSetOfStops,
+                        (stoptimedict, CalcWaitTime, start_sec, end_sec,
+                         stoptripbits, sortedstoptimes))
+
+    ReportStopSetCacheStats(len(featurestopsetdict), len(stopsets))
+
+    # Fan the statistics back out to the features
+    featurestatsdict = {}
+    for feature in featurestopsetdict:
+        featurestatsdict[feature] = stopsetstats[featurestopsetdict[feature]]
+
+    return featurestatsdict
+
+
+def CalculateStatsForStopSets(stopsets, function, args):
+    '''Return [function(stopset, *args) for stopset in stopsets].  If
+    NumProcesses is more than 1, the stop sets are split into chunks that are
+    calculated in a pool of processes.  The pool is only used where processes
+    are forked, so the workers share the parent's copy of the stop data.'''
+
+    global PoolData
+    if NumProcesses <= 1 or len(stopsets) < MinStopSetsForPool or not hasattr(os, "fork"):
+        return [function(stopset, *args) for stopset in stopsets]
+
+    # Several chunks per process so the work evens out if some chunks are slower.
+    chunksize = int(math.ceil(float(len(stopsets)) / (NumProcesses * 4)))
+    chunks = [(chunkstart, min(chunkstart + chunksize, len(stopsets)))
+                for chunkstart in range(0, len(stopsets), chunksize)]
+    PoolData = (stopsets, function, args)
+    if hasattr(multiprocessing, "get_context"):
+        pool = multiprocessing.get_context("fork").Pool(NumProcesses)
+    else:
+        pool = multiprocessing.Pool(NumProcesses)
+    try:
+        chunkstats = pool.map(CalculateStatsForStopSetsChunk, chunks)
+    finally:
+        pool.terminate()
+        PoolData = None
+
+    stopsetstats = []
+    for stats in chunkstats:
+        stopsetstats += stats
+    return stopsetstats
+
+
+def CalculateStatsForStopSetsChunk(chunk):
+    '''Calculate the statistics for the stop sets from chunk[0] to chunk[1] in
+    a pool worker process.'''
+    stopsets, function, args = PoolData
+    return [function(stopsets[idx], *args) for idx in range(chunk[0], chunk[1])]
+
+
+def ReportStopSetCacheStats(NumFeatures, NumStopSets):
+    '''Report how many unique sets of stops were calculated for the features.'''
+    if NumFeatures:
+        HitRate = 100 * float(NumFeatures - NumStopSets) / NumFeatures
+        messages.AddMessage("Calculated statistics for %i unique sets of stops \
+serving %i features (%.1f%% cache hit rate)." % (NumStopSets, NumFeatures, HitRate))
+
+
+def RetrieveStatsForSetsOfStopsForDays(featurestopsdict, daystoptimedict, DaysOfWeek, CalcWaitTime, start_sec, end_sec):
+    '''For each feature in {feature_id: [stop_id, ...]}, return a dictionary of
+    {feature_id: [(NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime), ...]}
+    with one entry for each weekday in DaysOfWeek, using the daystoptimedict
+    {DayOfWeek: stoptimedict} from CountTripsAtStopsForDays(). Days that share
+    a stoptimedict share one calculation.'''
+
+    statsdict = {} # {id(stoptimedict): featurestatsdict}
+    dayfeaturestats = []
+    for DayOfWeek in DaysOfWeek:
+        stoptimedict = daystoptimedict[DayOfWeek]
+        if id(stoptimedict) not in statsdict:
+            stoptripbits = MakeStopTripBitsets(stoptimedict)
+            sortedstoptimes = None
+            if CalcWaitTime == "true":
+                sortedstoptimes = MakeSortedStopTimes(stoptimedict)
+            statsdict[id(stoptimedict)] = RetrieveStatsForSetsOfStops(
+                                featurestopsdict, stoptimedict, CalcWaitTime,
+                                start_sec, end_sec, stoptripbits, sortedstoptimes)
+        dayfeaturestats.append(statsdict[id(stoptimedict)])
+
+    featurestatsdict = {}
+    for feature in featurestopsdict:
+        featurestatsdict[feature] = [featurestats[feature] for featurestats in dayfeaturestats]
+
+    return featurestatsdict
+
+
+def RetrieveTripStatsForDates(featurestopsdict, datestoptimedict, dates, start_sec, end_sec):
+    '''For each feature in {feature_id: [stop_id, ...]}, return a dictionary of
+    {feature_id: (MeanNumTrips, MinNumTrips, MaxNumTrips)} over the dates, using
+    the datestoptimedict {date: stoptimedict} from CountTripsAtStopsForDates().
+    Dates that share a stoptimedict share one calculation.'''
+
+    datestats = RetrieveStatsForSetsOfStopsForDays(featurestopsdict,
+                        datestoptimedict, dates, "false", start_sec, end_sec)
+
+    featurestatsdict = {}
+    for feature in datestats:
+        NumTripsList = [stats[0] for stats in datestats[feature]]
+        MeanNumTrips = round(float(sum(NumTripsList)) / len(NumTripsList), 2)
+        featurestatsdict[feature] = (MeanNumTrips, min(NumTripsList), max(NumTripsList))
+
+    return featurestatsdict
+
+
+def RetrieveHeadwayStatsForSetOfStops(stoplist, sortedstoptimes, start_sec, end_sec):
+    '''For a set of stops, merge the presorted stop times {stop_id: [stop_time, ...]}
+    and return the MaxWaitTime, MeanHeadway, and Headway90 (90th percentile
+    headway) in minutes for that set of stops, calculated in a single pass.'''
+
+    StopTimesAtThisPoint = MergeStopTimes(stoplist, sortedstoptimes)
+    return CalculateHeadwayStats(StopTimesAtThisPoint, start_sec, end_sec, True)
+
+
+def RoundToMinutes(seconds):
+    '''Round a time in seconds, or a numpy array of them, to whole minutes.
+    Halves are rounded up, like Python 2's round() does for the times, which
+    are never negative, rather than to even like Python 3's round().  Returns
+    a float.'''
+    return (seconds / 60.0 + 0.5) // 1
+
+
+def CalculateMaxWaitTime(stoptimelist, start_sec, end_sec):
+    '''Calculate the max time in minutes between adjacent stop visits. Set value
+    to None if it can't be calculated.'''
+
+    # Sort the list of stoptimes
+    stoptimelist.sort()
+
+    return CalculateHeadwayStats(stoptimelist, start_sec, end_sec)[0]
+
+
+def CalculateHeadwayStats(stoptimelist, start_sec, end_sec, CalcHeadways=False):
+    '''Given a sorted list of stop times, return the max time in minutes between
+    adjacent stop visits and, if CalcHeadways is True, the mean and 90th
+    percentile times in minutes between adjacent stop visits, as
+    (MaxWaitTime, MeanHeadway, Headway90).  Values that can't be calculated
+    are set to None.'''
+
+    maxWaitTime_toReturn = None
+    meanHeadway_toReturn = None
+    headway90_toReturn = None
+
+    # Calculate max time between adjacent stop times.
+    if len(stoptimelist) > 1:
+        # Find the differences between adjacent visits
+        headways = [y - x for (x, y) in zip(stoptimelist[:-1], stoptimelist[1:])]
+        # Find time from time window start to earliest stop visit
+        TimeFromStart = stoptimelist[0] - start_sec
+        # and time from latest stop visit to end of time window
+        TimeToEnd = end_sec - stoptimelist[-1]
+        # and which is largest.
+        MaxEdge = max(TimeFromStart, TimeToEnd)
+        # Find the maximum difference between adjacent visits
+        MaxWaitTime = max(headways)
+        # Compare with distance to edge of time window
+        if (MaxEdge < MaxWaitTime):
+            # Exclude cases where the time to the time window boundaries is
+            # > MaxWaitTime because we can't properly determine MaxWaitTime.
+            maxWaitTime_toReturn = int(RoundToMinutes(MaxWaitTime)) # In minutes
+
+        if CalcHeadways:
+            # The headways sum to the time between the first and last visits.
+            meanHeadway_toReturn = int(RoundToMinutes(float(stoptimelist[-1] - stoptimelist[0]) / len(headways))) # In minutes
+            # Nearest-rank 90th percentile. Only the largest headways need to be
+            # put in order to find it.
+            rank90 = int(math.ceil(0.9 * len(headways)))
+            Headway90 = heapq.nlargest(len(headways) - rank90 + 1, headways)[-1]
+            headway90_toReturn = int(RoundToMinutes(Headway90)) # In minutes
+
+    return maxWaitTime_toReturn, meanHeadway_toReturn, headway90_toReturn
+
+
+def MakeTimeWindows(start_sec, end_sec, step_sec):
+    '''Split the time window from start_sec to end_sec into consecutive time
+    windows step_sec seconds long. The last window is cut off at end_sec.
+    Returns a list of (start_sec, end_sec) tuples.'''
+
+    windows = []
+    window_start = start_sec
+    while window_start < end_sec:
+        window_end = min(window_start + step_sec, end_sec)
+        windows.append((window_start, window_end))
+        window_start = window_end
+
+    return windows
+
+
+def IsFrequencyVisit(trip_id, frequencytrips):
+    '''Return whether a trip_id in a stoptimedict is one of the visits made up
+    from the frequencies table, which are named trip_id_DayStartTime.'''
+    match = FrequencyVisitName.match(trip_id)
+    return bool(match) and match.group(1) in frequencytrips
+
+
+def MakeStopEventsForTimeWindows(stoptimedict, windows, frequencytrips=()):
+    '''Given a stoptimedict {stop_id: [[trip_id, stop_time]]} covering all the
+    time windows in windows [(start_sec, end_sec), ...], return a dictionary of
+    {stop_id: [(tripbits, [stop_time, ...]), ...]} with one entry for each time
+    window holding the trip bitset and the sorted stop times of the stop's
+    visits in that window.  frequencytrips holds the trip_ids that use the
+    frequencies table (like the frequencies dictionary).  As in a separate run
+    for each time window, time window boundaries are inclusive for the visits
+    from stop_times but exclusive for the visits of those trips.'''
+
+    tripindexdict = {} # {trip_id: dense integer index}
+    stopwindowevents = {}
+    for stop in stoptimedict:
+        stoptimelist = sorted(stoptimedict[stop], key=operator.itemgetter(1))
+        # ([stop_time, ...], [tripidx, ...]) for the visits from stop_times
+        # and for the visits of trips that use frequencies
+        scheduled = ([], [])
+        frequency = ([], [])
+        for stoptime in stoptimelist:
+            trip = stoptime[0]
+            try:
+                tripidx = tripindexdict[trip]
+            except KeyError:
+                tripidx = tripindexdict[trip] = len(tripindexdict)
+            visits = frequency if frequencytrips and IsFrequencyVisit(trip, frequencytrips) else scheduled
+            visits[0].append(stoptime[1])
+            visits[1].append(tripidx)
+
+        # Slice out each time window's visits from the sorted stop times.
+        windowevents = []
+        for window_start, window_end in windows:
+            stoptimes, tripidxs = scheduled
+            lo = bisect.bisect_left(stoptimes, window_start)
+            hi = bisect.bisect_right(stoptimes, window_end)
+            times = stoptimes[lo:hi]
+            tripbits = 0
+            for tripidx in tripidxs[lo:hi]:
+                tripbits |= 1 << tripidx
+            stoptimes, tripidxs = frequency
+            if stoptimes:
+                lo = bisect.bisect_right(stoptimes, window_start)
+                hi = bisect.bisect_left(stoptimes, window_end)
+                for tripidx in tripidxs[lo:hi]:
+                    tripbits |= 1 << tripidx
+                times = sorted(times + stoptimes[lo:hi])
+            windowevents.append((tripbits, times))
+        stopwindowevents[stop] = windowevents
+
+    return stopwindowevents
+
+
+def RetrieveStatsForSetOfStopsForTimeWindows(stoplist, stopwindowevents, windows, CalcWaitTime):
+    '''For a set of stops, query the stopwindowevents from
+    MakeStopEventsForTimeWindows() and return a list with the NumTrips,
+    NumTripsPerHr, NumStopsInRange, and MaxWaitTime for that set of stops in
+    each time window.'''
+
+    # Number of stops (in range of the given point or polygon being studied)
+    NumStopsInRange = len(stoplist)
+
+    stopevents = []
+    for stop in stoplist:
+        try:
+            stopevents.append(stopwindowevents[stop])
+        except KeyError:
+            pass
+
+    windowstats = []
+    for idx, (start_sec, end_sec) in enumerate(windows):
+        # Find the number of unique trips from the union of the stops' trip bitsets
+        tripbits = 0
+        for windowevents in stopevents:
+            tripbits |= windowevents[idx][0]
+        NumTrips = CountBits(tripbits)
+        NumTripsPerHr = round(float(NumTrips) / ((end_sec - start_sec) / 3600.0), 2)
+
+        MaxWaitTime = None
+        if CalcWaitTime == "true":
+            StopTimesAtThisPoint = list(heapq.merge(*[windowevents[idx][1] for windowevents in stopevents]))
+            MaxWaitTime = CalculateHeadwayStats(StopTimesAtThisPoint, start_sec, end_sec)[0]
+
+        windowstats.append((NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime))
+
+    return windowstats
+
+
+def RetrieveStatsForSetsOfStopsForTimeWindows(featurestopsdict, stopwindowevents, windows, CalcWaitTime):
+    '''For each feature in {feature_id: [stop_id, ...]}, return a dictionary of
+    {feature_id: [(NumTrips, NumTripsPerHr, NumStopsInRange, MaxWaitTime), ...]}
+    with one entry for each time window. Features served by an identical set of
+    stops share one calculation.'''
+
+    featurestopsetdict, stopsets = InternStopSets(featurestopsdict)
+
+    # Calculate the statistics once for each unique set of stops
+    stopsetstats = CalculateStatsForStopSets(stopsets,
+                        RetrieveStatsForSetOfStopsForTimeWindows,
+                        (stopwindowevents, windows, CalcWaitTime))
+
+    ReportStopSetCacheStats(len(featurestopsetdict), len(stopsets))
+
+    # Fan the statistics back out to the features
+    featurestatsdict = {}
+    for feature in featurestopsetdict:
+        featurestatsdict[feature] = stopsetstats[featurestopsetdict[feature]]
+
+    return featurestatsdict
+
+
+def MakeTimeWindowFieldSuffix(start_sec, end_sec, isShapefile):
+    '''Make the suffix for the names of the output fields for a time window,
+    such as "_0700_0800". Shapefile field names are limited to 10 characters,
+    so only the start time is used for shapefiles, such as "_0700".'''
+    start_time_pretty = "%02d%02d" % (int(start_sec) // 3600, int(start_sec) % 3600 // 60)
+    end_time_pretty = "%02d%02d" % (int(end_sec) // 3600, int(end_sec) % 3600 // 60)
+    if isShapefile:
+        return "_" + start_time_pretty
+    return "_" + start_time_pretty + "_" + end_time_pretty
@@ -0,0 +1,88 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Stop Groups
+## Last updated: 18 October 2026
+############################################################################
+''' This file groups stops that are in the same place, so the network
+analyses only have to solve one location for each group.  Large stations can
+have dozens of stops (platforms, entrances, and the station itself) within a
+few meters of each other, and they all reach practically the same area.
+
+Stops are grouped by their parent_station, following the parents up to the
+top-level station.  Stops without a parent_station (or children) can also be
+grouped by a grid with cells of a given size in meters.  Each group is
+represented by the station stop if it has one, or otherwise by the member
+closest to the middle of the group.  The stops reached from a representative
+stop are expanded back to all the stops in its group.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import math
+
+# Approximate length of a degree of latitude in meters
+MetersPerDegree = 111320.0
+
+
+def FindRootStation(stop_id, parents):
+    '''Follow the parent_stations of a stop up to the top-level station.'''
+    chain = [stop_id]
+    while parents.get(chain[-1]):
+        parent = parents[chain[-1]]
+        if parent in chain:
+            # The parent_stations go around in a circle, so use the same stop
+            # for every stop in the circle.
+            return min(chain[chain.index(parent):])
+        chain.append(parent)
+    return chain[-1]
+
+
+def GroupStops(stops, tolerance=0):
+    '''Group a list of stops given as (stop_id, lat, lon, parent_station) by
+    their top-level parent station and, if tolerance is more than 0, group the
+    other stops by a grid of cells tolerance meters wide.  Returns a
+    dictionary of {representative stop_id: [stop_id, ...]} with an entry for
+    every stop, so stops that aren't grouped are their own representative.'''
+
+    locations = dict((stop[0], (stop[1], stop[2])) for stop in stops)
+    parents = dict((stop[0], stop[3]) for stop in stops if stop[3])
+    haschildren = set(parents.values())
+
+    if stops:
+        # Scale the longitudes so the grid cells are about square.
+        meanlat = sum([stop[1] for stop in stops]) / float(len(stops))
+        lonscale = math.cos(math.radians(meanlat))
+
+    groups = {} # {group key: [stop_id, ...]}
+    for stop_id, lat, lon, parent in stops:
+        if stop_id in parents or stop_id in haschildren:
+            key = ("station", FindRootStation(stop_id, parents))
+        elif tolerance > 0:
+            key = ("cell", int(math.floor(lat * MetersPerDegree / tolerance)),
+                   int(math.floor(lon * MetersPerDegree * lonscale / tolerance)))
+        else:
+            key = ("stop", stop_id)
+        groups.setdefault(key, []).append(stop_id)
+
+    stopgroups = {}
+    for key, members in groups.items():
+        if key[0] == "station" and key[1] in locations:
+            rep = key[1]
+        else:
+            # Use the member closest to the middle of the group.
+            midlat = sum([locations[stop_id][0] for stop_id in members]) / len(members)
+            midlon = sum([locations[stop_id][1] for stop_id in members]) / len(members)
+            rep = min(members, key=lambda stop_id: ((locations[stop_id][0] - midlat) ** 2 +
+                        ((locations[stop_id][1] - midlon) * lonscale) ** 2, stop_id))
+        stopgroups[rep] = members
+
+    return stopgroups
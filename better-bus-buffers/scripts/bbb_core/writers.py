@@ -0,0 +1,259 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Core - Output Writers
+## Last updated: 18 October 2026
+############################################################################
+''' This file writes BetterBusBuffers results without arcpy, for headless runs
+and very large outputs.  A writer takes one feature at a time - its id, its
+statistics, and optionally its location - and writes the features in large
+batches, so the memory used doesn't depend on the number of features.
+
+The output format is picked from the file extension:
+- .csv: CSV file with a header row
+- .geojsonl, .geojsons, or .jsonl: GeoJSON-lines, one GeoJSON Feature per line
+- .gpkg: GeoPackage, written with the sqlite3 module only.  All the features
+  are written in one transaction.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import sys, os, re, csv, json, struct, sqlite3
+
+# Number of features to write at once
+BatchSize = 10000
+
+# GeoPackage application_id ("GPKG") and version 1.2
+GPKGApplicationID = 0x47504B47
+GPKGVersion = 10200
+
+
+def OpenCSV(path, mode):
+    '''Open a CSV file the way the csv module wants it in this Python version.'''
+    if sys.version_info[0] < 3:
+        return open(path, mode + "b")
+    return open(path, mode, newline="")
+
+
+class StatsWriter(object):
+    '''Base class for the output writers.  fields is a list of (field name,
+    SQL type) for the statistics, where the SQL type is TEXT, INTEGER, or
+    REAL. Locations are given as (lat, lon) in WGS84 decimal degrees.'''
+
+    def __init__(self, path, idField, fields):
+        self.path = path
+        self.idField = idField
+        self.fields = fields
+        self.batch = []
+        self.NumWritten = 0
+
+    def Write(self, feature, values, location=None):
+        '''Add a feature with its statistics (a sequence in the same order as
+        fields) and location, or None if it has no location.'''
+        self.batch.append((feature, values, location))
+        if len(self.batch) >= BatchSize:
+            self.Flush()
+
+    def Flush(self):
+        '''Write the features added since the last batch.'''
+        if self.batch:
+            self.WriteBatch(self.batch)
+            self.NumWritten += len(self.batch)
+            self.batch = []
+
+    def WriteBatch(self, batch):
+        raise NotImplementedError
+
+    def Close(self):
+        '''Write the remaining features and close the output.'''
+        self.Flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+
+
+class CSVStatsWriter(StatsWriter):
+    '''Write the features to a CSV file.  Locations are written as lat and lon
+    columns if hasLocation is True.'''
+
+    def __init__(self, path, idField, fields, hasLocation=False):
+        StatsWriter.__init__(self, path, idField, fields)
+        self.hasLocation = hasLocation
+        self.f = OpenCSV(path, "w")
+        self.writer = csv.writer(self.f)
+        header = [idField] + [field[0] for field in fields]
+        if hasLocation:
+            header += ["lat", "lon"]
+        self.writer.writerow(header)
+
+    def WriteBatch(self, batch):
+        rows = []
+        for feature, values, location in batch:
+            row = [feature] + ["" if value is None else value for value in values]
+            if self.hasLocation:
+                row += list(location) if location else ["", ""]
+            rows.append(row)
+        self.writer.writerows(rows)
+
+    def Close(self):
+        StatsWriter.Close(self)
+        self.f.close()
+
+
+class GeoJSONLinesStatsWriter(StatsWriter):
+    '''Write the features to a GeoJSON-lines file, one Feature per line.'''
+
+    def __init__(self, path, idField, fields):
+        StatsWriter.__init__(self, path, idField, fields)
+        self.fieldnames = [field[0] for field in fields]
+        self.f = open(path, "w")
+
+    def WriteBatch(self, batch):
+        lines = []
+        for feature, values, location in batch:
+            properties = dict(zip(self.fieldnames, values))
+            properties[self.idField] = feature
+            geometry = None
+            if location:
+                geometry = {"type": "Point", "coordinates": [location[1], location[0]]}
+            lines.append(json.dumps({"type": "Feature", "id": feature,
+                                "geometry": geometry, "properties": properties}))
+        self.f.write("\n".join(lines) + "\n")
+
+    def Close(self):
+        StatsWriter.Close(self)
+        self.f.close()
+
+
+class GeoPackageStatsWriter(StatsWriter):
+    '''Write the features to a point table in a new GeoPackage, or to an
+    attribute table if hasLocation is False.  The table is named after the
+    file.  If the id field's name is already used by the fid or geom column
+    (SQLite column names aren't case-sensitive), it gets a _1 suffix.'''
+
+    def __init__(self, path, idField, fields, hasLocation=True):
+        StatsWriter.__init__(self, path, idField, fields)
+        self.hasLocation = hasLocation
+        self.idColumn = self.MakeIdColumnName()
+        self.table = re.sub(r"\W", "_", os.path.splitext(os.path.basename(path))[0])
+        self.extent = None # [min_x, min_y, max_x, max_y]
+        if os.path.exists(path):
+            os.remove(path)
+        self.conn = sqlite3.connect(path)
+        self.c = self.conn.cursor()
+        self.CreateTables()
+
+    def MakeIdColumnName(self):
+        '''Return a name for the id field's column that doesn't collide with
+        the other columns of the table.'''
+        usednames = set(["fid"] + [field[0].lower() for field in self.fields])
+        if self.hasLocation:
+            usednames.add("geom")
+        idColumn = self.idField
+        suffix = 1
+        while idColumn.lower() in usednames:
+            idColumn = "%s_%i" % (self.idField, suffix)
+            suffix += 1
+        return idColumn
+
+    def CreateTables(self):
+        '''Create the GeoPackage metadata tables and the output table.'''
+        c = self.c
+        c.execute("PRAGMA application_id = %i;" % GPKGApplicationID)
+        c.execute("PRAGMA user_version = %i;" % GPKGVersion)
+        c.execute('''CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, \
+srs_id INTEGER NOT NULL PRIMARY KEY, organization TEXT NOT NULL, \
+organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, \
+description TEXT);''')
+        c.executemany('''INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?);''', [
+            ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+            ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+            ("WGS 84 geodetic", 4326, "EPSG", 4326, 'GEOGCS["WGS 84",\
+DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],\
+AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],\
+UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]',
+                None)])
+        c.execute('''CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, \
+data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', \
+last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), \
+min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER, \
+CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));''')
+        c.execute('''CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, \
+column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, \
+z TINYINT NOT NULL, m TINYINT NOT NULL, \
+CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name), \
+CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name), \
+CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id));''')
+
+        columns = ["fid INTEGER PRIMARY KEY AUTOINCREMENT"]
+        if self.hasLocation:
+            columns.append("geom POINT")
+        columns.append('"%s" TEXT' % self.idColumn)
+        columns += ['"%s" %s' % field for field in self.fields]
+        c.execute('CREATE TABLE "%s" (%s);' % (self.table, ", ".join(columns)))
+        if self.hasLocation:
+            c.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) \
+VALUES (?, 'features', ?, 4326);", (self.table, self.table))
+            c.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', 'POINT', 4326, 0, 0);",
+                        (self.table,))
+        else:
+            c.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier) \
+VALUES (?, 'attributes', ?);", (self.table, self.table))
+
+        placeholders = ["?"] * (len(self.fields) + (2 if self.hasLocation else 1))
+        names = (["geom"] if self.hasLocation else []) + [self.idColumn] + \
+                    [field[0] for field in self.fields]
+        self.insert_stmt = 'INSERT INTO "%s" (%s) VALUES (%s);' % (self.table,
+                    ", ".join(['"%s"' % name for name in names]), ", ".join(placeholders))
+
+    def MakePoint(self, location):
+        '''Return a GeoPackage geometry blob for a point at (lat, lon), and
+        extend the extent of the table to include it.'''
+        lat, lon = location
+        if self.extent is None:
+            self.extent = [lon, lat, lon, lat]
+        else:
+            self.extent = [min(self.extent[0], lon), min(self.extent[1], lat),
+                           max(self.extent[2], lon), max(self.extent[3], lat)]
+        # GeoPackage header (magic, version 0, little-endian with no envelope,
+        # srs_id) followed by a little-endian WKB point
+        return sqlite3.Binary(struct.pack("<2sBBiBIdd", b"GP", 0, 1, 4326,
+                                          1, 1, lon, lat))
+
+    def WriteBatch(self, batch):
+        rows = []
+        for feature, values, location in batch:
+            row = [feature] + list(values)
+            if self.hasLocation:
+                row.insert(0, self.MakePoint(location) if location else None)
+            rows.append(row)
+        self.c.executemany(self.insert_stmt, rows)
+
+    def Close(self):
+        StatsWriter.Close(self)
+        if self.extent:
+            self.c.execute("UPDATE gpkg_contents SET min_x = ?, min_y = ?, \
+max_x = ?, max_y = ? WHERE table_name = ?;", self.extent + [self.table])
+        self.conn.commit()
+        self.conn.close()
+
+
+def OpenStatsWriter(path, idField, fields, hasLocation=False):
+    '''Return a writer for the output file, picked from its extension.'''
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".gpkg":
+        return GeoPackageStatsWriter(path, idField, fields, hasLocation)
+    if ext in [".geojsonl", ".geojsons", ".jsonl"]:
+        return GeoJSONLinesStatsWriter(path, idField, fields)
+    return CSVStatsWriter(path, idField, fields, hasLocation)
@@ -39,6 +39,7 @@ import sqlite3
 import sys
 
 import hms
+from bbb_core import sqltrace
 
 
 class CustomError(Exception):
@@ -46,7 +47,7 @@ class CustomError(Exception):
 
 Errors_To_Return = []
 
-csv_fnames = ["stops.txt", "calendar.txt", "stop_times.txt", "trips.txt", "routes.txt", "frequencies.txt"]
+csv_fnames = ["stops.txt", "calendar.txt", "calendar_dates.txt", "stop_times.txt", "trips.txt", "routes.txt", "frequencies.txt"]
 
 sql_types = {
         str :   "TEXT" ,
@@ -83,6 +84,11 @@ sql_schema = {
                 "start_date" :      (str, True) ,
                 "end_date" :        (str, True) ,
             } ,
+        "calendar_dates" : {
+                "service_id" :  (str, True) ,
+                "date" :      (str, True) ,
+                "exception_type" :         (int, True) ,
+            } ,
         "stop_times" : {
                 "trip_id" :     (str, True) ,
                 "arrival_time" :    (float, True) ,
@@ -126,10 +132,12 @@ sql_schema = {
 db = None
 
 
-def connect(dbname):
+def connect(dbname, trace=None):
+    '''Connect to the SQL database. The statements are traced if trace is True,
+    or by default if the GTFS_SQL_TRACE environment variable is set.'''
     global db
     if db == None:
-        db = sqlite3.connect(dbname)
+        db = sqltrace.connect(dbname, trace)
 
 
 def check_time_str(s):
@@ -336,7 +344,7 @@ def handle_file(fname, service_label):
     elif tablename == "frequencies":
         rows = smarter_convert_times(reader, columns, fname, service_label, ('start_time', 'end_time'))
     # Make sure date fields are in YYYYMMDD format
-    elif tablename == "calendar":
+    elif tablename in ["calendar", "calendar_dates"]:
         rows = check_date_fields(reader, columns, tablename, fname)
     # Make sure lat/lon values are valid
     elif tablename == "stops":
@@ -384,7 +392,8 @@ def handle_agency(gtfs_dir):
             if os.path.exists(fname2):
                 csvs_withPaths.append(fname2)
             else:
-                if fname not in ["frequencies.txt"]:
+                # These files aren't required
+                if fname not in ["calendar_dates.txt", "frequencies.txt"]:
                     missing_files.append(fname)
         if missing_files:
             Errors_To_Return.append("GTFS dataset %s is missing files required for \
@@ -419,6 +428,7 @@ def create_indices():
     cur.execute("CREATE INDEX stopTimes_index_tripIdsDep ON stop_times (trip_id, departure_time);")
     cur.execute("CREATE INDEX stopTimes_index_tripIdsArr ON stop_times (trip_id, arrival_time);")
     cur.execute("CREATE INDEX calendar_index_serviceIds ON calendar (service_id);")
+    cur.execute("CREATE INDEX calendardates_index_date ON calendar_dates (date);")
     db.commit()
     cur.close()
 
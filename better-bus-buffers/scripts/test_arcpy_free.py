@@ -0,0 +1,97 @@
+############################################################################
+## Tool name: BetterBusBuffers
+## Check that the compute modules don't import arcpy
+## Last updated: 18 October 2026
+############################################################################
+''' Importing arcpy takes several seconds and loads hundreds of MB, so the
+modules that only do SQL and statistics work import it lazily, if at all.
+This checks that importing bbb_core, BBB_SharedFunctions, and the sqlize_csv
+modules of BetterBusBuffers and add-GTFS-to-a-network-dataset never imports
+arcpy, whether or not arcpy is installed.
+
+Run it from this folder with python -m unittest test_arcpy_free.  The
+sqlize_csv modules are Python 2 code, so they're only checked under Python 2.'''
+################################################################################
+'''Copyright 2015 Esri
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.'''
+################################################################################
+
+import os, sys, subprocess, unittest
+
+ScriptsDir = os.path.dirname(os.path.abspath(__file__))
+AddGTFSScriptsDir = os.path.join(os.path.dirname(os.path.dirname(ScriptsDir)),
+                        "add-GTFS-to-a-network-dataset", "scripts")
+
+# Run in a fresh interpreter, so no module imported by the test runner counts.
+# The finder records every attempt to import arcpy, including ones that are
+# caught because arcpy isn't installed.
+CheckScript = '''
+import sys
+attempts = []
+class ArcpyFinder(object):
+    def find_module(self, name, path=None):
+        if name.split(".")[0] == "arcpy":
+            attempts.append(name)
+        return None
+    def find_spec(self, name, path=None, target=None):
+        return self.find_module(name, path)
+sys.meta_path.insert(0, ArcpyFinder())
+for module in sys.argv[1:]:
+    __import__(module)
+    if attempts or "arcpy" in sys.modules:
+        print(module)
+        break
+'''
+
+
+def FindArcpyImports(folder, modules):
+    '''Import the modules in order in a new Python process with folder first
+    on the path. Returns the module whose import imported arcpy, or an empty
+    string.'''
+    process = subprocess.Popen([sys.executable, "-c", CheckScript] + modules,
+                    cwd=folder, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise AssertionError("Importing %s failed:\n%s" % (", ".join(modules),
+                                stderr.decode("utf-8", "replace")))
+    return stdout.decode("utf-8").strip()
+
+
+def GetCoreModules():
+    '''Return the names of the bbb_core modules. __main__ is left out, because
+    importing it runs the command line tool.'''
+    modules = ["bbb_core"]
+    for filename in sorted(os.listdir(os.path.join(ScriptsDir, "bbb_core"))):
+        name, ext = os.path.splitext(filename)
+        if ext == ".py" and name not in ("__init__", "__main__"):
+            modules.append("bbb_core." + name)
+    return modules
+
+
+class TestComputeModulesDontImportArcpy(unittest.TestCase):
+
+    def test_bbb_core(self):
+        self.assertEqual(FindArcpyImports(ScriptsDir, GetCoreModules()), "")
+
+    def test_shared_functions(self):
+        self.assertEqual(FindArcpyImports(ScriptsDir, ["BBB_SharedFunctions"]), "")
+
+    @unittest.skipIf(sys.version_info[0] > 2, "sqlize_csv is Python 2 code")
+    def test_sqlize_csv(self):
+        self.assertEqual(FindArcpyImports(ScriptsDir, ["sqlize_csv"]), "")
+
+    @unittest.skipIf(sys.version_info[0] > 2, "sqlize_csv is Python 2 code")
+    def test_add_gtfs_sqlize_csv(self):
+        self.assertEqual(FindArcpyImports(AddGTFSScriptsDir, ["sqlize_csv"]), "")
+
+
+if __name__ == '__main__':
+    unittest.main()